@@ -1,4 +1,7 @@
 from .comments import comments_router  # noqa: F401
+from .content import router as content_router  # noqa: F401
 from .documents import documents_router  # noqa: F401
 from .drive import router as drive_router  # noqa: F401
+from .jobs import router as jobs_router  # noqa: F401
+from .metrics import router as metrics_router  # noqa: F401
 from .spreadsheets import router as spreadsheets_router  # noqa: F401
@@ -1,36 +1,165 @@
-from fastapi import APIRouter, Body, Depends, HTTPException
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
 from googleapiclient.errors import HttpError
 
-from google_services import get_drive_service
+from cache import TTLCache
+from config import settings
+from executor import execute, execute_shared, http_exception
+from google_services import get_drive_service, get_user_id
 
 from .models import CommentRequest, ReplyRequest
 
 router = APIRouter()
 
+# Largest pageSize comments().list accepts
+COMMENT_PAGE_SIZE = 100
+REPLY_FIELDS = "id,createdTime,modifiedTime,author,content,htmlContent,deleted,action"
+COMMENT_FIELDS = (
+    "id,createdTime,modifiedTime,author,content,htmlContent,deleted,resolved,"
+    f"anchor,quotedFileContent,replies({REPLY_FIELDS})"
+)
+
+
+class FileComments:
+    """
+    A file's comments by id as last seen, deleted ones kept (with
+    "deleted": true) so listings since a time can report them.
+    """
+
+    __slots__ = ("comments", "cursor", "refreshed")
+
+    def __init__(self):
+        self.comments: Dict[str, dict] = {}
+        # Latest modifiedTime Google listed, where the next delta starts
+        self.cursor: Optional[str] = None
+        self.refreshed = 0.0
+
+    def put(self, comment: dict) -> None:
+        """Keeps comment unless the one held was modified after it."""
+        held = self.comments.get(comment["id"])
+        modified = comment.get("modifiedTime", "")
+        if held is None or modified >= held.get("modifiedTime", ""):
+            self.comments[comment["id"]] = comment
+
+    def listed(self, comments: List[dict]) -> None:
+        """Takes in comments listed by Google."""
+        for comment in comments:
+            self.put(comment)
+            modified = comment.get("modifiedTime")
+            if modified and (self.cursor is None or modified > self.cursor):
+                self.cursor = modified
+
+    def listing(self, since: Optional[datetime]) -> List[dict]:
+        if since is None:
+            return [c for c in self.comments.values() if not c.get("deleted")]
+        return [
+            c
+            for c in self.comments.values()
+            if _timestamp(c.get("modifiedTime")) >= since
+        ]
+
+
+# (user id, file id) -> FileComments, reseeded COMMENT_CACHE_TTL seconds
+# after their first listing
+_comments = TTLCache(settings.COMMENT_CACHE_SIZE, settings.COMMENT_CACHE_TTL)
+
+
+def _timestamp(value: Optional[str]) -> datetime:
+    """An RFC 3339 time, as UTC when it names no offset."""
+    if value is None:
+        return datetime.min.replace(tzinfo=timezone.utc)
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _now() -> str:
+    """The current time as Google writes modifiedTime."""
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds")[:-6] + "Z"
+
+
+async def _list_all(drive_service, file_id: str, since: Optional[str]) -> List[dict]:
+    """
+    Every page of the file's comments, or of those modified since; deleted
+    ones included, so listings since a time before the seed report them.
+    """
+    query = {"fileId": file_id, "pageSize": COMMENT_PAGE_SIZE, "includeDeleted": True}
+    if since is not None:
+        query["startModifiedTime"] = since
+    comments, page_token = [], None
+    while True:
+        # Built per page rather than with list_next(), since execute_shared()
+        # swaps the postproc of the request it sends
+        response = await execute_shared(
+            drive_service.comments().list(
+                **query,
+                pageToken=page_token,
+                fields=f"nextPageToken,comments({COMMENT_FIELDS})",
+            )
+        )
+        comments.extend(response.get("comments", []))
+        page_token = response.get("nextPageToken")
+        if page_token is None:
+            return comments
+
 
 @router.get("/drive/{file_id}/comment")
-async def list_comments(file_id: str, drive_service=Depends(get_drive_service)):
+async def list_comments(
+    file_id: str,
+    since: Optional[str] = Query(
+        None,
+        description="RFC 3339 time; only comments modified at or after it,"
+        " deleted ones included",
+    ),
+    drive_service=Depends(get_drive_service),
+    user_id: str = Depends(get_user_id),
+):
     """
-    List all comments for a file.
+    List all comments for a file, with their replies.
+
+    The first listing of a file fetches every page, COMMENT_PAGE_SIZE
+    comments at a time and deleted ones included, and keeps the comments in
+    memory for the user.
+    Later listings are answered from there; once COMMENT_REFRESH_INTERVAL
+    seconds have passed, one of them first asks Google for the comments
+    modified since the latest modifiedTime held (startModifiedTime), which
+    is usually a single small call. Comments added, replied to, resolved or
+    deleted through this API are updated in place. The file is listed in
+    full again COMMENT_CACHE_TTL seconds after its first listing.
+
+    With since, only the comments created, edited, replied to, resolved or
+    deleted from then on are listed, so a poller passing the latest
+    modifiedTime it has seen only receives what changed; deleted comments
+    come with "deleted": true so they can be dropped.
 
     Example input request:
-        GET /drive/1a-28yTY23NuCa7vmyMABGgRDCErW58Q99F_2o9ZePGo/comment
+        GET /drive/1a-28yTY23NuCa7vmyMABGgRDCErW58Q99F_2o9ZePGo/comment?since=2024-05-01T10:00:00.000Z
 
     Google API request sent:
-        drive_service.comments().list(fileId=file_id, fields="comments(id,createdTime,modifiedTime,author,content,htmlContent,deleted,resolved,anchor,quotedFileContent)")
+        drive_service.comments().list(fileId=file_id, pageSize=100, startModifiedTime=cursor, includeDeleted=True, fields="nextPageToken,comments(id,createdTime,modifiedTime,author,content,htmlContent,deleted,resolved,anchor,quotedFileContent,replies(...))")
+        and again with pageToken=nextPageToken until there is none
     """
     try:
-        comments = (
-            drive_service.comments()
-            .list(
-                fileId=file_id,
-                fields="comments(id,createdTime,modifiedTime,author,content,htmlContent,deleted,resolved,anchor,quotedFileContent)",
-            )
-            .execute()
-        )
-        return comments
+        after = None if since is None else _timestamp(since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid since: {since}")
+    try:
+        key = (user_id, file_id)
+        held = _comments.get(key)
+        started = time.monotonic()
+        if held is None:
+            held = FileComments()
+            held.listed(await _list_all(drive_service, file_id, None))
+            held.refreshed = started
+            _comments.set(key, held)
+        elif started - held.refreshed >= settings.COMMENT_REFRESH_INTERVAL:
+            held.listed(await _list_all(drive_service, file_id, held.cursor))
+            held.refreshed = max(held.refreshed, started)
+        return {"comments": held.listing(after)}
     except HttpError as e:
-        raise HTTPException(status_code=e.resp.status, detail=str(e))
+        raise http_exception(e)
 
 
 @router.get("/drive/{file_id}/comment/{comment_id}")
@@ -47,18 +176,16 @@ async def get_comment(
         drive_service.comments().get(fileId=file_id, commentId=comment_id, fields="id,createdTime,modifiedTime,author,content,htmlContent,deleted,resolved,anchor,quotedFileContent")
     """
     try:
-        comment = (
-            drive_service.comments()
-            .get(
+        comment = await execute(
+            drive_service.comments().get(
                 fileId=file_id,
                 commentId=comment_id,
                 fields="id,createdTime,modifiedTime,author,content,htmlContent,deleted,resolved,anchor,quotedFileContent",
             )
-            .execute()
         )
         return comment
     except HttpError as e:
-        raise HTTPException(status_code=e.resp.status, detail=str(e))
+        raise http_exception(e)
 
 
 @router.post("/drive/{file_id}/comment")
@@ -66,6 +193,7 @@ async def add_comment(
     file_id: str,
     req: CommentRequest = Body(...),
     drive_service=Depends(get_drive_service),
+    user_id: str = Depends(get_user_id),
 ):
     """
     Create a new comment on a file.
@@ -90,23 +218,27 @@ async def add_comment(
             # Pass through the anchor string without validation
             comment_body["anchor"] = req.anchor
 
-        comment = (
-            drive_service.comments()
-            .create(
+        comment = await execute(
+            drive_service.comments().create(
                 fileId=file_id,
                 body=comment_body,
-                fields="id,createdTime,modifiedTime,author,content,htmlContent,deleted,resolved,anchor,quotedFileContent",
+                fields=COMMENT_FIELDS,
             )
-            .execute()
         )
+        held = _comments.get((user_id, file_id))
+        if held is not None:
+            held.put(comment)
         return comment
     except HttpError as e:
-        raise HTTPException(status_code=e.resp.status, detail=str(e))
+        raise http_exception(e)
 
 
 @router.delete("/drive/{file_id}/comment/{comment_id}")
 async def delete_comment(
-    file_id: str, comment_id: str, drive_service=Depends(get_drive_service)
+    file_id: str,
+    comment_id: str,
+    drive_service=Depends(get_drive_service),
+    user_id: str = Depends(get_user_id),
 ):
     """
     Delete a comment from a file.
@@ -121,10 +253,16 @@ async def delete_comment(
         )
     """
     try:
-        drive_service.comments().delete(fileId=file_id, commentId=comment_id).execute()
+        await execute(
+            drive_service.comments().delete(fileId=file_id, commentId=comment_id)
+        )
+        held = _comments.get((user_id, file_id))
+        comment = None if held is None else held.comments.get(comment_id)
+        if comment is not None:
+            held.put(dict(comment, deleted=True, modifiedTime=_now()))
         return {"message": f"Comment {comment_id} deleted successfully"}
     except HttpError as e:
-        raise HTTPException(status_code=e.resp.status, detail=str(e))
+        raise http_exception(e)
 
 
 @router.post("/drive/{file_id}/comment/{comment_id}/reply")
@@ -133,6 +271,7 @@ async def add_reply(
     comment_id: str,
     req: ReplyRequest = Body(...),
     drive_service=Depends(get_drive_service),
+    user_id: str = Depends(get_user_id),
 ):
     """
     Add a reply to a comment.
@@ -149,19 +288,39 @@ async def add_reply(
         )
     """
     try:
-        reply = (
-            drive_service.replies()
-            .create(fileId=file_id, commentId=comment_id, body={"content": req.content})
-            .execute()
+        reply = await execute(
+            drive_service.replies().create(
+                fileId=file_id,
+                commentId=comment_id,
+                body={"content": req.content},
+                fields=REPLY_FIELDS,
+            )
         )
+        held = _comments.get((user_id, file_id))
+        comment = None if held is None else held.comments.get(comment_id)
+        if comment is not None:
+            # A reply also changes the modifiedTime of its comment
+            modified = max(
+                comment.get("modifiedTime", ""), reply.get("modifiedTime", "")
+            )
+            held.put(
+                dict(
+                    comment,
+                    replies=comment.get("replies", []) + [reply],
+                    modifiedTime=modified,
+                )
+            )
         return reply
     except HttpError as e:
-        raise HTTPException(status_code=e.resp.status, detail=str(e))
+        raise http_exception(e)
 
 
 @router.post("/drive/{file_id}/comment/{comment_id}/resolve")
 async def resolve_comment(
-    file_id: str, comment_id: str, drive_service=Depends(get_drive_service)
+    file_id: str,
+    comment_id: str,
+    drive_service=Depends(get_drive_service),
+    user_id: str = Depends(get_user_id),
 ):
     """
     Resolve a comment (mark it as resolved).
@@ -177,11 +336,17 @@ async def resolve_comment(
         )
     """
     try:
-        comment = (
-            drive_service.comments()
-            .update(fileId=file_id, commentId=comment_id, body={"resolved": True})
-            .execute()
+        comment = await execute(
+            drive_service.comments().update(
+                fileId=file_id,
+                commentId=comment_id,
+                body={"resolved": True},
+                fields=COMMENT_FIELDS,
+            )
         )
+        held = _comments.get((user_id, file_id))
+        if held is not None:
+            held.put(comment)
         return comment
     except HttpError as e:
-        raise HTTPException(status_code=e.resp.status, detail=str(e))
+        raise http_exception(e)
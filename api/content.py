@@ -0,0 +1,430 @@
+import asyncio
+import logging
+import random
+import re
+import time
+from typing import AsyncIterator, List, Optional, Tuple
+
+import httplib2
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseDownload, MediaUpload
+from pydantic import BaseModel
+from pydantic.fields import Field
+
+from api.drive import invalidate_created
+from config import settings
+from executor import execute, execute_raw, execute_shared, http_exception
+from google_services import get_drive_service, get_user_id
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+GOOGLE_APPS_MIME_TYPE = "application/vnd.google-apps."
+RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+# Resumable upload chunks must be multiples of this, except the last one
+UPLOAD_CHUNK_UNIT = 256 * 2**10
+
+
+class UploadResult(BaseModel):
+    id: str
+    name: str
+    mimeType: str
+    parent_id: Optional[str] = Field(None, description="Parent ID of the file")
+    size: int = Field(..., description="Bytes uploaded")
+    seconds: float = Field(..., description="Time the upload took")
+    bytes_per_second: float
+    retries: int = Field(..., description="Chunks resumed after transient errors")
+
+
+class _Chunks:
+    """Where MediaIoBaseDownload writes to: keeps what arrived, uncopied."""
+
+    def __init__(self):
+        self.received: List[bytes] = []
+
+    def write(self, data: bytes) -> None:
+        self.received.append(data)
+
+    def pop(self) -> bytes:
+        data = b"".join(self.received)
+        self.received.clear()
+        return data
+
+
+class _NextChunk:
+    """
+    One next_chunk() call of a MediaIoBaseDownload (GET) or a resumable
+    upload HttpRequest (PUT), in the shape execute() runs.
+    """
+
+    def __init__(self, transfer, method: str):
+        self.transfer = transfer
+        self.method = method
+        # Calls after a failed one, which first ask Google what it has
+        self.resumed = 0
+
+    def execute(self):
+        if getattr(self.transfer, "_in_error_state", False):
+            self.resumed += 1
+        return self.transfer.next_chunk()
+
+
+class _BodyUpload(MediaUpload):
+    """
+    Resumable upload of a request body of unknown length, read as it is
+    needed. Only bytes Google has not acknowledged yet are held, so after an
+    error the upload resumes from the last byte Google has, and memory use
+    stays at about three chunks whatever the size of the body.
+    """
+
+    def __init__(self, body: AsyncIterator[bytes], mimetype: str, chunksize: int):
+        super().__init__()
+        self._body = body
+        self._mimetype = mimetype
+        self._chunksize = chunksize
+        # Body messages not acknowledged yet, as they were received
+        self._held: List[bytes] = []
+        # Offset in the body of the first byte held
+        self._offset = 0
+        self.read = 0
+        self.complete = False
+        # getbytes() runs in the thread sending the chunk, and reads on this
+        self._loop = asyncio.get_running_loop()
+        self._reading = asyncio.Lock()
+
+    def chunksize(self) -> int:
+        return self._chunksize
+
+    def mimetype(self) -> str:
+        return self._mimetype
+
+    def size(self) -> None:
+        return None
+
+    def resumable(self) -> bool:
+        return True
+
+    def has_stream(self) -> bool:
+        return False
+
+    def getbytes(self, begin: int, length: int) -> bytes:
+        # When execute() retries a chunk Google took part of, the retry can
+        # need bytes not read yet. A short read tells next_chunk() this is the
+        # last chunk, so only give one at the end of the body.
+        if not self.complete and self.read < begin + length:
+            asyncio.run_coroutine_threadsafe(
+                self.read_until(begin + length), self._loop
+            ).result()
+        parts = []
+        start, end = begin - self._offset, begin - self._offset + length
+        for part in list(self._held):
+            if start < len(part) and end > 0:
+                parts.append(memoryview(part)[max(start, 0) : end])
+            start, end = start - len(part), end - len(part)
+        return b"".join(parts)
+
+    async def read_until(self, end: int) -> None:
+        """Reads the body until it is held up to offset end, or all read."""
+        async with self._reading:
+            while not self.complete and self.read < end:
+                try:
+                    data = await anext(self._body)
+                except StopAsyncIteration:
+                    self.complete = True
+                    return
+                self._held.append(data)
+                self.read += len(data)
+
+    def acknowledged(self, offset: int) -> None:
+        """Lets go of the bytes before offset, which Google has."""
+        while self._held and self._offset + len(self._held[0]) <= offset:
+            self._offset += len(self._held.pop(0))
+        if self._held:
+            self._held[0] = self._held[0][offset - self._offset :]
+            self._offset = offset
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    The first and last byte a Range header asks for, or None for the whole
+    file. Headers with several ranges, of another unit or invalid are
+    ignored, which HTTP allows; a range starting past the end raises 416.
+    """
+    match = RANGE.fullmatch(header.strip()) if header else None
+    if match is None or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first and last and int(last) < int(first):
+        return None
+    if first == "":
+        # The last n bytes
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Range Not Satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end
+
+
+async def _chunks(
+    request, start: int = 0, end: Optional[int] = None
+) -> AsyncIterator[bytes]:
+    """
+    Downloads a media request DOWNLOAD_CHUNK_SIZE bytes at a time from byte
+    start to end (inclusive, or to the end of the media), yielding each
+    chunk once it has arrived. Each chunk is a Google call of its own,
+    scheduled and retried like any other.
+    """
+    received = _Chunks()
+    downloader = MediaIoBaseDownload(
+        received, request, chunksize=settings.DOWNLOAD_CHUNK_SIZE
+    )
+    # MediaIoBaseDownload always starts at 0 and asks for whole chunks
+    downloader._progress = start
+    done = False
+    while not done:
+        if end is not None:
+            downloader._chunksize = min(
+                settings.DOWNLOAD_CHUNK_SIZE, end + 1 - downloader._progress
+            )
+        status, done = await execute(_NextChunk(downloader, "GET"))
+        done = done or (end is not None and status.resumable_progress > end)
+        yield received.pop()
+
+
+async def _stream(chunks: AsyncIterator[bytes], media_type: str, **kwargs):
+    """
+    Streams downloaded chunks as the response. The first chunk is fetched
+    before the response starts, so errors from it are still regular HTTP
+    error responses.
+    """
+    try:
+        first = await anext(chunks, b"")
+    except HttpError as e:
+        raise http_exception(e)
+
+    async def body():
+        nonlocal first
+        yield first
+        first = b""
+        async for chunk in chunks:
+            yield chunk
+
+    return StreamingResponse(body(), media_type=media_type, **kwargs)
+
+
+# GET /drive/{file_id}/content: Download the content of a file
+@router.get("/drive/{file_id}/content")
+async def download_content(
+    file_id: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    drive_service=Depends(get_drive_service),
+) -> Response:
+    """
+    Download the content of a (non Google Workspace) file.
+
+    Content is streamed DOWNLOAD_CHUNK_SIZE bytes at a time, so memory use
+    does not grow with the size of the file. A Range header for one byte
+    range is passed through to Google and answered with 206.
+
+    Example input request:
+        GET /drive/1R3rJWb50oW2JNOqKd4l0XlP-9hdMPr1c9cxjYX3PWnY/content
+        Range: bytes=0-1023
+
+    Google API requests sent:
+        drive_service.files().get(fileId=file_id, fields="mimeType, size")
+        drive_service.files().get_media(fileId=file_id), one per chunk
+    """
+    try:
+        metadata = await execute_shared(
+            drive_service.files().get(fileId=file_id, fields="mimeType, size")
+        )
+    except HttpError as e:
+        raise http_exception(e)
+    mime_type = metadata.get("mimeType", "application/octet-stream")
+    if mime_type.startswith(GOOGLE_APPS_MIME_TYPE):
+        raise HTTPException(
+            status_code=400,
+            detail=f"{mime_type} files have no content to download,"
+            f" export them with /drive/{file_id}/export?mimeType=",
+        )
+    size = int(metadata.get("size", 0))
+    byte_range = parse_range(range_header, size)
+    headers = {"Accept-Ranges": "bytes"}
+    if byte_range is not None:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end + 1 - start)
+        chunks = _chunks(drive_service.files().get_media(fileId=file_id), start, end)
+        return await _stream(chunks, mime_type, status_code=206, headers=headers)
+    headers["Content-Length"] = str(size)
+    if size == 0:
+        return Response(media_type=mime_type, headers=headers)
+    chunks = _chunks(drive_service.files().get_media(fileId=file_id))
+    return await _stream(chunks, mime_type, headers=headers)
+
+
+# GET /drive/{file_id}/export: Export a Google Workspace file
+@router.get("/drive/{file_id}/export")
+async def export_content(
+    file_id: str,
+    mimeType: str = Query(
+        ..., description="Format to export to, e.g. application/pdf or text/csv"
+    ),
+    drive_service=Depends(get_drive_service),
+) -> Response:
+    """
+    Export a Google Docs, Sheets or Slides file to another format.
+
+    Google renders exports on request and ignores Range for them, so the
+    export arrives in one response and is returned as is; Drive caps
+    exports at 10 MB, which bounds the memory this takes. Range headers
+    are not supported here.
+
+    Example input request:
+        GET /drive/1R3rJWb50oW2JNOqKd4l0XlP-9hdMPr1c9cxjYX3PWnY/export?mimeType=application/pdf
+
+    Google API request sent:
+        drive_service.files().export_media(fileId=file_id, mimeType=mimeType)
+    """
+    try:
+        content = await execute_raw(
+            drive_service.files().export_media(fileId=file_id, mimeType=mimeType)
+        )
+    except HttpError as e:
+        raise http_exception(e)
+    return Response(content=content, media_type=mimeType)
+
+
+async def _upload(create, upload: _BodyUpload) -> Tuple[dict, int]:
+    """
+    Sends a resumable upload chunk by chunk, reading the next chunk of the
+    body while the current one is sent. Returns the created file and how
+    many chunks were resumed after an error.
+
+    execute() retries the 5xx and rate-limit errors of a chunk; connection
+    errors are retried here, up to GOOGLE_MAX_RETRIES times in a row. Either
+    way next_chunk() then asks Google which bytes it has and goes on from
+    there.
+    """
+    chunksize = upload.chunksize()
+    next_chunk = _NextChunk(create, "PUT")
+    failures = 0
+    response = None
+    while response is None:
+        await upload.read_until(create.resumable_progress + chunksize)
+        # Never cancelled, a body message read halfway would be lost
+        read_ahead = asyncio.create_task(
+            upload.read_until(create.resumable_progress + 2 * chunksize)
+        )
+        try:
+            _, response = await execute(next_chunk)
+            failures = 0
+        except (OSError, httplib2.HttpLib2Error) as e:
+            failures += 1
+            if failures > settings.GOOGLE_MAX_RETRIES:
+                raise
+            logger.warning(
+                "Upload chunk at %d failed, resuming: %s", create.resumable_progress, e
+            )
+            backoff = min(
+                settings.GOOGLE_BACKOFF_MAX,
+                settings.GOOGLE_BACKOFF_BASE * 2 ** (failures - 1),
+            )
+            await asyncio.sleep(random.uniform(0, backoff))
+        finally:
+            await read_ahead
+        upload.acknowledged(create.resumable_progress)
+    return response, next_chunk.resumed
+
+
+# POST /drive/upload: Upload a file of any type and size
+@router.post("/drive/upload", response_model=UploadResult)
+async def upload_file(
+    request: Request,
+    name: str = Query(..., description="Name of the new file"),
+    parent: Optional[str] = Query(None, description="Optional parent folder id"),
+    mimeType: Optional[str] = Query(
+        None, description="Type of the content, by default its Content-Type"
+    ),
+    chunkSize: Optional[int] = Query(
+        None,
+        ge=UPLOAD_CHUNK_UNIT,
+        description="Bytes sent to Google per call, a multiple of 262144",
+    ),
+    drive_service=Depends(get_drive_service),
+    user_id: str = Depends(get_user_id),
+) -> UploadResult:
+    """
+    Upload the request body as a new file, streaming it into a Google
+    resumable upload session.
+
+    The body is read while it is uploaded, UPLOAD_CHUNK_SIZE (or chunkSize)
+    bytes per Google call, and never held whole, so files of any size can be
+    uploaded in little memory. Transient errors resume the upload from the
+    last byte Google acknowledged.
+
+    Example input request:
+        POST /drive/upload?name=video.mp4&parent=1xa0a3Z4YUfDZ3FQS4LrpdOZEkVp8hrq7
+        Content-Type: video/mp4
+        <file content>
+
+    Example response:
+        {"id": "1Ab...", "name": "video.mp4", "mimeType": "video/mp4",
+         "parent_id": "1xa0a3Z4YUfDZ3FQS4LrpdOZEkVp8hrq7", "size": 1073741824,
+         "seconds": 21.4, "bytes_per_second": 50174843.6, "retries": 0}
+
+    Google API requests sent:
+        drive_service.files().create(body=metadata, media_body=upload),
+        one PUT per chunk
+    """
+    chunksize = chunkSize or settings.UPLOAD_CHUNK_SIZE
+    if chunksize % UPLOAD_CHUNK_UNIT:
+        raise HTTPException(
+            status_code=400,
+            detail=f"chunkSize must be a multiple of {UPLOAD_CHUNK_UNIT}",
+        )
+    mime_type = (
+        mimeType or request.headers.get("content-type") or "application/octet-stream"
+    )
+    metadata = {"name": name}
+    if parent:
+        metadata["parents"] = [parent]
+    upload = _BodyUpload(request.stream(), mime_type, chunksize)
+    create = drive_service.files().create(
+        body=metadata,
+        media_body=upload,
+        fields="id, name, mimeType, parents",
+    )
+    started = time.perf_counter()
+    try:
+        item, retries = await _upload(create, upload)
+    except HttpError as e:
+        raise http_exception(e)
+    invalidate_created(user_id, parent or "root", name)
+    seconds = time.perf_counter() - started
+    logger.info(
+        "Uploaded %d bytes in %.1fs (%.1f MB/s, %d retries)",
+        upload.read,
+        seconds,
+        upload.read / seconds / 2**20,
+        retries,
+    )
+    return UploadResult(
+        id=item["id"],
+        name=item.get("name", name),
+        mimeType=item.get("mimeType", mime_type),
+        parent_id=item.get("parents", [None])[0],
+        size=upload.read,
+        seconds=seconds,
+        bytes_per_second=upload.read / seconds if seconds else 0.0,
+        retries=retries,
+    )
@@ -1,12 +1,117 @@
-from typing import Optional
+import hashlib
+import json
+import re
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query, Response
+from googleapiclient.errors import HttpError
+from pydantic import TypeAdapter, create_model
 
 from api.documents.models import Document
-from google_services import get_docs_service, get_drive_service
+from api.documents.persistence import pack, persist_requests
+from api.drive import invalidate_created, invalidate_folder
+from cache import SizedLRUCache, TTLCache
+from config import settings
+from executor import execute, execute_raw, execute_shared, http_exception, run
+from google_services import get_docs_service, get_drive_service, get_user_id
+from jobs import progress
 
 router = APIRouter()
 
+# Document with every field optional, for payloads trimmed by a field mask or
+# carrying their content in tabs instead of the body
+PartialDocument = create_model(
+    "PartialDocument",
+    __base__=Document,
+    **{
+        name: (Optional[field.annotation], None)
+        for name, field in Document.model_fields.items()
+    },
+)
+
+_document_adapter = TypeAdapter(Document)
+_partial_document_adapter = TypeAdapter(PartialDocument)
+
+# Rendered response bodies keyed by (document id, revision id, variant). The
+# variant names the user, as what the Docs API returns depends on their access
+# (e.g. suggestions are only inline for editors).
+_documents = SizedLRUCache(settings.DOCUMENT_CACHE_BYTES)
+# (document id, user id) -> (Drive version, revision id) last seen for them
+_revisions = TTLCache(
+    settings.DOCUMENT_REVISION_CACHE_SIZE, settings.DOCUMENT_REVISION_CACHE_TTL
+)
+
+# revisionId is a top-level field only, so the first match is the document's
+REVISION_ID = re.compile(rb'"revisionId"\s*:\s*"([^"]+)"')
+
+
+def select_tabs(tabs: List[dict], tab_ids: set) -> List[dict]:
+    """Keeps the selected tabs; selected tabs nested in dropped ones move up."""
+    selected = []
+    for tab in tabs:
+        tab_id = tab.get("tabProperties", {}).get("tabId", tab.get("tabId"))
+        if tab_id in tab_ids:
+            selected.append(tab)
+        else:
+            selected.extend(select_tabs(tab.get("childTabs", []), tab_ids))
+    return selected
+
+
+def revision_of(content: bytes) -> Optional[str]:
+    """Reads revisionId from a raw payload without parsing all of it."""
+    match = REVISION_ID.search(content)
+    return match.group(1).decode() if match else None
+
+
+def make_etag(revision_id: str, variant: tuple) -> str:
+    digest = hashlib.sha1(repr(variant).encode()).hexdigest()[:12]
+    return f'"{revision_id}-{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags
+
+
+def cached_document_response(body: bytes, etag: str, if_none_match: Optional[str]):
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
+def forget_document(document_id: str) -> None:
+    _revisions.discard_where(lambda key, _: key[0] == document_id)
+    _documents.discard_where(lambda key, _: key[0] == document_id)
+
+
+def document_response(
+    content: bytes, partial: bool = False, tab_ids: Optional[List[str]] = None
+) -> Response:
+    """
+    Turns a raw Docs API document payload into the response.
+
+    The payload is validated against Document once and serialized by
+    pydantic-core straight to bytes; returning a Response skips FastAPI's
+    response_model pass. Partial payloads are validated against
+    PartialDocument and only the fields they contain are returned.
+
+    With VALIDATE_DOCUMENTS off the upstream bytes are returned unchanged,
+    and are only parsed when tabs have to be selected.
+    """
+    if not settings.VALIDATE_DOCUMENTS and not tab_ids:
+        return Response(content=content, media_type="application/json")
+    data = json.loads(content)
+    if tab_ids:
+        data["tabs"] = select_tabs(data.get("tabs", []), set(tab_ids))
+    if not settings.VALIDATE_DOCUMENTS:
+        return Response(content=json.dumps(data), media_type="application/json")
+    adapter = _partial_document_adapter if partial else _document_adapter
+    document = adapter.validate_python(data)
+    content = adapter.dump_json(document, exclude_unset=partial)
+    return Response(content=content, media_type="application/json")
+
 
 # POST /drive/documents?parent=&title=: Create new empty document, with optional parent id parameter
 @router.post("/drive/documents", response_model=Document)
@@ -15,6 +120,7 @@ async def create_document(
     title: str = Query(..., description="Document title"),
     docs_service=Depends(get_docs_service),
     drive_service=Depends(get_drive_service),
+    user_id: str = Depends(get_user_id),
 ):
     """
     Create a new empty document with an optional parent folder.
@@ -28,44 +134,238 @@ async def create_document(
     """
     try:
         # Create the document
-        document_data = docs_service.documents().create(body={"title": title}).execute()
+        content = await execute_raw(
+            docs_service.documents().create(body={"title": title})
+        )
 
         # If parent is specified, move the document to that folder
         if parent:
-            file_id = document_data["documentId"]
-            drive_service.files().update(
-                fileId=file_id, addParents=parent, fields="id, name, parents"
-            ).execute()
+            file_id = json.loads(content)["documentId"]
+            await execute(
+                drive_service.files().update(
+                    fileId=file_id, addParents=parent, fields="id, name, parents"
+                )
+            )
+        invalidate_created(user_id, parent or "root", title)
 
-        # Convert to Document model
-        return Document(**document_data)
+        return document_response(content)
+    except HTTPException:
+        raise
+    except HttpError as e:
+        raise http_exception(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # GET /drive/documents/{document_id}: Return a specific document by id
 @router.get("/drive/documents/{document_id}", response_model=Document)
-async def get_document(document_id: str, docs_service=Depends(get_docs_service)):
+async def get_document(
+    document_id: str,
+    fields: Optional[str] = Query(
+        None, description="Docs API field mask, e.g. title,revisionId"
+    ),
+    includeTabsContent: bool = Query(
+        False, description="Return the content of every tab in tabs"
+    ),
+    tabs: Optional[List[str]] = Query(
+        None, description="Only return these tab IDs, implies includeTabsContent"
+    ),
+    if_none_match: Optional[str] = Header(None),
+    docs_service=Depends(get_docs_service),
+    drive_service=Depends(get_drive_service),
+    user_id: str = Depends(get_user_id),
+):
     """
     Get a document by its ID.
 
+    Only the parts of the document named by the fields mask are fetched and
+    returned, so the response size and parse time follow what was asked for.
+
+    Responses carry an ETag derived from the document's revisionId and are
+    cached per revision and user, since the Docs API answers according to
+    the user's access. Each request first asks Drive for the file version;
+    while it is unchanged the cached body is returned, or 304 Not Modified
+    when If-None-Match already names it, without fetching the document.
+
     Example input request:
-        GET /drive/documents/1a-28yTY23NuCa7vmyMABGgRDCErW58Q99F_2o9ZePGo
+        GET /drive/documents/1a-28yTY23NuCa7vmyMABGgRDCErW58Q99F_2o9ZePGo?fields=title,revisionId
+        GET /drive/documents/1a-28yTY23NuCa7vmyMABGgRDCErW58Q99F_2o9ZePGo?tabs=t.0
 
     Google API request sent:
-        docs_service.documents().get(documentId=document_id)
+        drive_service.files().get(fileId=document_id, fields="version,modifiedTime")
+        docs_service.documents().get(
+            documentId=document_id,
+            fields="title,revisionId",
+            includeTabsContent=True,
+        )
     """
     try:
-        document_data = docs_service.documents().get(documentId=document_id).execute()
-        # Convert to Document model
-        return Document(**document_data)
+        params = {}
+        if fields:
+            params["fields"] = fields
+        if includeTabsContent or tabs:
+            params["includeTabsContent"] = True
+        variant = (
+            user_id,
+            fields,
+            bool(params),
+            tuple(tabs or ()),
+            settings.VALIDATE_DOCUMENTS,
+        )
+
+        metadata = await execute_shared(
+            drive_service.files().get(fileId=document_id, fields="version,modifiedTime")
+        )
+        version = metadata.get("version")
+        known = _revisions.get((document_id, user_id))
+        revision_id = known[1] if known and known[0] == version else None
+        if revision_id:
+            etag = make_etag(revision_id, variant)
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers={"ETag": etag})
+            body = _documents.get((document_id, revision_id, variant))
+            if body is not None:
+                return cached_document_response(body, etag, if_none_match)
+
+        content = await execute_raw(
+            docs_service.documents().get(documentId=document_id, **params),
+            shared=True,
+        )
+        response = document_response(content, partial=bool(params), tab_ids=tabs)
+        # Payloads trimmed by a mask without revisionId are only cached once
+        # the revision of this version is known from another request
+        revision_id = revision_of(content) or revision_id
+        if not revision_id:
+            return response
+        _revisions.set((document_id, user_id), (version, revision_id))
+        _documents.set(
+            (document_id, revision_id, variant), response.body, len(response.body)
+        )
+        return cached_document_response(
+            response.body, make_etag(revision_id, variant), if_none_match
+        )
+    except HTTPException:
+        raise
+    except HttpError as e:
+        raise http_exception(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# PUT /drive/documents/{document_id}: Persist a document as the changes it needs
+@router.put("/drive/documents/{document_id}")
+async def persist_document(
+    document_id: str,
+    document: Document = Body(..., description="The document as it should be"),
+    docs_service=Depends(get_docs_service),
+):
+    """
+    Persist a document by applying only what differs from its current
+    revision.
+
+    The body of the current revision is diffed against the body of the
+    payload, paragraph by paragraph and then character by character where
+    they differ, and the differences are sent as one atomic batchUpdate of
+    deleteContentRange / insertText edits and text and paragraph style
+    updates. Unchanged content, and the comments anchored to it, is left
+    alone, and the work done follows the size of the change. Nothing is sent
+    when the bodies are the same.
+
+    Stretches rewritten rather than edited, such as the whole body of a new
+    document, are sent as one insert of their text; touching style updates
+    are collapsed into one setting the most common style, followed only by
+    those asking for another. Requests beyond DOCS_BATCH_UPDATE_BYTES go in
+    several batchUpdate calls, each pinned to the revision the previous one
+    produced; such a persist is only atomic per call. As a job
+    (POST /jobs/drive/documents/{id}), its progress counts those calls.
+
+    A payload carrying a revisionId must have been read at the current
+    revision, else 409 is returned; in any case the update only applies to
+    the revision the diff was made against. Tables, inline objects and
+    bullets can be kept or removed but not added (422), and a payload
+    without body.content, such as one read with a field mask, is refused
+    with 422 as well.
+
+    Example input request:
+        PUT /drive/documents/1a-28yTY23NuCa7vmyMABGgRDCErW58Q99F_2o9ZePGo
+        {"documentId": "1a-28yTY23NuCa7vmyMABGgRDCErW58Q99F_2o9ZePGo",
+         "title": "MyDocument",
+         "body": {"content": [{"paragraph": {"elements": [
+             {"textRun": {"content": "Hello\\n", "textStyle": {}}}]}}]}}
+
+    Google API request sent:
+        docs_service.documents().get(documentId=document_id, fields="revisionId,body")
+        docs_service.documents().batchUpdate(
+            documentId=document_id,
+            body={
+                "requests": [{"insertText": {...}}, ...],
+                "writeControl": {"requiredRevisionId": revision_id},
+            },
+        )
+    """
+    body = getattr(document, "body", None)
+    if body is None or getattr(body, "content", None) is None:
+        raise HTTPException(
+            status_code=422,
+            detail="Only the body is persisted, so the document needs body.content",
+        )
+    try:
+        current = json.loads(
+            await execute_raw(
+                docs_service.documents().get(
+                    documentId=document_id, fields="revisionId,body"
+                )
+            )
+        )
+        revision_id = current.get("revisionId")
+        if document.revisionId and document.revisionId != revision_id:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Document {document_id} changed since revision"
+                f" {document.revisionId}",
+            )
+        # Body content is kept as plain dicts, so needs no dumping
+        target = {"body": {"content": body.content}}
+        requests = persist_requests(current, target)
+        batches = pack(requests, settings.DOCS_BATCH_UPDATE_BYTES)
+        progress(0, len(batches))
+        for done, batch in enumerate(batches, 1):
+            # Building the call encodes the requests, off the event loop
+            update = await run(
+                docs_service.documents().batchUpdate,
+                documentId=document_id,
+                body={
+                    "requests": batch,
+                    "writeControl": {"requiredRevisionId": revision_id},
+                },
+            )
+            result = await execute(update)
+            revision_id = result.get("writeControl", {}).get(
+                "requiredRevisionId", revision_id
+            )
+            progress(done, len(batches))
+            forget_document(document_id)
+        return {
+            "documentId": document_id,
+            "revisionId": revision_id,
+            "requests": len(requests),
+            "calls": len(batches),
+        }
+    except HTTPException:
+        raise
+    except HttpError as e:
+        raise http_exception(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # DELETE /drive/documents/{document_id}: Delete document by id
 @router.delete("/drive/documents/{document_id}")
-async def delete_document(document_id: str, drive_service=Depends(get_drive_service)):
+async def delete_document(
+    document_id: str,
+    drive_service=Depends(get_drive_service),
+    user_id: str = Depends(get_user_id),
+):
     """
     Delete a document by its ID.
 
@@ -76,7 +376,13 @@ async def delete_document(document_id: str, drive_service=Depends(get_drive_serv
         drive_service.files().delete(fileId=document_id)
     """
     try:
-        drive_service.files().delete(fileId=document_id).execute()
+        await execute(drive_service.files().delete(fileId=document_id))
+        forget_document(document_id)
+        invalidate_folder(user_id, document_id)
         return {"message": f"Document {document_id} deleted successfully"}
+    except HTTPException:
+        raise
+    except HttpError as e:
+        raise http_exception(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -711,9 +711,9 @@ class DocumentStyle(BaseModel):
     pageOrientation: Optional[PageOrientation] = Field(
         None, description="Page orientation"
     )
-    headerIds: Optional[List[str]] = Field(None, description="Header IDs")
-    footerIds: Optional[List[str]] = Field(None, description="Footer IDs")
-    footnoteIds: Optional[List[str]] = Field(None, description="Footnote IDs")
+    headerIds: Optional[list[str]] = Field(None, description="Header IDs")
+    footerIds: Optional[list[str]] = Field(None, description="Footer IDs")
+    footnoteIds: Optional[list[str]] = Field(None, description="Footnote IDs")
 
 
 class NamedRanges(BaseModel):
@@ -755,8 +755,17 @@ class StructuralElement(BaseModel):
 class Tab(BaseModel):
     """Represents a tab in the document."""
 
-    tabId: str = Field(..., description="The ID of the tab")
-    title: str = Field(..., description="The title of the tab")
+    tabProperties: Optional[Dict[str, Any]] = Field(
+        None, description="Properties of the tab, like ID and title"
+    )
+    childTabs: Optional[list["Tab"]] = Field(
+        None, description="Child tabs nested within this tab"
+    )
+    documentTab: Optional[Dict[str, Any]] = Field(
+        None, description="The document contents of the tab"
+    )
+    tabId: Optional[str] = Field(None, description="The ID of the tab")
+    title: Optional[str] = Field(None, description="The title of the tab")
     body: Optional[Dict[str, Any]] = Field(
         None, description="The body content of the tab"
     )
@@ -811,7 +820,7 @@ class Document(BaseModel):
 
     documentId: str = Field(..., description="The ID of the document")
     title: str = Field(..., description="The title of the document")
-    tabs: Optional[List[Tab]] = Field(None, description="Tabs in the document")
+    tabs: Optional[list[Tab]] = Field(None, description="Tabs in the document")
     revisionId: Optional[str] = Field(None, description="Revision ID")
     suggestionsViewMode: Optional[SuggestionsViewMode] = Field(
         None, description="Suggestions view mode"
@@ -0,0 +1,574 @@
+"""
+Turns the current revision of a document into a target one with the
+fewest Docs API requests: a diff over the structural elements of the body,
+then over the characters of the elements that changed, emitted as
+deleteContentRange / insertText edits and the updateTextStyle /
+updateParagraphStyle requests the new text needs.
+
+Paragraph text, text styles and paragraph styles can change freely.
+Tables, section breaks, tables of contents and inline objects can be kept
+or removed but not added, and bullets can be kept or removed but not
+created: a target that needs any of that is rejected with 422.
+"""
+
+import difflib
+import json
+from itertools import repeat
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+# Paragraph style fields the Docs API returns but does not accept
+READ_ONLY_PARAGRAPH_STYLE = ("headingId",)
+# Stands for an element other than text in the outline of a paragraph
+OBJECT = "\ufffc"
+# Edits of a paragraph fewer characters apart than this are sent as one,
+# which re-inserts the text between them but saves three requests
+EDIT_GAP = 8
+# Stretches whose character counts multiply to more than this are not
+# diffed per character but replaced as a whole: one insert of their text
+# and a style update per run of equally styled text
+DIFF_LIMIT = 2**22
+
+
+def _utf16_length(text: str) -> int:
+    """Docs API indices count UTF-16 code units."""
+    return len(text) if text.isascii() else len(text.encode("utf-16-le")) // 2
+
+
+def _without_indices(value):
+    if isinstance(value, dict):
+        return {
+            k: _without_indices(v)
+            for k, v in value.items()
+            if k not in ("startIndex", "endIndex")
+        }
+    if isinstance(value, list):
+        return [_without_indices(v) for v in value]
+    return value
+
+
+def _key(value) -> str:
+    return json.dumps(_without_indices(value), sort_keys=True)
+
+
+def _paragraph_style(paragraph: dict) -> dict:
+    """The paragraph style without the fields the Docs API sets itself."""
+    style = paragraph.get("paragraphStyle", {})
+    if not style.keys().isdisjoint(READ_ONLY_PARAGRAPH_STYLE):
+        style = dict(style)
+        for name in READ_ONLY_PARAGRAPH_STYLE:
+            style.pop(name, None)
+    return style
+
+
+def _outline(element: dict) -> str:
+    """
+    A cheap stand-in for a structural element to align bodies by: the text
+    of a paragraph, or the kind of another element.
+    """
+    paragraph = element.get("paragraph")
+    if paragraph is None:
+        return next((k for k in element if not k.endswith("Index")), "")
+    return "".join(
+        part["textRun"].get("content", "") if "textRun" in part else OBJECT
+        for part in paragraph.get("elements", [])
+    )
+
+
+def _same(old: dict, new: dict) -> bool:
+    """Whether two structural elements differ at most in their indices."""
+    a, b = old.get("paragraph"), new.get("paragraph")
+    if a is None or b is None:
+        return a is b and _without_indices(old) == _without_indices(new)
+    parts_a, parts_b = a.get("elements", []), b.get("elements", [])
+    if len(parts_a) != len(parts_b) or a.get("bullet") != b.get("bullet"):
+        return False
+    for x, y in zip(parts_a, parts_b):
+        run_x, run_y = x.get("textRun"), y.get("textRun")
+        if run_x is None or run_y is None:
+            if run_x is not run_y or _without_indices(x) != _without_indices(y):
+                return False
+        elif run_x.get("content") != run_y.get("content") or run_x.get(
+            "textStyle", {}
+        ) != run_y.get("textStyle", {}):
+            return False
+    return _paragraph_style(a) == _paragraph_style(b)
+
+
+class _Unit:
+    """A paragraph or another structural element of a body."""
+
+    __slots__ = ("paragraph", "parts", "length", "key")
+
+    def __init__(self, element: dict, lengths: Dict[str, int]):
+        self.paragraph = element.get("paragraph")
+        if self.paragraph is None:
+            self.key = _key(element)
+            self.length = _element_length(element, self.key, lengths)
+            return
+        # (text, text style) per run, (None, key, length) per other element
+        self.parts, self.length = [], 0
+        for part in self.paragraph.get("elements", []):
+            run = part.get("textRun")
+            if run is not None:
+                content = run.get("content", "")
+                self.parts.append((content, run.get("textStyle", {})))
+                self.length += _utf16_length(content)
+            else:
+                key = _key(part)
+                length = _element_length(part, key, lengths)
+                self.parts.append((None, key, length))
+                self.length += length
+
+    def style(self) -> dict:
+        return _paragraph_style(self.paragraph)
+
+    def bullet(self) -> Optional[dict]:
+        return self.paragraph.get("bullet")
+
+
+class _Atoms:
+    """
+    Units as columns of key, text style, length and unit per character or
+    element; a paragraph's last atom is its newline.
+    """
+
+    __slots__ = ("keys", "styles", "lengths", "units")
+
+    def __init__(self, units: List[_Unit]):
+        self.keys: list = []
+        self.styles: List[Optional[dict]] = []
+        self.lengths: List[int] = []
+        self.units: List[_Unit] = []
+        for unit in units:
+            if unit.paragraph is None:
+                self._extend([("element", unit.key)], None, [unit.length], unit)
+                continue
+            for text, style, *length in unit.parts:
+                if text is None:
+                    self._extend([("element", style)], None, length, unit)
+                elif text.isascii():
+                    self._extend(text, style, repeat(1, len(text)), unit)
+                else:
+                    lengths = (2 if ord(c) > 0xFFFF else 1 for c in text)
+                    self._extend(text, style, lengths, unit)
+
+    def _extend(self, keys, style, lengths, unit: _Unit) -> None:
+        count = len(self.keys)
+        self.keys.extend(keys)
+        count = len(self.keys) - count
+        self.styles.extend(repeat(style, count))
+        self.lengths.extend(lengths)
+        self.units.extend(repeat(unit, count))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+def _element_length(element: dict, key: str, lengths: Dict[str, int]) -> int:
+    """Current elements have indices; target ones get those of their twin."""
+    if "endIndex" in element:
+        length = element["endIndex"] - element.get("startIndex", 0)
+        lengths.setdefault(key, length)
+        return length
+    if key not in lengths:
+        kind = next((k for k in element if k != "textStyle"), "element")
+        raise HTTPException(
+            status_code=422,
+            detail=f"A {kind} can be kept or removed but not added by persisting",
+        )
+    return lengths[key]
+
+
+def _edits(old: list, new: list) -> List[Tuple[int, int, int, int]]:
+    """
+    (old start, old end, new start, new end) of the differing stretches of
+    two sequences, common ends trimmed first so only the middle is matched.
+    """
+    end = min(len(old), len(new))
+    suffix = 0
+    while suffix < end and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+    prefix = 0
+    while prefix < end - suffix and old[prefix] == new[prefix]:
+        prefix += 1
+    if prefix + suffix == min(len(old), len(new)):
+        # One is the other with a stretch added or removed
+        if len(old) == len(new):
+            return []
+        return [(prefix, len(old) - suffix, prefix, len(new) - suffix)]
+    matcher = difflib.SequenceMatcher(
+        None, old[prefix : len(old) - suffix], new[prefix : len(new) - suffix], False
+    )
+    return [
+        (i1 + prefix, i2 + prefix, j1 + prefix, j2 + prefix)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+
+class _Plan:
+    """The requests of a persist, gathered region by region."""
+
+    def __init__(self):
+        # (old start, old end, text) in the current document
+        self.text: List[Tuple[int, int, str]] = []
+        # (start, end, text style), (start, end, paragraph style) and
+        # (start, end) of paragraphs losing their bullets, in the target
+        # document; touching spans that ask for the same are merged
+        self.styles: List[Tuple[int, int, dict]] = []
+        self.paragraph_styles: List[Tuple[int, int, dict]] = []
+        self.unbulleted: List[Tuple[int, int, None]] = []
+
+    @staticmethod
+    def _extend(spans: list, start: int, end: int, value) -> None:
+        if spans and spans[-1][1] == start and spans[-1][2] == value:
+            spans[-1] = (spans[-1][0], end, value)
+        else:
+            spans.append((start, end, value))
+
+    @staticmethod
+    def _layered(spans: list) -> list:
+        """
+        The spans to apply, in order, for the same outcome: where touching
+        spans form a chain, its most common value is set across all of it
+        first and only the spans asking for something else follow.
+        """
+        layered = []
+        chain_start = 0
+        for k in range(1, len(spans) + 1):
+            if k < len(spans) and spans[k][0] == spans[k - 1][1]:
+                continue
+            chain = spans[chain_start:k]
+            chain_start = k
+            counts: Dict[str, int] = {}
+            for span in chain:
+                value = _key(span[2])
+                counts[value] = counts.get(value, 0) + 1
+            base = max(counts, key=counts.get)
+            if counts[base] < 2:
+                layered.extend(chain)
+                continue
+            value = next(span[2] for span in chain if _key(span[2]) == base)
+            layered.append((chain[0][0], chain[-1][1], value))
+            layered.extend(span for span in chain if _key(span[2]) != base)
+        return layered
+
+    def restyle(self, start: int, end: int, style: dict) -> None:
+        self._extend(self.styles, start, end, style)
+
+    def restyle_paragraph(self, start: int, end: int, style: dict) -> None:
+        self._extend(self.paragraph_styles, start, end, style)
+
+    def unbullet(self, start: int, end: int) -> None:
+        self._extend(self.unbulleted, start, end, None)
+
+    def requests(self) -> List[dict]:
+        requests = []
+        for start, end, text in sorted(self.text, reverse=True):
+            if end > start:
+                requests.append(
+                    {
+                        "deleteContentRange": {
+                            "range": {"startIndex": start, "endIndex": end}
+                        }
+                    }
+                )
+            if text:
+                requests.append(
+                    {"insertText": {"location": {"index": start}, "text": text}}
+                )
+        for start, end, style in self._layered(self.paragraph_styles):
+            requests.append(
+                {
+                    "updateParagraphStyle": {
+                        "range": {"startIndex": start, "endIndex": end},
+                        "paragraphStyle": style,
+                        "fields": "*",
+                    }
+                }
+            )
+        for start, end, _ in self.unbulleted:
+            requests.append(
+                {
+                    "deleteParagraphBullets": {
+                        "range": {"startIndex": start, "endIndex": end}
+                    }
+                }
+            )
+        for start, end, style in self._layered(self.styles):
+            requests.append(
+                {
+                    "updateTextStyle": {
+                        "range": {"startIndex": start, "endIndex": end},
+                        "textStyle": style,
+                        "fields": "*",
+                    }
+                }
+            )
+        return requests
+
+
+def _persist_region(
+    plan: _Plan,
+    old: _Atoms,
+    new: _Atoms,
+    old_start: int,
+    new_start: int,
+    following: Optional[_Unit],
+) -> None:
+    """
+    Plans one stretch of differing units: the character edits, then the
+    styles of the text and paragraphs the target has there. following is
+    the current paragraph after the stretch, which text inserted at its end
+    joins.
+    """
+    old_positions = [old_start]
+    for length in old.lengths:
+        old_positions.append(old_positions[-1] + length)
+    edits: List[tuple] = []
+    if len(old) * len(new) > DIFF_LIMIT:
+        # Rewritten rather than edited: one edit keeping only the newline
+        # both stretches end with
+        keep = int(old.keys[-1] == new.keys[-1] == "\n")
+        differences = [(0, len(old) - keep, 0, len(new) - keep)]
+    else:
+        differences = _edits(old.keys, new.keys)
+    for edit in differences:
+        if edits and edit[0] - edits[-1][1] < EDIT_GAP:
+            gap = old.keys[edits[-1][1] : edit[0]]
+            if all(isinstance(key, str) and key != "\n" for key in gap):
+                edits[-1] = (edits[-1][0], edit[1], edits[-1][2], edit[3])
+                continue
+        edits.append(edit)
+
+    # Where each target atom came from: the current atom kept, or the edit
+    # inserting it
+    kept_from: List[Optional[int]] = []
+    inserted_by: List[Optional[tuple]] = []
+    deleted = [False] * len(old)
+    i = j = 0
+    for edit in edits + [(len(old), len(old), len(new), None)]:
+        i1, i2, j1, j2 = edit
+        kept_from.extend(range(i, i + j1 - j))
+        inserted_by.extend(repeat(None, j1 - j))
+        if j2 is None:
+            break
+        keys = new.keys[j1:j2]
+        if not all(isinstance(key, str) for key in keys):
+            raise HTTPException(
+                status_code=422,
+                detail="Elements other than text can be kept or removed"
+                " but not added by persisting",
+            )
+        plan.text.append((old_positions[i1], old_positions[i2], "".join(keys)))
+        kept_from.extend(repeat(None, j2 - j1))
+        inserted_by.extend(repeat(edit, j2 - j1))
+        deleted[i1:i2] = repeat(True, i2 - i1)
+        i, j = i2, j2
+    # Edits deleting newlines merge paragraphs into the one holding the
+    # text after them
+    ends = {edit[3]: edit for edit in edits}
+    # The paragraph each current atom (or following) stays in, and the
+    # distinct paragraphs whose newlines each edit deletes
+    staying: List[Optional[_Unit]] = [following] * (len(old) + 1)
+    for k in range(len(old) - 1, -1, -1):
+        kept_newline = old.keys[k] == "\n" and not deleted[k]
+        staying[k] = old.units[k] if kept_newline else staying[k + 1]
+    merged: Dict[tuple, List[_Unit]] = {}
+    for edit in edits:
+        distinct = {}
+        for k in range(edit[0], edit[1]):
+            if old.keys[k] == "\n":
+                unit = old.units[k]
+                distinct.setdefault(_key((unit.style(), unit.bullet())), unit)
+        merged[edit] = list(distinct.values())
+
+    position = new_start
+    paragraph_start, touched = new_start, set()
+    # The text style span being gathered, atom by atom of the same run
+    restyled: list = []
+    for j, (key, style, length, unit) in enumerate(
+        zip(new.keys, new.styles, new.lengths, new.units)
+    ):
+        kept, edit = kept_from[j], inserted_by[j]
+        if j in ends:
+            touched.add(ends[j])
+        if edit is not None:
+            touched.add(edit)
+        if edit is not None or style is not None and old.styles[kept] != style:
+            if restyled and restyled[1] == position and restyled[2] is style:
+                restyled[1] = position + length
+            else:
+                if restyled:
+                    plan.restyle(*restyled)
+                restyled = [position, position + length, style]
+        position += length
+        if key != "\n":
+            if unit.paragraph is None:
+                paragraph_start, touched = position, set()
+            continue
+        # The paragraph ends here: what it will be after the edits is the
+        # current paragraph of this newline, or of where it was inserted,
+        # merged with those whose newlines the edits inside it delete
+        anchor = old.units[kept] if edit is None else staying[edit[1]]
+        candidates = [anchor] + [unit for e in touched for unit in merged[e]]
+        _restyle_paragraph(plan, unit, candidates, paragraph_start, position)
+        paragraph_start, touched = position, set()
+    if restyled:
+        plan.restyle(*restyled)
+
+
+def _restyle_paragraph(
+    plan: _Plan, target: _Unit, candidates: List[Optional[_Unit]], start: int, end: int
+) -> None:
+    """Plans the paragraph style and bullet of a target paragraph."""
+    style = target.style()
+    if any(c is None or c.style() != style for c in candidates):
+        plan.restyle_paragraph(start, end, style)
+    bullet = target.bullet()
+    if all(c is not None and c.bullet() == bullet for c in candidates):
+        return
+    if bullet is not None:
+        raise HTTPException(
+            status_code=422,
+            detail="Bullets can be kept or removed but not added by persisting",
+        )
+    plan.unbullet(start, end)
+
+
+def _regions(old: List[dict], new: List[dict]) -> List[List[int]]:
+    """
+    [old start, old end, new start, new end] of the stretches of structural
+    elements that differ, aligned by outline and then compared in full.
+    """
+    regions = []
+    matcher = difflib.SequenceMatcher(
+        None, list(map(_outline, old)), list(map(_outline, new)), False
+    )
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            regions.append([i1, i2, j1, j2])
+            continue
+        for k in range(i2 - i1):
+            if not _same(old[i1 + k], new[j1 + k]):
+                regions.append([i1 + k, i1 + k + 1, j1 + k, j1 + k + 1])
+
+    moved: List[List[int]] = []
+    for i1, i2, j1, j2 in regions:
+        if (i1 == i2 or j1 == j2) and i1 > 0 and "paragraph" in old[i1 - 1]:
+            # Text cannot be inserted where an element like a table starts,
+            # nor after the newline ending the body, which cannot be deleted
+            # either: such edits move to the newline ahead of them
+            if i2 == len(old) or (i1 == i2 and "paragraph" not in old[i1]):
+                i1, j1 = i1 - 1, j1 - 1
+        if moved and moved[-1][1] >= i1:
+            moved[-1][1], moved[-1][3] = i2, j2
+        else:
+            moved.append([i1, i2, j1, j2])
+    return moved
+
+
+def persist_requests(current: dict, target: dict) -> List[dict]:
+    """
+    The Docs API requests turning the body of the current document into the
+    body of the target, in the order batchUpdate must apply them. Empty when
+    the bodies are the same.
+
+    Elements the bodies share at either end are only compared, and those
+    in between only aligned, so the work done follows the size of the change
+    more than that of the document.
+    """
+    old_content = current.get("body", {}).get("content", [])
+    content = target.get("body", {}).get("content", [])
+    if old_content and "sectionBreak" in old_content[0]:
+        if not content or "sectionBreak" not in content[0]:
+            # Hand-written bodies may leave out the section break starting
+            # every body
+            content = [old_content[0]] + content
+    if not content or "paragraph" not in content[-1]:
+        raise HTTPException(
+            status_code=422, detail="The body must end with a paragraph"
+        )
+    for element in content:
+        if "paragraph" not in element:
+            continue
+        parts = element["paragraph"].get("elements") or [{}]
+        if not parts[-1].get("textRun", {}).get("content", "").endswith("\n"):
+            raise HTTPException(
+                status_code=422, detail="Every paragraph must end with a newline"
+            )
+
+    end = min(len(old_content), len(content))
+    suffix = 0
+    while suffix < end and _same(old_content[-1 - suffix], content[-1 - suffix]):
+        suffix += 1
+    prefix = 0
+    while prefix < end - suffix and _same(old_content[prefix], content[prefix]):
+        prefix += 1
+    if prefix == len(old_content) == len(content):
+        return []
+    # One shared element stays on either side, for edits to move onto
+    first = max(prefix - 1, 0)
+    old = old_content[first : min(len(old_content) - suffix + 1, len(old_content))]
+    new = content[first : min(len(content) - suffix + 1, len(content))]
+
+    plan = _Plan()
+    lengths: Dict[str, int] = {}
+    # How far the target has moved from the current document so far
+    shift = 0
+    for i1, i2, j1, j2 in _regions(old, new):
+        old_units = [_Unit(element, lengths) for element in old[i1:i2]]
+        new_units = [_Unit(element, lengths) for element in new[j1:j2]]
+        following = None
+        if i2 < len(old) and "paragraph" in old[i2]:
+            following = _Unit(old[i2], lengths)
+        start = old[i1].get("startIndex", 0) if i1 < len(old) else old[-1]["endIndex"]
+        _persist_region(
+            plan,
+            _Atoms(old_units),
+            _Atoms(new_units),
+            start,
+            start + shift,
+            following,
+        )
+        shift += sum(u.length for u in new_units) - sum(u.length for u in old_units)
+    return plan.requests()
+
+
+def _pieces(request: dict, size: int, limit: int) -> List[Tuple[dict, int]]:
+    """
+    A request with the size of its JSON encoding, or an insert larger than
+    limit as inserts of consecutive pieces of its text.
+    """
+    if size <= limit or "insertText" not in request:
+        return [(request, size)]
+    text = request["insertText"]["text"]
+    index = request["insertText"]["location"]["index"]
+    # Escaped, a character takes at most twelve bytes
+    step = max((limit - 100) // 12, 1)
+    pieces = []
+    for offset in range(0, len(text), step):
+        piece = text[offset : offset + step]
+        part = {"insertText": {"location": {"index": index}, "text": piece}}
+        pieces.append((part, len(json.dumps(part))))
+        index += _utf16_length(piece)
+    return pieces
+
+
+def pack(requests: List[dict], limit: int) -> List[List[dict]]:
+    """
+    Splits requests, in order, into as few batches as keep the JSON encoding
+    of each within about limit bytes.
+    """
+    batches: List[List[dict]] = [[]]
+    size = 0
+    for request in requests:
+        for part, part_size in _pieces(request, len(json.dumps(request)), limit):
+            if batches[-1] and size + part_size > limit:
+                batches.append([])
+                size = 0
+            batches[-1].append(part)
+            size += part_size + 1
+    return batches if batches[0] else []
@@ -1,14 +1,40 @@
-from typing import List, Optional
+import asyncio
+import logging
+from functools import partial
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
 from googleapiclient.errors import HttpError
 from pydantic import BaseModel
 from pydantic.fields import Field
 
-from google_services import get_drive_service
+from cache import TTLCache
+from config import settings
+from drive_index import drive_index, drive_sync
+from executor import bulk, execute, http_exception, is_rate_limited
+from google_services import get_drive_service, get_user_id
+from jobs import progress
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+# Largest pageSize files().list accepts
+MAX_PAGE_SIZE = 1000
+FILE_LIST_FIELDS = "nextPageToken, files(id, name, mimeType, parents)"
+# Sub-requests Drive accepts in one batch request
+BATCH_SIZE = 100
+# Marks page tokens of responses answered from the Drive index
+INDEX_PAGE_TOKEN = "index:"
+
+# (user id, parent folder id, folder name) -> folder id
+_folder_ids = TTLCache(settings.FOLDER_CACHE_SIZE, settings.FOLDER_CACHE_TTL)
+# (user id, file id) -> (name, first parent id); the parent is None for roots
+# and for folders the user cannot see
+_ancestors = TTLCache(settings.ANCESTOR_CACHE_SIZE, settings.ANCESTOR_CACHE_TTL)
+
 
 class DriveObject(BaseModel):
     id: str
@@ -18,6 +44,16 @@ class DriveObject(BaseModel):
     parent_id: Optional[str] = Field(None, description="Parent ID of the file")
 
 
+class BatchDeleteRequest(BaseModel):
+    ids: List[str] = Field(..., description="IDs of the objects to delete")
+
+
+class BatchDeleteResult(BaseModel):
+    id: str
+    status: int = Field(..., description="HTTP status of the delete, 204 on success")
+    error: Optional[str] = Field(None, description="Error message if it failed")
+
+
 def build_drive_object(item: dict, parent_path: str = "") -> DriveObject:
     """Builds a DriveObject from Google Drive API item."""
     return DriveObject(
@@ -31,77 +67,736 @@ def build_drive_object(item: dict, parent_path: str = "") -> DriveObject:
     )
 
 
+def remember_ancestor(user_id: str, item: dict) -> None:
+    """Caches a folder's name and parent so paths below it resolve locally."""
+    if item.get("mimeType") == FOLDER_MIME_TYPE:
+        parent_id = item.get("parents", [None])[0]
+        _ancestors.set((user_id, item["id"]), (item.get("name"), parent_id))
+
+
+def _unknown_ancestors(user_id: str, items: List[dict]) -> set:
+    """Returns the first folder id above each item that is not cached yet."""
+    unknown = set()
+    for item in items:
+        folder_id = item.get("parents", [None])[0]
+        seen = set()
+        while folder_id is not None and folder_id not in seen:
+            seen.add(folder_id)
+            entry = _ancestors.get((user_id, folder_id))
+            if entry is None:
+                unknown.add(folder_id)
+                break
+            folder_id = entry[1]
+    return unknown
+
+
+async def _fetch_ancestors(drive_service, user_id: str, folder_ids: List[str]) -> set:
+    """
+    Caches the given folders, and returns the ids whose lookup failed other
+    than by the folder being out of the user's reach.
+    """
+    results: Dict[str, tuple] = {}
+    failed = set()
+
+    def callback(request_id, response, exception):
+        if exception is None:
+            results[request_id] = (
+                response.get("name"),
+                response.get("parents", [None])[0],
+            )
+        elif (
+            isinstance(exception, HttpError)
+            and exception.resp.status in (403, 404)
+            and not is_rate_limited(exception)
+        ):
+            # A folder the user cannot see: paths stop below it
+            results[request_id] = (None, None)
+        else:
+            failed.add(request_id)
+
+    batch = drive_service.new_batch_http_request(callback=callback)
+    for folder_id in folder_ids:
+        batch.add(
+            drive_service.files().get(fileId=folder_id, fields="id, name, parents"),
+            request_id=folder_id,
+        )
+    await execute(batch)
+    for folder_id, entry in results.items():
+        _ancestors.set((user_id, folder_id), entry)
+    return failed
+
+
+async def resolve_paths(drive_service, user_id: str, items: List[dict]) -> None:
+    """
+    Makes sure every folder above the given items is in the ancestor cache.
+
+    Unknown folders are fetched one level at a time, all of a level's unique
+    ids together in batched files().get requests, so a page of results costs
+    at most one round of batches per level of depth rather than a call per
+    item and level. A lookup failing for another reason than the folder
+    being out of reach is retried once; if it fails again, paths through
+    that folder stop below it for this request, and nothing is cached.
+    """
+    unknown = _unknown_ancestors(user_id, items)
+    retried, given_up = set(), set()
+    while unknown:
+        ids = sorted(unknown)
+        chunks = [ids[i : i + BATCH_SIZE] for i in range(0, len(ids), BATCH_SIZE)]
+        failures = await asyncio.gather(
+            *(_fetch_ancestors(drive_service, user_id, chunk) for chunk in chunks)
+        )
+        for folder_id in set().union(*failures):
+            if folder_id in retried:
+                given_up.add(folder_id)
+            retried.add(folder_id)
+        unknown = (
+            _unknown_ancestors(user_id, [{"parents": [folder_id]} for folder_id in ids])
+            - given_up
+        )
+
+
+def cached_parent_path(user_id: str, item: dict) -> str:
+    """Builds the path of an item's parent folder from the ancestor cache."""
+    names = []
+    folder_id = item.get("parents", [None])[0]
+    seen = set()
+    while folder_id is not None and folder_id not in seen:
+        seen.add(folder_id)
+        entry = _ancestors.get((user_id, folder_id))
+        if entry is None or entry[1] is None:
+            # My Drive, a shared drive or a folder the user cannot see
+            break
+        names.append(entry[0])
+        folder_id = entry[1]
+    return "".join(f"/{name}" for name in reversed(names))
+
+
+async def resolve_drive_objects(
+    drive_service, user_id: str, items: List[dict]
+) -> List[DriveObject]:
+    """Builds DriveObjects with full paths for items from anywhere in Drive."""
+    for item in items:
+        remember_ancestor(user_id, item)
+    await resolve_paths(drive_service, user_id, items)
+    return [
+        build_drive_object(item, cached_parent_path(user_id, item)) for item in items
+    ]
+
+
+async def resolve_folder(drive_service, user_id: str, parts: List[str]) -> str:
+    """
+    Resolves a folder path to the id of its last folder.
+
+    Each (parent, name) step is looked up in the folder cache first, so only
+    segments not seen recently cost a Drive call.
+    """
+    parent_id = "root"
+    parent_path = ""
+    for part in parts:
+        key = (user_id, parent_id, part)
+        folder_id = _folder_ids.get(key)
+        if folder_id is None:
+            q = (
+                f"'{parent_id}' in parents and name='{part}'"
+                f" and mimeType='{FOLDER_MIME_TYPE}'"
+            )
+            res = await execute(
+                drive_service.files().list(q=q, fields="files(id)", pageSize=1)
+            )
+            folders = res.get("files", [])
+            if not folders:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Folder '{part}' not found in path '{parent_path}'",
+                )
+            folder_id = folders[0]["id"]
+            _folder_ids.set(key, folder_id)
+            _ancestors.set((user_id, folder_id), (part, parent_id))
+        parent_id = folder_id
+        parent_path += f"/{part}"
+    return parent_id
+
+
+async def resolve_indexed_folder(user_id: str, root_id: str, parts: List[str]) -> str:
+    """Resolves a folder path to the id of its last folder from the index."""
+    folder_id = root_id
+    parent_path = ""
+    for part in parts:
+        folder_id = await drive_index.folder(user_id, folder_id, part)
+        if folder_id is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Folder '{part}' not found in path '{parent_path}'",
+            )
+        parent_path += f"/{part}"
+    return folder_id
+
+
+async def _encode(pages: AsyncIterator[List[DriveObject]], format: str):
+    if format == "ndjson":
+        async for page in pages:
+            yield "".join(f"{obj.model_dump_json()}\n" for obj in page)
+        return
+    separator = ""
+    yield "["
+    async for page in pages:
+        for obj in page:
+            yield separator + obj.model_dump_json()
+            separator = ","
+    yield "]"
+
+
+async def drive_objects_response(
+    drive_service,
+    request,
+    convert: Callable[[List[dict]], Awaitable[List[DriveObject]]],
+    format: str,
+    all_pages: bool,
+) -> StreamingResponse:
+    """
+    Streams the DriveObjects of a files().list request to the client.
+
+    With all_pages, every page is fetched at MAX_PAGE_SIZE and sent as soon as
+    it arrives, so memory use does not grow with the size of the listing.
+    Otherwise only the first page is sent and the token for the next one is
+    returned in the X-Next-Page-Token header.
+
+    The first page is fetched before the response starts, so errors from it
+    still become regular HTTP error responses.
+    """
+    response = await execute(request)
+    headers = {}
+    if not all_pages and response.get("nextPageToken"):
+        headers["X-Next-Page-Token"] = response["nextPageToken"]
+
+    async def pages():
+        nonlocal request, response
+        while True:
+            yield await convert(response.get("files", []))
+            if not all_pages:
+                return
+            request = drive_service.files().list_next(request, response)
+            if request is None:
+                return
+            response = await execute(request)
+
+    if format == "ndjson":
+        media_type = "application/x-ndjson"
+    else:
+        media_type = "application/json"
+    return StreamingResponse(
+        _encode(pages(), format), media_type=media_type, headers=headers
+    )
+
+
+async def indexed_root(
+    drive_service, user_id: str, pageToken: Optional[str]
+) -> Optional[str]:
+    """
+    Returns the id of the user's root folder if the request can be answered
+    from the Drive index, after any change made through this API is in it.
+
+    Requests continuing a Google listing, and any while the user's index is
+    still being built or cannot be read, go to Google instead.
+    """
+    if not settings.DRIVE_INDEX_ENABLED:
+        return None
+    from_index = pageToken is not None and pageToken.startswith(INDEX_PAGE_TOKEN)
+    if pageToken is not None and not from_index:
+        return None
+    drive_sync.touch(user_id, drive_service)
+    try:
+        current = await drive_sync.current(user_id)
+        root_id = await drive_index.root(user_id) if current else None
+    except Exception as e:
+        logger.warning("Drive index unavailable for %s: %s", user_id, e)
+        root_id = None
+    if root_id is None and from_index:
+        raise HTTPException(status_code=400, detail="Page token is no longer valid")
+    return root_id
+
+
+def indexed_item(row: tuple) -> dict:
+    file_id, name, mime_type, parent_id = row
+    return {"id": file_id, "name": name, "mimeType": mime_type, "parents": [parent_id]}
+
+
+async def indexed_objects_response(
+    fetch: Callable[[int, int], Awaitable[List[DriveObject]]],
+    format: str,
+    pageSize: Optional[int],
+    pageToken: Optional[str],
+) -> StreamingResponse:
+    """
+    Returns DriveObjects read from the index like drive_objects_response:
+    every page streamed, or one page with X-Next-Page-Token.
+    """
+    headers = {}
+    if pageSize is None and pageToken is None:
+
+        async def pages():
+            offset = 0
+            while True:
+                page = await fetch(offset, MAX_PAGE_SIZE)
+                yield page
+                if len(page) < MAX_PAGE_SIZE:
+                    return
+                offset += MAX_PAGE_SIZE
+
+    else:
+        offset = 0
+        if pageToken:
+            try:
+                offset = int(pageToken[len(INDEX_PAGE_TOKEN) :])
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid page token")
+        limit = pageSize or MAX_PAGE_SIZE
+        # One more than asked for tells whether there is a next page
+        objects = await fetch(offset, limit + 1)
+        if len(objects) > limit:
+            headers["X-Next-Page-Token"] = f"{INDEX_PAGE_TOKEN}{offset + limit}"
+
+        async def pages():
+            yield objects[:limit]
+
+    if format == "ndjson":
+        media_type = "application/x-ndjson"
+    else:
+        media_type = "application/json"
+    return StreamingResponse(
+        _encode(pages(), format), media_type=media_type, headers=headers
+    )
+
+
+def invalidate_folder(user_id: str, folder_id: str) -> None:
+    """
+    Drops cached lookups of a folder and of the folders directly inside it,
+    and has the next Drive index read wait for the change.
+    """
+    invalidate_folders(user_id, {folder_id})
+
+
+def invalidate_folders(user_id: str, folder_ids: set) -> None:
+    """Like invalidate_folder() for many folders, in one pass over the cache."""
+    if not folder_ids:
+        return
+    drive_sync.changed(user_id)
+    for folder_id in folder_ids:
+        _ancestors.pop((user_id, folder_id))
+    _folder_ids.discard_where(
+        lambda key, value: (
+            key[0] == user_id and (value in folder_ids or key[1] in folder_ids)
+        )
+    )
+
+
+def invalidate_created(user_id: str, parent_id: str, name: str) -> None:
+    """
+    Drops the cached lookup of the name an object was created under in its
+    folder, leaving the folder's other lookups, and has the next Drive index
+    read wait for the change.
+    """
+    drive_sync.changed(user_id)
+    _folder_ids.pop((user_id, parent_id, name))
+
+
 @router.get("/drive/search", response_model=List[DriveObject])
 async def search_drive(
     name: Optional[str] = Query(None, description="Name to search for"),
     mimeType: Optional[str] = Query(None, description="Filter by mimeType"),
+    format: str = Query(
+        "json", pattern="^(json|ndjson)$", description="json array or ndjson"
+    ),
+    pageSize: Optional[int] = Query(
+        None, ge=1, le=MAX_PAGE_SIZE, description="Return a single page"
+    ),
+    pageToken: Optional[str] = Query(
+        None, description="X-Next-Page-Token of the previous page"
+    ),
     drive_service=Depends(get_drive_service),
-) -> List[DriveObject]:
-    """Search Google Drive objects by name with optional mimeType filter."""
+    user_id: str = Depends(get_user_id),
+) -> Response:
+    """
+    Search Google Drive objects by name with optional mimeType filter.
+
+    All matches are streamed, unless pageSize or pageToken is given, in which
+    case a single page is returned.
+
+    Once the user's Drive index is built, matches are read from it instead
+    of asking Google: ranked by the in-memory name index (names starting
+    with the term, then names with a word starting with it, then names
+    containing it) or, while that loads, ordered by name. A name nothing in
+    the index matches is still looked up at Google.
+    """
     try:
+        root_id = await indexed_root(drive_service, user_id, pageToken)
+        if root_id is not None:
+
+            async def fetch(offset: int, limit: int) -> List[DriveObject]:
+                rows = None
+                if name and settings.DRIVE_NAME_INDEX_ENABLED:
+                    rows = await drive_index.search_names(
+                        user_id, name, mimeType, offset, limit
+                    )
+                if rows is None:
+                    rows = await drive_index.search(
+                        user_id, name, mimeType, offset, limit
+                    )
+                return [
+                    build_drive_object(indexed_item(row), parent_path)
+                    for row, parent_path in rows
+                ]
+
+            # Files created since the last sync are only known to Google
+            if not name or pageToken or await fetch(0, 1):
+                return await indexed_objects_response(
+                    fetch, format, pageSize, pageToken
+                )
+
         q = []
         if name:
             q.append(f"name contains '{name}'")
         if mimeType:
             q.append(f"mimeType='{mimeType}'")
         query = " and ".join(q) if q else None
-        results = (
-            drive_service.files()
-            .list(q=query, fields="files(id, name, mimeType, parents)")
-            .execute()
+        request = drive_service.files().list(
+            q=query,
+            fields=FILE_LIST_FIELDS,
+            pageSize=pageSize or MAX_PAGE_SIZE,
+            pageToken=pageToken,
+        )
+        return await drive_objects_response(
+            drive_service,
+            request,
+            lambda files: resolve_drive_objects(drive_service, user_id, files),
+            format,
+            all_pages=pageSize is None and pageToken is None,
         )
-        files = results.get("files", [])
-        return [build_drive_object(f) for f in files]
     except HttpError as e:
-        raise HTTPException(status_code=e.resp.status, detail=str(e))
+        raise http_exception(e)
 
 
 @router.get("/drive/navigate/{path:path}", response_model=List[DriveObject])
 async def list_drive_path(
     path: str,
     mimeType: Optional[str] = Query(None, description="Filter by mimeType"),
+    format: str = Query(
+        "json", pattern="^(json|ndjson)$", description="json array or ndjson"
+    ),
+    pageSize: Optional[int] = Query(
+        None, ge=1, le=MAX_PAGE_SIZE, description="Return a single page"
+    ),
+    pageToken: Optional[str] = Query(
+        None, description="X-Next-Page-Token of the previous page"
+    ),
     drive_service=Depends(get_drive_service),
-) -> List[DriveObject]:
-    """List Google Drive content in a specific path with optional mimeType filter."""
+    user_id: str = Depends(get_user_id),
+) -> Response:
+    """
+    List Google Drive content in a specific path with optional mimeType filter.
+
+    The whole folder is streamed, unless pageSize or pageToken is given, in
+    which case a single page is returned.
+
+    Once the user's Drive index is built, the folder is read from it
+    (ordered by name) instead of asking Google.
+    """
     try:
         parts = [p for p in path.strip("/").split("/") if p]
-        parent_id = "root"
-        parent_path = ""
-        for part in parts:
-            q = f"'{parent_id}' in parents and name='{part}' and mimeType='application/vnd.google-apps.folder'"
-            res = (
-                drive_service.files()
-                .list(q=q, fields="files(id, name, mimeType, parents)")
-                .execute()
-            )
-            folders = res.get("files", [])
-            if not folders:
-                raise HTTPException(
-                    status_code=404,
-                    detail=f"Folder '{part}' not found in path '{parent_path}'",
+        parent_path = "".join(f"/{part}" for part in parts)
+        root_id = await indexed_root(drive_service, user_id, pageToken)
+        if root_id is not None:
+            folder_id = await resolve_indexed_folder(user_id, root_id, parts)
+
+            async def fetch(offset: int, limit: int) -> List[DriveObject]:
+                rows = await drive_index.children(
+                    user_id, folder_id, mimeType, offset, limit
                 )
-            parent_id = folders[0]["id"]
-            parent_path += f"/{part}"
+                return [build_drive_object(indexed_item(r), parent_path) for r in rows]
+
+            return await indexed_objects_response(fetch, format, pageSize, pageToken)
+
+        parent_id = await resolve_folder(drive_service, user_id, parts)
         q = f"'{parent_id}' in parents"
         if mimeType:
             q += f" and mimeType='{mimeType}'"
-        results = (
-            drive_service.files()
-            .list(q=q, fields="files(id, name, mimeType, parents)")
-            .execute()
+        request = drive_service.files().list(
+            q=q,
+            fields=FILE_LIST_FIELDS,
+            pageSize=pageSize or MAX_PAGE_SIZE,
+            pageToken=pageToken,
+        )
+
+        async def convert(files: List[dict]) -> List[DriveObject]:
+            for f in files:
+                remember_ancestor(user_id, f)
+            return [build_drive_object(f, parent_path) for f in files]
+
+        return await drive_objects_response(
+            drive_service,
+            request,
+            convert,
+            format,
+            all_pages=pageSize is None and pageToken is None,
         )
-        files = results.get("files", [])
-        return [build_drive_object(f, parent_path) for f in files]
     except HttpError as e:
-        raise HTTPException(status_code=e.resp.status, detail=str(e))
+        raise http_exception(e)
+
+
+async def _list_children(
+    drive_service, folder_ids: List[str]
+) -> AsyncIterator[List[dict]]:
+    """
+    Lists what is directly in many folders, TREE_PARENTS_PER_QUERY of them
+    OR'd into each files().list query and up to TREE_CONCURRENCY queries in
+    flight at once. Pages are yielded in the order they arrive; a slow
+    reader holds the queries back rather than have their pages pile up.
+    """
+    size = settings.TREE_PARENTS_PER_QUERY
+    chunks = [folder_ids[i : i + size] for i in range(0, len(folder_ids), size)]
+    pages: asyncio.Queue = asyncio.Queue(settings.TREE_CONCURRENCY)
+    slots = asyncio.Semaphore(settings.TREE_CONCURRENCY)
+
+    async def list_chunk(chunk: List[str]) -> None:
+        q = " or ".join(f"'{folder_id}' in parents" for folder_id in chunk)
+        request = drive_service.files().list(
+            q=q, fields=FILE_LIST_FIELDS, pageSize=MAX_PAGE_SIZE
+        )
+        try:
+            async with slots:
+                while request is not None:
+                    response = await execute(request)
+                    await pages.put(response.get("files", []))
+                    request = drive_service.files().list_next(request, response)
+        except Exception as e:
+            await pages.put(e)
+            return
+        await pages.put(None)
+
+    with bulk():
+        tasks = [asyncio.create_task(list_chunk(chunk)) for chunk in chunks]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            page = await pages.get()
+            if page is None:
+                remaining -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield page
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _list_indexed_children(
+    user_id: str, folder_ids: List[str]
+) -> AsyncIterator[List[dict]]:
+    size = settings.TREE_PARENTS_PER_QUERY
+    for i in range(0, len(folder_ids), size):
+        rows = await drive_index.children_of(user_id, folder_ids[i : i + size])
+        yield [indexed_item(row) for row in rows]
+
+
+async def walk_tree(
+    list_children: Callable[[List[str]], AsyncIterator[List[dict]]],
+    folder_id: str,
+    folder_path: str,
+    mime_type: Optional[str],
+    max_depth: int,
+) -> AsyncIterator[List[DriveObject]]:
+    """
+    Yields the DriveObjects below a folder breadth first, a page at a time,
+    listing all folders of a level together with list_children.
+
+    Objects reachable along several paths, like files with more than one
+    parent, are returned once. With mime_type, only objects of that type
+    are returned, but every folder is still walked.
+    """
+    level = {folder_id: folder_path}
+    seen = {folder_id}
+    for _ in range(max_depth):
+        below: Dict[str, str] = {}
+        async for files in list_children(list(level)):
+            objects = []
+            for item in files:
+                if item["id"] in seen:
+                    continue
+                seen.add(item["id"])
+                parents = item.get("parents") or [None]
+                parent_id = next((p for p in parents if p in level), None)
+                if parent_id is None:
+                    # Listed under an alias, which only the top folder can be
+                    parent_id, parent_path = parents[0], folder_path
+                else:
+                    parent_path = level[parent_id]
+                obj = DriveObject(
+                    id=item["id"],
+                    name=item.get("name"),
+                    mimeType=item.get("mimeType"),
+                    path=f"{parent_path}/{item.get('name')}",
+                    parent_id=parent_id,
+                )
+                if item.get("mimeType") == FOLDER_MIME_TYPE:
+                    below[obj.id] = obj.path
+                if mime_type is None or obj.mimeType == mime_type:
+                    objects.append(obj)
+            if objects:
+                yield objects
+        if not below:
+            return
+        level = below
+
+
+async def _delete_batch(drive_service, ids: List[str]) -> List[BatchDeleteResult]:
+    outcomes: Dict[str, tuple] = {}
+
+    def callback(request_id, response, exception):
+        if exception is None:
+            outcomes[request_id] = (204, None)
+        elif isinstance(exception, HttpError):
+            outcomes[request_id] = (exception.resp.status, str(exception))
+        else:
+            outcomes[request_id] = (500, str(exception))
+
+    batch = drive_service.new_batch_http_request(callback=callback)
+    for index, file_id in enumerate(ids):
+        # Batch request ids must be unique, file ids may repeat
+        batch.add(drive_service.files().delete(fileId=file_id), request_id=str(index))
+    await execute(batch)
+    results = []
+    for index, file_id in enumerate(ids):
+        code, error = outcomes[str(index)]
+        results.append(BatchDeleteResult(id=file_id, status=code, error=error))
+    return results
+
+
+async def tree_pages(
+    drive_service, user_id: str, path: str, mime_type: Optional[str], max_depth: int
+) -> AsyncIterator[List[DriveObject]]:
+    """walk_tree below the folder at path, from the Drive index once built."""
+    parts = [p for p in path.strip("/").split("/") if p]
+    folder_path = "".join(f"/{part}" for part in parts)
+    root_id = await indexed_root(drive_service, user_id, None)
+    if root_id is not None:
+        folder_id = await resolve_indexed_folder(user_id, root_id, parts)
+        list_children = partial(_list_indexed_children, user_id)
+    else:
+        folder_id = await resolve_folder(drive_service, user_id, parts)
+        list_children = partial(_list_children, drive_service)
+    return walk_tree(list_children, folder_id, folder_path, mime_type, max_depth)
+
+
+@router.get("/drive/tree/{path:path}", response_model=List[DriveObject])
+async def list_drive_tree(
+    path: str,
+    mimeType: Optional[str] = Query(None, description="Filter by mimeType"),
+    maxDepth: int = Query(
+        settings.TREE_MAX_DEPTH,
+        ge=1,
+        le=settings.TREE_MAX_DEPTH,
+        description="Levels below the folder to list, 1 for its content only",
+    ),
+    format: str = Query(
+        "json", pattern="^(json|ndjson)$", description="json array or ndjson"
+    ),
+    drive_service=Depends(get_drive_service),
+    user_id: str = Depends(get_user_id),
+) -> Response:
+    """
+    List everything below a folder, level by level, with full paths.
+
+    Each level's folders are listed together, TREE_PARENTS_PER_QUERY to a
+    files().list query (q="'a' in parents or 'b' in parents ..."), with up
+    to TREE_CONCURRENCY queries in flight in the bulk lane. Objects are
+    streamed as pages arrive, so within a level they are in no particular
+    order. Once the user's Drive index is built, the tree is read from it.
+
+    Example input request:
+        GET /drive/tree/Projects/2024?maxDepth=2&format=ndjson
+    """
+    try:
+        pages = await tree_pages(drive_service, user_id, path, mimeType, maxDepth)
+        # Fetched before the response starts, so its errors are still
+        # regular HTTP error responses
+        first = await anext(pages, [])
+    except HttpError as e:
+        raise http_exception(e)
+
+    async def all_pages():
+        yield first
+        async for page in pages:
+            yield page
+
+    if format == "ndjson":
+        media_type = "application/x-ndjson"
+    else:
+        media_type = "application/json"
+    return StreamingResponse(_encode(all_pages(), format), media_type=media_type)
+
+
+@router.post("/drive/batch-delete", response_model=List[BatchDeleteResult])
+async def batch_delete_drive_objects(
+    req: BatchDeleteRequest = Body(...),
+    drive_service=Depends(get_drive_service),
+    user_id: str = Depends(get_user_id),
+) -> List[BatchDeleteResult]:
+    """
+    Deletes many objects from Google Drive, reporting a status per ID.
+
+    IDs are sent as Google batch requests of up to 100 deletes each, with at
+    most BATCH_DELETE_CONCURRENCY batches in flight at once. They run in the
+    bulk lane, so interactive calls are scheduled ahead of them. As a job
+    (POST /jobs/drive/batch-delete), its progress counts the IDs processed.
+
+    Example input request:
+        POST /drive/batch-delete
+        Body: {"ids": ["1a-28yTY23NuCa7vmyMABGgRDCErW58Q99F_2o9ZePGo", "missing"]}
+
+    Example response:
+        [
+            {"id": "1a-28yTY23NuCa7vmyMABGgRDCErW58Q99F_2o9ZePGo", "status": 204},
+            {"id": "missing", "status": 404, "error": "..."}
+        ]
+    """
+    slots = asyncio.Semaphore(settings.BATCH_DELETE_CONCURRENCY)
+
+    deleted = 0
+
+    async def delete_chunk(ids: List[str]) -> List[BatchDeleteResult]:
+        nonlocal deleted
+        async with slots:
+            try:
+                results = await _delete_batch(drive_service, ids)
+            except HttpError as e:
+                # The batch request itself failed, so none of its deletes ran
+                results = [
+                    BatchDeleteResult(id=i, status=e.resp.status, error=str(e))
+                    for i in ids
+                ]
+        deleted += len(ids)
+        progress(deleted, len(req.ids))
+        return results
+
+    ids = req.ids
+    chunks = [ids[i : i + BATCH_SIZE] for i in range(0, len(ids), BATCH_SIZE)]
+    with bulk():
+        chunk_results = await asyncio.gather(*map(delete_chunk, chunks))
+    results = [result for results in chunk_results for result in results]
+    invalidate_folders(user_id, {r.id for r in results if r.status == 204})
+    return results
 
 
 @router.delete("/drive/{id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_drive_object(
-    id: str, drive_service=Depends(get_drive_service)
+    id: str,
+    drive_service=Depends(get_drive_service),
+    user_id: str = Depends(get_user_id),
 ) -> None:
     """Deletes an object by id from Google Drive."""
     try:
-        drive_service.files().delete(fileId=id).execute()
+        await execute(drive_service.files().delete(fileId=id))
+        invalidate_folder(user_id, id)
     except HttpError as e:
-        raise HTTPException(status_code=e.resp.status, detail=str(e))
+        raise http_exception(e)
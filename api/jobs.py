@@ -0,0 +1,142 @@
+from typing import Any, List, Optional
+
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
+from pydantic import BaseModel
+from pydantic.fields import Field
+
+from api.documents.documents_api import persist_document
+from api.documents.models import Document
+from api.drive import BatchDeleteRequest, batch_delete_drive_objects, tree_pages
+from config import settings
+from google_services import get_docs_service, get_drive_service, get_user_id
+from jobs import job_queue, progress
+
+router = APIRouter()
+
+
+class Job(BaseModel):
+    id: str
+    kind: str
+    status: str = Field(..., description="queued, running, succeeded or failed")
+    done: int = Field(0, description="Work done so far, in units of the kind")
+    total: Optional[int] = Field(None, description="Work to do, once known")
+    result: Any = Field(None, description="What the operation returns")
+    error: Optional[str] = None
+    error_status: Optional[int] = Field(None, description="HTTP status of the error")
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+
+# POST /jobs/drive/tree/{path}: List a folder tree in the background
+@router.post("/jobs/drive/tree/{path:path}", response_model=Job, status_code=202)
+async def submit_tree_job(
+    path: str,
+    mimeType: Optional[str] = Query(None, description="Filter by mimeType"),
+    maxDepth: int = Query(settings.TREE_MAX_DEPTH, ge=1, le=settings.TREE_MAX_DEPTH),
+    drive_service=Depends(get_drive_service),
+    user_id: str = Depends(get_user_id),
+) -> Job:
+    """
+    Starts GET /drive/tree/{path} as a job; its result is the list of
+    DriveObjects and its progress the number listed so far.
+
+    Example input request:
+        POST /jobs/drive/tree/Projects/2024?maxDepth=2
+
+    Example response:
+        {"id": "9f1c...", "kind": "tree", "status": "queued", "done": 0, ...}
+    """
+
+    async def work() -> list:
+        pages = await tree_pages(drive_service, user_id, path, mimeType, maxDepth)
+        objects = []
+        async for page in pages:
+            objects.extend(page)
+            progress(len(objects))
+        return objects
+
+    return Job(**await job_queue.submit(user_id, "tree", work))
+
+
+# POST /jobs/drive/batch-delete: Delete many objects in the background
+@router.post("/jobs/drive/batch-delete", response_model=Job, status_code=202)
+async def submit_batch_delete_job(
+    req: BatchDeleteRequest = Body(...),
+    drive_service=Depends(get_drive_service),
+    user_id: str = Depends(get_user_id),
+) -> Job:
+    """
+    Starts POST /drive/batch-delete as a job; its result is the status per
+    ID.
+
+    Example input request:
+        POST /jobs/drive/batch-delete
+        Body: {"ids": ["1a-28yTY23NuCa7vmyMABGgRDCErW58Q99F_2o9ZePGo", "missing"]}
+    """
+
+    async def work() -> list:
+        return await batch_delete_drive_objects(req, drive_service, user_id)
+
+    return Job(**await job_queue.submit(user_id, "batch-delete", work))
+
+
+# POST /jobs/drive/documents/{document_id}: Persist a document in the background
+@router.post("/jobs/drive/documents/{document_id}", response_model=Job, status_code=202)
+async def submit_persist_job(
+    document_id: str,
+    document: Document = Body(..., description="The document as it should be"),
+    docs_service=Depends(get_docs_service),
+    user_id: str = Depends(get_user_id),
+) -> Job:
+    """
+    Starts PUT /drive/documents/{document_id} as a job; its result is what
+    the persist returns. A stale revisionId fails the job with
+    error_status 409.
+
+    Example input request:
+        POST /jobs/drive/documents/1a-28yTY23NuCa7vmyMABGgRDCErW58Q99F_2o9ZePGo
+        (body as for PUT /drive/documents/{document_id})
+    """
+
+    async def work() -> dict:
+        return await persist_document(document_id, document, docs_service)
+
+    return Job(**await job_queue.submit(user_id, "persist", work))
+
+
+# GET /jobs: The user's latest jobs
+@router.get("/jobs", response_model=List[Job])
+async def list_jobs(
+    limit: int = Query(50, ge=1, le=1000),
+    user_id: str = Depends(get_user_id),
+) -> List[Job]:
+    """
+    Lists the user's jobs, newest first. Finished jobs are kept for
+    JOBS_RETENTION seconds, and across restarts; jobs a restart interrupted
+    are failed with error_status 503.
+    """
+    return [Job(**job) for job in await job_queue.list(user_id, limit)]
+
+
+# GET /jobs/{job_id}: State, progress and result of a job
+@router.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str, user_id: str = Depends(get_user_id)) -> Job:
+    """
+    Returns a job of the user, with the result once it succeeded or the
+    error (and the HTTP status the operation would have answered) once it
+    failed.
+
+    Example input request:
+        GET /jobs/9f1c0e5a2b7d4c3e8f6a1b2c3d4e5f60
+
+    Example response:
+        {"id": "9f1c0e5a2b7d4c3e8f6a1b2c3d4e5f60", "kind": "batch-delete",
+         "status": "running", "done": 300, "total": 1000, "result": null,
+         "error": null, "error_status": null, "created_at": 1760745600.0,
+         "started_at": 1760745600.2, "finished_at": null}
+    """
+    job = await job_queue.get(user_id, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return Job(**job)
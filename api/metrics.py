@@ -0,0 +1,34 @@
+from fastapi import APIRouter
+
+from executor import coalescing, scheduler
+from transport import google_http
+
+router = APIRouter()
+
+
+# GET /metrics: Connection reuse and scheduling of Google API calls
+@router.get("/metrics")
+async def get_metrics():
+    """
+    Report how the shared Google API connection pool and the scheduler
+    admitting calls to it are used.
+
+    Example input request:
+        GET /metrics
+
+    Example response:
+        {"google_http": {"requests": 1200, "reused": 1168, "connected": 32,
+         "expired": 0, "pool_size": 32, "created": 32, "idle": 32,
+         "reuse_rate": 0.973},
+         "scheduler": {"running": 3, "running_bulk": 0, "waiting": 0,
+         "project_rate": 200.0},
+         "coalescing": {"upstream": 800, "joined": 350, "reused": 0}}
+
+    Coalescing counts GETs that were sent to Google, and the calls saved by
+    joining one in flight or reusing one within COALESCE_WINDOW.
+    """
+    return {
+        "google_http": google_http.stats(),
+        "scheduler": scheduler.stats(),
+        "coalescing": dict(coalescing),
+    }
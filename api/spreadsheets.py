@@ -1,11 +1,36 @@
-from typing import Optional
+import asyncio
+import codecs
+import csv
+import io
+import json
+import re
+import time
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from googleapiclient.errors import HttpError
 
-from google_services import get_sheets_service
+from api.drive import invalidate_created, invalidate_folder
+from config import settings
+from executor import (
+    bulk,
+    execute,
+    execute_raw,
+    execute_shared,
+    http_exception,
+    run,
+)
+from google_services import get_sheets_service, get_user_id
 
 router = APIRouter()
 
+# Rows whose size is measured at once when cutting a body into batches
+SIZED_TOGETHER = 100
+# Optional sheet name, then the top left cell of a range, e.g. 'Data'!B2
+TOP_LEFT = re.compile(r"(?:(?P<sheet>.+)!)?(?P<column>[A-Za-z]+)(?P<row>\d+)(?::.*)?")
+# Optional sheet name, then whole columns or rows, e.g. Data!A:C or 2:5
+COLUMNS_OR_ROWS = re.compile(r"(?:.+!)?[A-Za-z]*\d*:[A-Za-z]*\d*")
+
 
 # POST /drive/spreadsheets: Create new empty spreadsheet, with optional parent id
 @router.post("/drive/spreadsheets")
@@ -13,6 +38,7 @@ async def create_spreadsheet(
     parent: Optional[str] = Query(None, description="Optional parent folder id"),
     title: str = Query(..., description="Spreadsheet title"),
     sheets_service=Depends(get_sheets_service),
+    user_id: str = Depends(get_user_id),
 ):
     """
     Create a new empty spreadsheet with an optional parent folder.
@@ -31,31 +57,126 @@ async def create_spreadsheet(
     if parent:
         body["parents"] = [parent]
     try:
-        spreadsheet = sheets_service.spreadsheets().create(body=body).execute()
+        spreadsheet = await execute(sheets_service.spreadsheets().create(body=body))
+        invalidate_created(user_id, parent or "root", title)
         return spreadsheet
+    except HTTPException:
+        raise
+    except HttpError as e:
+        raise http_exception(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def sheet_range(title: str) -> str:
+    """The A1 range of a whole sheet, quoted as A1 notation requires."""
+    return "'" + title.replace("'", "''") + "'"
+
+
 # GET /drive/spreadsheets/{spreadsheet_id}: Return a spreadsheet by id
 @router.get("/drive/spreadsheets/{spreadsheet_id}")
 async def get_spreadsheet(
-    spreadsheet_id: str, sheets_service=Depends(get_sheets_service)
+    spreadsheet_id: str,
+    ranges: Optional[List[str]] = Query(
+        None, description="A1 ranges to return, e.g. Data!A1:D100"
+    ),
+    fields: Optional[str] = Query(
+        None, description="Sheets API field mask, e.g. sheets.properties.title"
+    ),
+    includeGridData: bool = Query(
+        False, description="Return the cells of the ranges (or every sheet)"
+    ),
+    values: bool = Query(
+        False, description="Return only the values of the ranges, as row arrays"
+    ),
+    valueRenderOption: str = Query(
+        "FORMATTED_VALUE",
+        pattern="^(FORMATTED_VALUE|UNFORMATTED_VALUE|FORMULA)$",
+        description="With values, how values are rendered",
+    ),
+    majorDimension: str = Query(
+        "ROWS", pattern="^(ROWS|COLUMNS)$", description="With values, ROWS or COLUMNS"
+    ),
+    sheets_service=Depends(get_sheets_service),
 ):
     """
     Get a spreadsheet by its ID.
 
+    Only the parts named by the fields mask and the ranges are fetched, and
+    cells only with includeGridData. With values, the values of the ranges
+    (every sheet if none are given) are returned as arrays of rows by
+    values.batchGet instead, a fraction of the size of the same cells as
+    GridData. Google's response is passed through without being decoded.
+
     Example input request:
-        GET /drive/spreadsheets/1R3rJWb50oW2JNOqKd4l0XlP-9hdMPr1c9cxjYX3PWnY
+        GET /drive/spreadsheets/1R3rJWb50oW2JNOqKd4l0XlP-9hdMPr1c9cxjYX3PWnY?fields=sheets.properties.title
+        GET /drive/spreadsheets/1R3rJWb50oW2JNOqKd4l0XlP-9hdMPr1c9cxjYX3PWnY?values=true&ranges=Data!A1:C3
 
-    Google API request sent:
-        sheets_service.spreadsheets().get(spreadsheetId=spreadsheet_id)
+    Example response, with values:
+        {
+            "spreadsheetId": "1R3rJWb50oW2JNOqKd4l0XlP-9hdMPr1c9cxjYX3PWnY",
+            "valueRanges": [
+                {"range": "Data!A1:C3", "majorDimension": "ROWS",
+                 "values": [["Date", "City", "Temp"], ["2024-01-01", "Berlin", "12.5"]]}
+            ]
+        }
+
+    Google API requests sent:
+        sheets_service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id, ranges=ranges, fields=fields,
+            includeGridData=includeGridData)
+        or, with values (the get only without ranges):
+        sheets_service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id, fields="sheets.properties.title")
+        sheets_service.spreadsheets().values().batchGet(
+            spreadsheetId=spreadsheet_id, ranges=ranges,
+            valueRenderOption=valueRenderOption, majorDimension=majorDimension)
     """
+    if values and includeGridData:
+        raise HTTPException(
+            status_code=400, detail="values and includeGridData exclude each other"
+        )
+    params = {}
+    if fields:
+        params["fields"] = fields
     try:
-        spreadsheet = (
-            sheets_service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
+        if not values:
+            if ranges:
+                params["ranges"] = ranges
+            if includeGridData:
+                params["includeGridData"] = True
+            request = sheets_service.spreadsheets().get(
+                spreadsheetId=spreadsheet_id, **params
+            )
+            content = await execute_raw(request, shared=True)
+            return Response(content=content, media_type="application/json")
+        if not ranges:
+            spreadsheet = await execute_shared(
+                sheets_service.spreadsheets().get(
+                    spreadsheetId=spreadsheet_id, fields="sheets.properties.title"
+                )
+            )
+            ranges = [
+                sheet_range(sheet["properties"]["title"])
+                for sheet in spreadsheet.get("sheets", [])
+            ]
+        content = await execute_raw(
+            sheets_service.spreadsheets()
+            .values()
+            .batchGet(
+                spreadsheetId=spreadsheet_id,
+                ranges=ranges,
+                valueRenderOption=valueRenderOption,
+                majorDimension=majorDimension,
+                **params,
+            ),
+            shared=True,
         )
-        return spreadsheet
+        return Response(content=content, media_type="application/json")
+    except HTTPException:
+        raise
+    except HttpError as e:
+        raise http_exception(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -63,7 +184,9 @@ async def get_spreadsheet(
 # DELETE /drive/spreadsheets/{spreadsheet_id}: Delete a spreadsheet by id
 @router.delete("/drive/spreadsheets/{spreadsheet_id}")
 async def delete_spreadsheet(
-    spreadsheet_id: str, sheets_service=Depends(get_sheets_service)
+    spreadsheet_id: str,
+    sheets_service=Depends(get_sheets_service),
+    user_id: str = Depends(get_user_id),
 ):
     """
     Delete a spreadsheet by its ID.
@@ -75,7 +198,253 @@ async def delete_spreadsheet(
         sheets_service.spreadsheets().delete(spreadsheetId=spreadsheet_id)
     """
     try:
-        sheets_service.spreadsheets().delete(spreadsheetId=spreadsheet_id).execute()
+        await execute(
+            sheets_service.spreadsheets().delete(spreadsheetId=spreadsheet_id)
+        )
+        invalidate_folder(user_id, spreadsheet_id)
         return {"message": f"Spreadsheet {spreadsheet_id} deleted successfully"}
+    except HTTPException:
+        raise
+    except HttpError as e:
+        raise http_exception(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+async def _text(body: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    async for chunk in body:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+async def _json_rows(body: AsyncIterator[bytes]) -> AsyncIterator[List[list]]:
+    """Rows of a JSON array of arrays, parsed as each part of it arrives."""
+    decoder = json.JSONDecoder()
+    text, pos, opened, closed = "", 0, False, False
+    async for part in _text(body):
+        text = text[pos:] + part
+        pos = 0
+        rows = []
+        while not closed:
+            while pos < len(text) and text[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(text):
+                break
+            if not opened:
+                if text[pos] != "[":
+                    raise HTTPException(status_code=400, detail="Expected a JSON array")
+                opened = True
+                pos += 1
+            elif text[pos] == "]":
+                closed = True
+            else:
+                try:
+                    row, pos = decoder.raw_decode(text, pos)
+                except json.JSONDecodeError:
+                    # Most likely a row cut off at the end of this part
+                    break
+                if not isinstance(row, list):
+                    raise HTTPException(
+                        status_code=400, detail="Each row must be a JSON array"
+                    )
+                rows.append(row)
+        yield rows
+    if not closed:
+        raise HTTPException(status_code=400, detail="Invalid JSON array of rows")
+
+
+async def _ndjson_rows(body: AsyncIterator[bytes]) -> AsyncIterator[List[list]]:
+    """Rows of newline delimited JSON, one array per line."""
+    rest = ""
+    async for part in _text(body):
+        lines = (rest + part).split("\n")
+        rest = lines.pop()
+        try:
+            rows = [json.loads(line) for line in lines if line.strip()]
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid row: {e}")
+        if not all(isinstance(row, list) for row in rows):
+            raise HTTPException(status_code=400, detail="Each row must be a JSON array")
+        yield rows
+    if rest.strip():
+        raise HTTPException(status_code=400, detail="Last row is not terminated")
+
+
+async def _csv_rows(body: AsyncIterator[bytes]) -> AsyncIterator[List[list]]:
+    """
+    Rows of CSV, parsed as whole lines arrive. A line break inside a quoted
+    value follows an odd number of quotes, so the text is only cut after a
+    line break with an even number of quotes before it.
+    """
+    rest = ""
+    async for part in _text(body):
+        text = rest + part
+        cut = text.rfind("\n")
+        while cut >= 0 and text.count('"', 0, cut) % 2:
+            cut = text.rfind("\n", 0, cut)
+        rest = text[cut + 1 :]
+        yield list(csv.reader(io.StringIO(text[: cut + 1])))
+    if rest.strip():
+        yield list(csv.reader(io.StringIO(rest)))
+
+
+ROW_PARSERS = {
+    "application/json": _json_rows,
+    "application/x-ndjson": _ndjson_rows,
+    "text/csv": _csv_rows,
+}
+
+
+def _sized(rows: List[list], limit: int) -> Iterator[Tuple[List[list], int]]:
+    """
+    Rows with the size of their JSON encoding, in groups of SIZED_TOGETHER
+    (encoding each row on its own costs more than sending it), or one by
+    one where a group is larger than limit.
+    """
+    for i in range(0, len(rows), SIZED_TOGETHER):
+        group = rows[i : i + SIZED_TOGETHER]
+        size = len(json.dumps(group))
+        if size <= limit:
+            yield group, size
+        else:
+            for row in group:
+                yield [row], len(json.dumps(row)) + 1
+
+
+async def _batches(
+    parts: AsyncIterator[List[list]], limit: int
+) -> AsyncIterator[Tuple[int, List[list]]]:
+    """
+    Groups consecutive rows into batches whose JSON encoding stays within
+    limit bytes, yielding each with the offset of its first row.
+    """
+    batch, size, offset = [], 0, 0
+    async for rows in parts:
+        for group, group_size in _sized(rows, limit):
+            if batch and size + group_size > limit:
+                yield offset, batch
+                offset += len(batch)
+                batch, size = [], 0
+            batch += group
+            size += group_size
+    if batch:
+        yield offset, batch
+
+
+# POST /drive/spreadsheets/{spreadsheet_id}/values: Write many rows of values
+@router.post("/drive/spreadsheets/{spreadsheet_id}/values")
+async def write_values(
+    spreadsheet_id: str,
+    request: Request,
+    range_: str = Query(
+        "A1", alias="range", description="Top left cell to write from, e.g. Data!A1"
+    ),
+    valueInputOption: str = Query(
+        "RAW", pattern="^(RAW|USER_ENTERED)$", description="RAW or USER_ENTERED"
+    ),
+    sheets_service=Depends(get_sheets_service),
+):
+    """
+    Write a large set of rows to a sheet, starting at the top left cell of
+    range, or at A1 of the sheet when range only names one. Ranges of
+    whole columns or rows have no top left cell and are refused with 400.
+
+    The body is a JSON array of rows (application/json), one JSON array per
+    line (application/x-ndjson) or CSV (text/csv). It is parsed as it
+    arrives and cut into blocks of consecutive rows of up to
+    SHEETS_WRITE_BATCH_BYTES of JSON each, which are written with up to
+    SHEETS_WRITE_CONCURRENCY calls in flight at once, in the bulk lane.
+    Reading the body waits while all of them are, so only about that many
+    blocks are ever held in memory.
+
+    Example input request:
+        POST /drive/spreadsheets/1R3rJWb50oW2JNOqKd4l0XlP-9hdMPr1c9cxjYX3PWnY/values?range=Data!A2
+        Content-Type: text/csv
+        2024-01-01,Berlin,12.5
+        2024-01-02,Berlin,13.1
+
+    Example response:
+        {"spreadsheetId": "1R3rJWb50oW2JNOqKd4l0XlP-9hdMPr1c9cxjYX3PWnY",
+         "updatedRows": 2, "updatedCells": 6, "calls": 1, "seconds": 0.4}
+
+    Google API requests sent, one per block:
+        sheets_service.spreadsheets().values().update(
+            spreadsheetId=spreadsheet_id, range="'Data'!A2",
+            valueInputOption="RAW", body={"values": rows})
+    """
+    content_type = request.headers.get("content-type", "application/json")
+    parse = ROW_PARSERS.get(content_type.split(";")[0].strip().lower())
+    if parse is None:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Send rows as one of {', '.join(ROW_PARSERS)}",
+        )
+    top_left = TOP_LEFT.fullmatch(range_)
+    if top_left is not None:
+        sheet, column = top_left.group("sheet"), top_left.group("column").upper()
+        first_row = int(top_left.group("row"))
+    elif COLUMNS_OR_ROWS.fullmatch(range_):
+        raise HTTPException(
+            status_code=400,
+            detail="range must start at a cell, e.g. Data!A1, or name a sheet",
+        )
+    else:
+        # A sheet name alone
+        sheet, column, first_row = range_, "A", 1
+    if sheet and not (len(sheet) > 1 and sheet[0] == sheet[-1] == "'"):
+        sheet = sheet_range(sheet)
+    prefix = f"{sheet}!" if sheet else ""
+
+    slots = asyncio.Semaphore(settings.SHEETS_WRITE_CONCURRENCY)
+    tasks: List[asyncio.Task] = []
+    # The first write that failed, noted as it finishes
+    failures: List[BaseException] = []
+
+    def note_failure(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None and not failures:
+            failures.append(task.exception())
+
+    async def write(offset: int, rows: List[list]) -> None:
+        try:
+            # Building the request encodes the rows, off the event loop
+            update = await run(
+                sheets_service.spreadsheets().values().update,
+                spreadsheetId=spreadsheet_id,
+                range=f"{prefix}{column}{first_row + offset}",
+                valueInputOption=valueInputOption,
+                body={"values": rows},
+            )
+            # From here on the rows are only held encoded, in the request
+            del rows
+            await execute(update)
+        finally:
+            slots.release()
+
+    rows = cells = 0
+    started = time.perf_counter()
+    try:
+        batches = _batches(parse(request.stream()), settings.SHEETS_WRITE_BATCH_BYTES)
+        async for offset, batch in batches:
+            await slots.acquire()
+            if failures:
+                raise failures[0]
+            with bulk():
+                task = asyncio.create_task(write(offset, batch))
+            task.add_done_callback(note_failure)
+            tasks.append(task)
+            rows += len(batch)
+            cells += sum(map(len, batch))
+        await asyncio.gather(*tasks)
+    except HttpError as e:
+        raise http_exception(e)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return {
+        "spreadsheetId": spreadsheet_id,
+        "updatedRows": rows,
+        "updatedCells": cells,
+        "calls": len(tasks),
+        "seconds": time.perf_counter() - started,
+    }
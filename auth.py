@@ -1,8 +1,10 @@
 from fastapi import APIRouter, Request
 from fastapi.responses import RedirectResponse
+from google.auth import jwt
 from google_auth_oauthlib.flow import Flow
 
 from config import settings
+from google_services import credentials_to_session
 
 router = APIRouter()
 
@@ -33,13 +35,10 @@ async def callback(request: Request):
 
     credentials = flow.credentials
 
-    request.session["credentials"] = {
-        "token": credentials.token,
-        "refresh_token": credentials.refresh_token,
-        "token_uri": credentials.token_uri,
-        "client_id": credentials.client_id,
-        "client_secret": credentials.client_secret,
-        "scopes": credentials.scopes,
-    }
+    request.session["credentials"] = credentials_to_session(credentials)
+    if credentials.id_token:
+        # Received directly from Google's token endpoint, so no need to verify
+        claims = jwt.decode(credentials.id_token, verify=False)
+        request.session["user_id"] = claims["sub"]
 
     return RedirectResponse(url="/drive/search")
@@ -0,0 +1,48 @@
+"""
+Upstream Google calls and latency when a dashboard fans out identical
+GET /drive/{file_id}/comment requests at the same moment, with every
+request calling Google ("separate") and with identical calls coalesced.
+
+Usage:
+    python benchmarks/coalescing.py [concurrent requests] [latency seconds]
+"""
+
+import asyncio
+import sys
+import time
+
+from harness import InMemoryHttp, call, create_app
+
+import api.comments.comments_api as comments_api
+import executor
+from api.comments import comments_router
+
+
+async def fan_out(app, requests: int) -> float:
+    started = time.perf_counter()
+    statuses = await asyncio.gather(
+        *(call(app, "/drive/file-id/comment") for _ in range(requests))
+    )
+    assert set(statuses) == {200}, statuses
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    InMemoryHttp.latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    InMemoryHttp.payload = b'{"comments": []}'
+    app = create_app(comments_router)
+
+    print(f"{'mode':<10} {'upstream':>9} {'elapsed':>10}")
+    for mode in ("separate", "coalesced"):
+        comments_api.execute_shared = (
+            executor.execute if mode == "separate" else executor.execute_shared
+        )
+        InMemoryHttp.calls = 0
+        elapsed = asyncio.run(fan_out(app, requests))
+        print(f"{mode:<10} {InMemoryHttp.calls:>9} {elapsed * 1000:>8.0f}ms")
+    print(f"counters: {executor.coalescing}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Writing whole documents of 100, 1,000 and 10,000 paragraphs through
+PUT /drive/documents/{id}, into a new empty document and over one whose
+every paragraph was reworded: requests and batchUpdate calls sent, and
+time per persist, against the naive translation of one insert and one
+style update per text run and a style update per paragraph.
+
+Usage:
+    python benchmarks/document_compile.py [batch kilobytes]
+"""
+
+import asyncio
+import json
+import sys
+import time
+
+from harness import InMemoryHttp, create_app, request
+
+from api.documents import documents_router
+from config import settings
+
+DOCUMENT = "https://docs.googleapis.com/v1/documents/doc-id"
+SIZES = (100, 1000, 10000)
+calls = []
+http_request = InMemoryHttp.request
+
+
+def recording_request(self, uri, method="GET", body=None, headers=None, **kwargs):
+    if uri.startswith(DOCUMENT + ":batchUpdate"):
+        calls.append(len(json.loads(body)["requests"]))
+    return http_request(self, uri, method, body, headers, **kwargs)
+
+
+def paragraph(number: int, words: str) -> dict:
+    """Headings every ten paragraphs, and a bold lead in every other one."""
+    text = f"{words} {number}, and the rest of its sentence.\n"
+    heading = number % 10 == 0
+    runs = [(text, {})]
+    if not heading and number % 2 == 0:
+        runs = [(text[:12], {"bold": True}), (text[12:], {})]
+    return {
+        "paragraph": {
+            "elements": [
+                {"textRun": {"content": content, "textStyle": style}}
+                for content, style in runs
+            ],
+            "paragraphStyle": {
+                "namedStyleType": "HEADING_2" if heading else "NORMAL_TEXT"
+            },
+        }
+    }
+
+
+def with_indices(content: list) -> list:
+    position = 1
+    indexed = [{"endIndex": 1, "sectionBreak": {}}]
+    for element in content:
+        start = position
+        for run in element["paragraph"]["elements"]:
+            run["startIndex"] = position
+            position += len(run["textRun"]["content"])
+            run["endIndex"] = position
+        indexed.append(dict(element, startIndex=start, endIndex=position))
+    return indexed
+
+
+def naive(content: list) -> int:
+    runs = sum(len(element["paragraph"]["elements"]) for element in content)
+    return 2 * runs + len(content)
+
+
+async def persist(app, current: list, target: list) -> tuple:
+    InMemoryHttp.routes = {
+        DOCUMENT + ":batchUpdate": json.dumps(
+            {"documentId": "doc-id", "writeControl": {"requiredRevisionId": "r2"}}
+        ).encode(),
+        DOCUMENT: json.dumps(
+            {"documentId": "doc-id", "revisionId": "r1", "body": {"content": current}}
+        ).encode(),
+    }
+    body = json.dumps(
+        {"documentId": "doc-id", "title": "Sample", "body": {"content": target}}
+    ).encode()
+    calls.clear()
+    started = time.perf_counter()
+    status, _, response = await request(
+        app,
+        "/drive/documents/doc-id",
+        headers={"Content-Type": "application/json"},
+        method="PUT",
+        content=[body],
+    )
+    elapsed = time.perf_counter() - started
+    assert status == 200, response[:200]
+    result = json.loads(response)
+    assert result["calls"] == len(calls) and sum(calls) >= result["requests"]
+    return result, elapsed
+
+
+async def run() -> None:
+    InMemoryHttp.request = recording_request
+    app = create_app(documents_router)
+    empty = [
+        {"endIndex": 1, "sectionBreak": {}},
+        {
+            "startIndex": 1,
+            "endIndex": 2,
+            "paragraph": {
+                "elements": [
+                    {"startIndex": 1, "endIndex": 2, "textRun": {"content": "\n"}}
+                ],
+                "paragraphStyle": {"namedStyleType": "NORMAL_TEXT"},
+            },
+        },
+    ]
+    # Builds the Docs service, outside the timings
+    await persist(app, empty, [paragraph(0, "Paragraph")])
+    print(
+        f"batchUpdate calls of up to {settings.DOCS_BATCH_UPDATE_BYTES // 2**10}KB\n"
+        f"{'paragraphs':>10} {'into':>9} {'naive':>7} {'requests':>9}"
+        f" {'calls':>6} {'per persist':>12}"
+    )
+    for size in SIZES:
+        target = [paragraph(number, "Paragraph") for number in range(size)]
+        reworded = with_indices(
+            [paragraph(number, "Former text of") for number in range(size)]
+        )
+        for label, current in (("empty", empty), ("reworded", reworded)):
+            result, elapsed = await persist(app, current, target)
+            print(
+                f"{size:>10} {label:>9} {naive(target):>7} {result['requests']:>9}"
+                f" {result['calls']:>6} {elapsed * 1000:>10.0f}ms"
+            )
+
+
+def main() -> None:
+    if len(sys.argv) > 1:
+        settings.DOCS_BATCH_UPDATE_BYTES = int(sys.argv[1]) * 2**10
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
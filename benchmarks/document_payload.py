@@ -0,0 +1,128 @@
+"""
+Latency and peak memory of GET /drive/documents/{id} for synthetic documents
+of increasing size, comparing:
+
+    legacy     Document(**data) returned through response_model (two passes)
+    validated  one validation from the raw bytes (VALIDATE_DOCUMENTS on)
+    trusted    upstream bytes passed through (VALIDATE_DOCUMENTS off)
+
+Usage:
+    python benchmarks/document_payload.py [repeats]
+"""
+
+import asyncio
+import json
+import sys
+import time
+import tracemalloc
+
+from fastapi import Depends
+from harness import InMemoryHttp, create_app, request
+
+from api.documents import documents_router
+from api.documents.documents_api import forget_document
+from api.documents.models import Document
+from config import settings
+from google_services import get_docs_service
+
+
+def synthetic_document(paragraphs: int) -> dict:
+    content = [{"endIndex": 1, "sectionBreak": {"sectionStyle": {}}}]
+    index = 1
+    for i in range(paragraphs):
+        text = f"Paragraph {i} of a synthetic benchmark document.\n"
+        content.append(
+            {
+                "startIndex": index,
+                "endIndex": index + len(text),
+                "paragraph": {
+                    "elements": [
+                        {
+                            "startIndex": index,
+                            "endIndex": index + len(text),
+                            "textRun": {
+                                "content": text,
+                                "textStyle": {
+                                    "bold": i % 2 == 0,
+                                    "fontSize": {"magnitude": 11, "unit": "PT"},
+                                },
+                            },
+                        }
+                    ],
+                    "paragraphStyle": {
+                        "namedStyleType": "NORMAL_TEXT",
+                        "direction": "LEFT_TO_RIGHT",
+                    },
+                },
+            }
+        )
+        index += len(text)
+    return {
+        "documentId": "benchmark",
+        "title": "Benchmark",
+        "revisionId": "rev",
+        "body": {"content": content},
+    }
+
+
+def add_legacy_route(app) -> None:
+    @app.get("/legacy/documents/{document_id}", response_model=Document)
+    async def legacy_get_document(
+        document_id: str, docs_service=Depends(get_docs_service)
+    ):
+        document_data = docs_service.documents().get(documentId=document_id).execute()
+        return Document(**document_data)
+
+
+def fetch(app, path: str) -> int:
+    # Measure rendering, not the revision cache
+    forget_document("benchmark")
+    status, _, _ = asyncio.run(request(app, path))
+    return status
+
+
+def measure(app, path: str, repeats: int) -> tuple:
+    fetch(app, path)
+    started = time.perf_counter()
+    for _ in range(repeats):
+        status = fetch(app, path)
+        assert status == 200, status
+    latency = (time.perf_counter() - started) / repeats
+
+    tracemalloc.start()
+    fetch(app, path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return latency * 1000, peak / 2**20
+
+
+def main() -> None:
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    app = create_app(documents_router)
+    add_legacy_route(app)
+    InMemoryHttp.routes = {
+        "https://www.googleapis.com/drive/v3/files/": json.dumps(
+            {"version": "1"}
+        ).encode()
+    }
+
+    print(
+        f"{'paragraphs':>10} {'payload':>9}  {'mode':<10} {'latency':>10} {'peak':>9}"
+    )
+    for paragraphs in (100, 1000, 10000, 50000):
+        InMemoryHttp.payload = json.dumps(synthetic_document(paragraphs)).encode()
+        size = len(InMemoryHttp.payload) / 2**20
+        runs = [("legacy", "/legacy/documents/benchmark", True)]
+        runs += [("validated", "/drive/documents/benchmark", True)]
+        runs += [("trusted", "/drive/documents/benchmark", False)]
+        for mode, path, validate in runs:
+            settings.VALIDATE_DOCUMENTS = validate
+            latency, peak = measure(app, path, repeats)
+            print(
+                f"{paragraphs:>10} {size:>7.1f}MB  {mode:<10}"
+                f" {latency:>8.1f}ms {peak:>7.1f}MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
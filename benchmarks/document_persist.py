@@ -0,0 +1,153 @@
+"""
+Persisting a document of PARAGRAPHS styled paragraphs through
+PUT /drive/documents/{id} after editing a few of them: batchUpdate requests
+and bytes sent to Google, and time per persist, against replacing the whole
+body (one delete, one insert, then a style update per run).
+
+Usage:
+    python benchmarks/document_persist.py [paragraphs]
+"""
+
+import asyncio
+import copy
+import json
+import sys
+import time
+
+from harness import InMemoryHttp, create_app, request
+
+from api.documents import documents_router
+
+DOCUMENT = "https://docs.googleapis.com/v1/documents/doc-id"
+RUNS = 5
+sent = []
+http_request = InMemoryHttp.request
+
+
+def recording_request(self, uri, method="GET", body=None, headers=None, **kwargs):
+    if uri.startswith(DOCUMENT + ":batchUpdate"):
+        sent.append(body)
+    return http_request(self, uri, method, body, headers, **kwargs)
+
+
+def paragraph(number: int) -> dict:
+    words = f"Paragraph {number} of the sample, with some words in it"
+    return {
+        "paragraph": {
+            "elements": [
+                {"textRun": {"content": words[:20], "textStyle": {"bold": True}}},
+                {"textRun": {"content": words[20:] + ".\n", "textStyle": {}}},
+            ],
+            "paragraphStyle": {"namedStyleType": "NORMAL_TEXT"},
+        }
+    }
+
+
+def with_indices(content: list) -> list:
+    position = 1
+    indexed = [{"startIndex": 0, "endIndex": 1, "sectionBreak": {}}]
+    for element in content:
+        element = copy.deepcopy(element)
+        start = position
+        for run in element["paragraph"]["elements"]:
+            run["startIndex"] = position
+            position += len(run["textRun"]["content"])
+            run["endIndex"] = position
+        element.update(startIndex=start, endIndex=position)
+        indexed.append(element)
+    return indexed
+
+
+def edited(content: list, count: int) -> list:
+    """Rewords count paragraphs spread over the document."""
+    content = copy.deepcopy(content)
+    for number in range(0, len(content), max(len(content) // max(count, 1), 1))[:count]:
+        runs = content[number]["paragraph"]["elements"]
+        runs[1]["textRun"]["content"] = runs[1]["textRun"]["content"].replace(
+            "some", "a few more"
+        )
+    return content
+
+
+def replacement(content: list) -> list:
+    """The requests replacing the whole body with content."""
+    text = "".join(
+        run["textRun"]["content"]
+        for element in content
+        for run in element["paragraph"]["elements"]
+    )
+    requests = [
+        {"deleteContentRange": {"range": {"startIndex": 1, "endIndex": len(text)}}},
+        {"insertText": {"location": {"index": 1}, "text": text}},
+    ]
+    position = 1
+    for element in content:
+        for run in element["paragraph"]["elements"]:
+            end = position + len(run["textRun"]["content"])
+            requests.append(
+                {
+                    "updateTextStyle": {
+                        "range": {"startIndex": position, "endIndex": end},
+                        "textStyle": run["textRun"]["textStyle"],
+                        "fields": "*",
+                    }
+                }
+            )
+            position = end
+    return requests
+
+
+async def run(paragraphs: int) -> None:
+    InMemoryHttp.request = recording_request
+    content = [paragraph(number) for number in range(paragraphs)]
+    InMemoryHttp.routes = {
+        DOCUMENT + ":batchUpdate": json.dumps(
+            {"documentId": "doc-id", "writeControl": {"requiredRevisionId": "r2"}}
+        ).encode(),
+        DOCUMENT: json.dumps(
+            {
+                "documentId": "doc-id",
+                "title": "Sample",
+                "revisionId": "r1",
+                "body": {"content": with_indices(content)},
+            }
+        ).encode(),
+    }
+    app = create_app(documents_router)
+    full = replacement(content)
+    print(
+        f"{paragraphs} paragraphs, replacing the body takes {len(full)} requests"
+        f" of {len(json.dumps({'requests': full})) / 2**10:.0f}KB\n"
+        f"{'edited':>7} {'requests':>9} {'sent':>9} {'per persist':>12}"
+    )
+    for count in (0, 1, 10, 100):
+        body = {"content": edited(content, count)}
+        target = json.dumps(
+            {"documentId": "doc-id", "title": "Sample", "body": body}
+        ).encode()
+        sent.clear()
+        started = time.perf_counter()
+        for _ in range(RUNS):
+            status, _, response = await request(
+                app,
+                "/drive/documents/doc-id",
+                headers={"Content-Type": "application/json"},
+                method="PUT",
+                content=[target],
+            )
+            assert status == 200, response[:200]
+        elapsed = (time.perf_counter() - started) / RUNS
+        size = len(sent[-1]) / 2**10 if sent else 0
+        print(
+            f"{count:>7} {json.loads(response)['requests']:>9} {size:>7.1f}KB"
+            f" {elapsed * 1000:>10.0f}ms"
+        )
+
+
+def main() -> None:
+    paragraphs = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    asyncio.run(run(paragraphs))
+
+
+if __name__ == "__main__":
+    main()
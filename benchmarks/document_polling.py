@@ -0,0 +1,62 @@
+"""
+Cost of a reader polling GET /drive/documents/{id} for an unchanged
+document, comparing:
+
+    uncached     every poll fetches and renders the document again
+    cached       the Drive version check finds the rendered revision cached
+    conditional  the poll sends If-None-Match and is answered with 304
+
+Usage:
+    python benchmarks/document_polling.py [polls] [latency seconds]
+"""
+
+import asyncio
+import json
+import sys
+import time
+
+from document_payload import synthetic_document
+from harness import InMemoryHttp, create_app, request
+
+from api.documents import documents_router
+from api.documents.documents_api import forget_document
+
+DRIVE_FILES = "https://www.googleapis.com/drive/v3/files/"
+
+
+def poll(app, polls: int, mode: str) -> tuple:
+    path = "/drive/documents/benchmark"
+    _, headers, _ = asyncio.run(request(app, path))
+    conditional = {"If-None-Match": headers["etag"]} if mode == "conditional" else {}
+    calls, transferred = InMemoryHttp.calls, 0
+    started = time.perf_counter()
+    for _ in range(polls):
+        if mode == "uncached":
+            forget_document("benchmark")
+        status, _, body = asyncio.run(request(app, path, headers=conditional))
+        assert status == (304 if conditional else 200), status
+        transferred += len(body)
+    latency = (time.perf_counter() - started) / polls
+    upstream = (InMemoryHttp.calls - calls) / polls
+    return latency * 1000, upstream, transferred / polls / 2**10
+
+
+def main() -> None:
+    polls = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    InMemoryHttp.latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+    app = create_app(documents_router)
+
+    InMemoryHttp.routes = {DRIVE_FILES: json.dumps({"version": "7"}).encode()}
+    print(f"{'paragraphs':>10}  {'mode':<12} {'latency':>10} {'calls':>6} {'body':>10}")
+    for paragraphs in (1000, 10000, 50000):
+        InMemoryHttp.payload = json.dumps(synthetic_document(paragraphs)).encode()
+        for mode in ("uncached", "cached", "conditional"):
+            latency, upstream, size = poll(app, polls, mode)
+            print(
+                f"{paragraphs:>10}  {mode:<12} {latency:>8.1f}ms"
+                f" {upstream:>6.1f} {size:>8.1f}KB"
+            )
+
+
+if __name__ == "__main__":
+    main()
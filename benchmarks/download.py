@@ -0,0 +1,86 @@
+"""
+Time to first byte, total time and peak memory of GET /drive/{id}/content
+for one large file, with the whole file fetched in one Google call (as
+files().get_media().execute() would) against DOWNLOAD_CHUNK_SIZE chunks.
+Also checks a Range request returns exactly the bytes asked for.
+
+Usage:
+    python benchmarks/download.py [megabytes] [latency seconds]
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from harness import InMemoryHttp, create_app, request
+
+from api import content_router
+from config import settings
+
+MB = 2**20
+
+
+async def download(app, headers=None) -> tuple:
+    received = 0
+    first_byte = None
+    started = time.perf_counter()
+
+    def on_body(part: bytes) -> None:
+        nonlocal received, first_byte
+        if part and first_byte is None:
+            first_byte = time.perf_counter() - started
+        received += len(part)
+
+    status, _, body = await request(
+        app, "/drive/file-id/content", headers=headers, on_body=on_body
+    )
+    assert status in (200, 206), body
+    return received, first_byte, time.perf_counter() - started
+
+
+async def run(size: int) -> None:
+    InMemoryHttp.media = os.urandom(size)
+    metadata = {"mimeType": "application/octet-stream", "size": str(size)}
+    InMemoryHttp.routes = {
+        "https://www.googleapis.com/drive/v3/files/": json.dumps(metadata).encode()
+    }
+    app = create_app(content_router)
+    print(
+        f"{size // MB}MB file, {InMemoryHttp.latency * 1000:.0f}ms per Google call\n"
+        f"{'chunk':>12} {'first byte':>11} {'total':>8} {'peak memory':>12}"
+    )
+    for chunk in (size, 32 * MB, 8 * MB, 1 * MB):
+        settings.DOWNLOAD_CHUNK_SIZE = chunk
+        tracemalloc.start()
+        received, first_byte, elapsed = await download(app)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert received == size
+        label = "whole file" if chunk == size else f"{chunk // MB}MB"
+        print(
+            f"{label:>12} {first_byte * 1000:>9.0f}ms {elapsed:>7.2f}s"
+            f" {peak / MB:>10.1f}MB"
+        )
+
+    start, end = size // 3, size // 3 + 5 * MB
+    status, headers, body = await request(
+        app, "/drive/file-id/content", headers={"Range": f"bytes={start}-{end}"}
+    )
+    exact = status == 206 and body == InMemoryHttp.media[start : end + 1]
+    print(
+        f"\nRange bytes={start}-{end}: {status} {headers['content-range']}"
+        f", exact bytes: {exact}"
+    )
+
+
+def main() -> None:
+    size = int(sys.argv[1]) * MB if len(sys.argv) > 1 else 256 * MB
+    InMemoryHttp.latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+    asyncio.run(run(size))
+
+
+if __name__ == "__main__":
+    main()
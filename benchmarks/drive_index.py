@@ -0,0 +1,170 @@
+"""
+/drive/search and /drive/navigate answered by Google against the local
+Drive index, over a simulated Drive of FILES files in FOLDERS folders
+(LATENCY seconds per Google call). Also times building the index and
+picking up a change from the changes feed.
+
+Usage:
+    python benchmarks/drive_index.py [files] [latency seconds]
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qs, urlparse
+
+os.environ["DRIVE_INDEX_PATH"] = os.path.join(tempfile.mkdtemp(), "index.sqlite3")
+
+from harness import InMemoryHttp, create_app, request  # noqa: E402
+
+import api.drive  # noqa: E402
+from config import settings  # noqa: E402
+from drive_index import drive_index, drive_sync  # noqa: E402
+
+FOLDER = "application/vnd.google-apps.folder"
+DOC = "application/vnd.google-apps.document"
+FOLDERS = 500
+
+
+class FakeDrive:
+    """Just enough of files.list/get and changes.list for the benchmark."""
+
+    def __init__(self, files: int):
+        self.files = {
+            "root-id": {"id": "root-id", "name": "My Drive", "mimeType": FOLDER}
+        }
+        for i in range(FOLDERS):
+            self.add(f"folder-{i}", f"Folder {i}", FOLDER, "root-id")
+        for i in range(files):
+            self.add(f"file-{i}", f"Report {i} draft", DOC, f"folder-{i % FOLDERS}")
+        self.changes = []
+
+    def add(self, file_id, name, mime_type, parent):
+        self.files[file_id] = {
+            "id": file_id,
+            "name": name,
+            "mimeType": mime_type,
+            "parents": [parent],
+        }
+
+    def change(self, file_id, name, mime_type, parent):
+        self.add(file_id, name, mime_type, parent)
+        self.changes.append({"fileId": file_id, "file": self.files[file_id]})
+
+    def __call__(self, uri: str):
+        url = urlparse(uri)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        path = url.path.removeprefix("/drive/v3/")
+        if path == "changes/startPageToken":
+            return self.json({"startPageToken": str(len(self.changes))})
+        if path == "changes":
+            start = int(query["pageToken"])
+            return self.json(
+                {
+                    "changes": self.changes[start:],
+                    "newStartPageToken": str(len(self.changes)),
+                }
+            )
+        if path.startswith("files/"):
+            file_id = path.removeprefix("files/")
+            return self.json(self.files["root-id" if file_id == "root" else file_id])
+        if path == "files":
+            return self.list(query)
+        return None
+
+    def list(self, query: dict) -> bytes:
+        q = query.get("q", "")
+        matches = list(self.files.values())[1:]
+        if "name contains" in q:
+            term = q.split("'")[1].lower()
+            matches = [
+                f
+                for f in matches
+                if f["name"].lower().startswith(term) or f" {term}" in f["name"].lower()
+            ]
+        elif "in parents" in q:
+            parent = q.split("'")[1]
+            parent = "root-id" if parent == "root" else parent
+            matches = [f for f in matches if f["parents"][0] == parent]
+            if "name=" in q:
+                name = q.split("name='")[1].split("'")[0]
+                matches = [f for f in matches if f["name"] == name]
+        size = int(query.get("pageSize", 100))
+        offset = int(query.get("pageToken", 0))
+        page = {"files": matches[offset : offset + size]}
+        if offset + size < len(matches):
+            page["nextPageToken"] = str(offset + size)
+        return self.json(page)
+
+    @staticmethod
+    def json(data) -> bytes:
+        return json.dumps(data).encode()
+
+
+async def timed(app, path: str, query: str = "") -> tuple:
+    started = time.perf_counter()
+    status, _, body = await request(app, path, query)
+    assert status == 200, (status, body[:200])
+    return (time.perf_counter() - started) * 1000, json.loads(body)
+
+
+async def run(files: int) -> None:
+    drive = FakeDrive(files)
+    InMemoryHttp.handler = drive
+    app = create_app(api.drive.router)
+
+    queries = [
+        ("search", "/drive/search", "name=Report%2042"),
+        ("navigate", "/drive/navigate/Folder 7", ""),
+    ]
+    print(f"{'query':<10} {'source':<8} {'latency':>10} {'results':>8}")
+    for label, path, query in queries:
+        latency, results = await timed(app, path, query)
+        print(f"{label:<10} {'google':<8} {latency:>8.1f}ms {len(results):>8}")
+
+    settings.DRIVE_INDEX_ENABLED = True
+    started = time.perf_counter()
+    # The first request starts the sync and is still answered by Google
+    await timed(app, "/drive/navigate/")
+    while await drive_index.root("benchmark") is None:
+        await asyncio.sleep(0.05)
+    print(f"\nindex of {files} files built in {time.perf_counter() - started:.1f}s\n")
+
+    for label, path, query in queries:
+        await timed(app, path, query)
+        latency, results = await timed(app, path, query)
+        print(f"{label:<10} {'index':<8} {latency:>8.1f}ms {len(results):>8}")
+
+    # The first search above started loading the name index
+    while await drive_index.search_names("benchmark", "x", None, 0, 1) is None:
+        await asyncio.sleep(0.05)
+    for query in ("name=Report%2042", "name=port%2042&pageSize=20"):
+        await timed(app, "/drive/search", query)
+        latency, results = await timed(app, "/drive/search", query)
+        print(f"{'search':<10} {'names':<8} {latency:>8.1f}ms {len(results):>8}")
+
+    # A change made through this API is visible to the next read
+    drive.change("file-new", "Report 42 final", DOC, "folder-7")
+    drive_sync.changed("benchmark")
+    latency, results = await timed(app, "/drive/navigate/Folder 7")
+    visible = any(r["id"] == "file-new" for r in results)
+    print(f"\nread after a change: {latency:.1f}ms, change visible: {visible}")
+    latency, results = await timed(app, "/drive/search", "name=42%20fin")
+    visible = any(r["id"] == "file-new" for r in results)
+    print(f"search after a change: {latency:.1f}ms, change visible: {visible}")
+
+    for task in list(drive_sync._followers.values()):
+        task.cancel()
+
+
+def main() -> None:
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    InMemoryHttp.latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    asyncio.run(run(files))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Requests per second for GET /drive/search, with googleapiclient's build() on
+every request versus the prebuilt resources from google_services.
+
+Usage:
+    python benchmarks/drive_search_rps.py [requests]
+"""
+
+import asyncio
+import sys
+import time
+
+from fastapi import Depends, FastAPI
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+from harness import call, create_app
+
+from api.drive import router
+from google_services import get_credentials, get_drive_service
+
+
+def legacy_drive_service(credentials: Credentials = Depends(get_credentials)):
+    return build("drive", "v3", credentials=credentials)
+
+
+async def measure(app: FastAPI, count: int) -> float:
+    await call(app, "/drive/search", "name=Sample")
+    started = time.perf_counter()
+    for _ in range(count):
+        status = await call(app, "/drive/search", "name=Sample")
+        assert status == 200, status
+    return count / (time.perf_counter() - started)
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    app = create_app(router)
+
+    app.dependency_overrides[get_drive_service] = legacy_drive_service
+    before = asyncio.run(measure(app, count))
+    del app.dependency_overrides[get_drive_service]
+    after = asyncio.run(measure(app, count))
+
+    print(f"discovery build() per request: {before:8.0f} req/s")
+    print(f"prebuilt resources:            {after:8.0f} req/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Listing a whole folder tree with one /drive/tree request against a client
+recursing over /drive/navigate, one request per folder and several at
+once, over a simulated Drive DEPTH levels deep with FANOUT folders
+and FILES files in every folder (LATENCY seconds per Google call).
+
+Usage:
+    python benchmarks/drive_tree.py [depth] [fanout] [files] [latency seconds]
+"""
+
+import asyncio
+import json
+import re
+import sys
+import time
+from urllib.parse import parse_qs, urlparse
+
+from harness import InMemoryHttp, create_app, request
+
+import api.drive
+
+FOLDER = "application/vnd.google-apps.folder"
+DOC = "application/vnd.google-apps.document"
+# Requests a client recursing over /drive/navigate keeps in flight
+CLIENT_CONCURRENCY = 8
+PARENT = re.compile(r"'([^']+)' in parents")
+
+
+class TreeDrive:
+    """A Drive of nested folders answering files.list by parents and name."""
+
+    def __init__(self, depth: int, fanout: int, files: int):
+        self.children = {}
+        level = ["root"]
+        for _ in range(depth):
+            below = []
+            for parent in level:
+                for i in range(fanout):
+                    folder = self.add(f"{parent}.{i}", f"Folder {i}", FOLDER, parent)
+                    below.append(folder)
+                for i in range(files):
+                    self.add(f"{parent}.f{i}", f"File {i}", DOC, parent)
+            level = below
+
+    def add(self, file_id, name, mime_type, parent) -> str:
+        self.children.setdefault(parent, []).append(
+            {"id": file_id, "name": name, "mimeType": mime_type, "parents": [parent]}
+        )
+        return file_id
+
+    def __call__(self, uri: str):
+        url = urlparse(uri)
+        if not url.path.endswith("/files"):
+            return None
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        q = query.get("q", "")
+        matches = [f for p in PARENT.findall(q) for f in self.children.get(p, [])]
+        if "name=" in q:
+            name = q.split("name='")[1].split("'")[0]
+            matches = [f for f in matches if f["name"] == name]
+        size = int(query.get("pageSize", 100))
+        offset = int(query.get("pageToken", 0))
+        page = {"files": matches[offset : offset + size]}
+        if offset + size < len(matches):
+            page["nextPageToken"] = str(offset + size)
+        return json.dumps(page).encode()
+
+
+async def recursive(app) -> int:
+    """What a client does without /drive/tree, CLIENT_CONCURRENCY at a time."""
+    slots = asyncio.Semaphore(CLIENT_CONCURRENCY)
+
+    async def navigate(path: str) -> tuple:
+        async with slots:
+            return await request(app, f"/drive/navigate/{path[1:]}")
+
+    found = 0
+    level = ["/"]
+    while level:
+        responses = await asyncio.gather(*map(navigate, level))
+        level = []
+        for status, _, body in responses:
+            assert status == 200, body[:200]
+            objects = json.loads(body)
+            found += len(objects)
+            level += [o["path"] for o in objects if o["mimeType"] == FOLDER]
+    return found
+
+
+async def tree(app) -> int:
+    status, _, body = await request(app, "/drive/tree/", "format=ndjson")
+    assert status == 200, body[:200]
+    return len(body.splitlines())
+
+
+async def run(depth: int, fanout: int, files: int) -> None:
+    InMemoryHttp.handler = TreeDrive(depth, fanout, files)
+    app = create_app(api.drive.router)
+    print(
+        f"{depth} levels, {fanout} folders and {files} files per folder,"
+        f" {InMemoryHttp.latency * 1000:.0f}ms per Google call"
+    )
+    for label, walk in (("navigate, recursive", recursive), ("tree", tree)):
+        for cache in (api.drive._folder_ids, api.drive._ancestors):
+            cache.discard_where(lambda key, value: True)
+        calls = InMemoryHttp.calls
+        started = time.perf_counter()
+        found = await walk(app)
+        elapsed = time.perf_counter() - started
+        print(
+            f"{label:<20} {found:>7} objects  {elapsed:>6.2f}s"
+            f"  {InMemoryHttp.calls - calls:>5} Google calls"
+        )
+
+
+def main() -> None:
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    fanout = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+    files = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    InMemoryHttp.latency = float(sys.argv[4]) if len(sys.argv) > 4 else 0.05
+    asyncio.run(run(depth, fanout, files))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+Shared helpers for the benchmarks: an in-memory Google transport and a
+minimal in-process ASGI client, so runs need neither network access nor
+Google credentials.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("HOST", "localhost")
+os.environ.setdefault("PORT", "8000")
+# Benchmarks opt in to the Drive index themselves
+os.environ.setdefault("DRIVE_INDEX_ENABLED", "false")
+# Google is simulated, so only InMemoryHttp.quota limits the request rate
+for quota in ("GOOGLE_PROJECT", "GOOGLE_USER"):
+    os.environ.setdefault(f"{quota}_RATE", "1e9")
+    os.environ.setdefault(f"{quota}_BURST", "1e9")
+
+import googleapiclient.http  # noqa: E402
+import httplib2  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from google.oauth2.credentials import Credentials  # noqa: E402
+
+import google_services  # noqa: E402
+import transport  # noqa: E402
+from google_services import get_credentials, get_user_id  # noqa: E402
+
+UPLOAD_SESSION = "https://upload.test/session/"
+BATCH_PART = re.compile(r"Content-ID: <([^>]+)>.*?\r?\n\r?\n\w+ (\S+)", re.S)
+
+RATE_LIMITED = json.dumps(
+    {
+        "error": {
+            "code": 403,
+            "message": "User rate limit exceeded.",
+            "errors": [{"reason": "userRateLimitExceeded", "domain": "usageLimits"}],
+        }
+    }
+).encode()
+
+FILES = {
+    "files": [
+        {
+            "id": f"id-{i}",
+            "name": f"Sample {i}",
+            "mimeType": "application/vnd.google-apps.document",
+            "parents": ["root"],
+        }
+        for i in range(20)
+    ]
+}
+
+
+class InMemoryHttp:
+    """
+    Answers Google API calls with what handler(uri) returns, if set and not
+    None, else with the payload of the first routes prefix the URI starts
+    with, otherwise with payload, by default FILES. Media downloads
+    (alt=media) are answered from media, honouring Range headers, and
+    resumable uploads are received into uploads, failing upload_errors of
+    the chunks with 503 after taking only part of them.
+    """
+
+    timeout = None
+    redirect_codes = frozenset()
+    follow_redirects = True
+    connections: dict = {}
+    latency = 0.0
+    payload = json.dumps(FILES).encode()
+    routes: dict = {}
+    handler: Optional[Callable[[str], Optional[bytes]]] = None
+    media = b""
+    # Upload session URI -> {"metadata", "received", "sha256"}
+    uploads: dict = {}
+    upload_errors = 0.0
+    calls = 0
+    # Requests per second Google accepts before answering 403
+    # userRateLimitExceeded, or None for no limit
+    quota: Optional[float] = None
+    _allowance = 0.0
+    _checked = time.monotonic()
+    _lock = threading.Lock()
+
+    @classmethod
+    def within_quota(cls) -> bool:
+        with cls._lock:
+            now = time.monotonic()
+            cls._allowance = min(
+                cls.quota, cls._allowance + (now - cls._checked) * cls.quota
+            )
+            cls._checked = now
+            if cls._allowance < 1:
+                return False
+            cls._allowance -= 1
+            return True
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        InMemoryHttp.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.quota is not None and not self.within_quota():
+            return httplib2.Response({"status": 403}), RATE_LIMITED
+        if "/batch/" in uri:
+            return self.batch(body)
+        if "alt=media" in uri:
+            return self.download((headers or {}).get("range"))
+        if "uploadType=resumable" in uri:
+            return self.start_upload(body)
+        if uri.startswith(UPLOAD_SESSION):
+            headers = {k.lower(): v for k, v in (headers or {}).items()}
+            return self.upload(uri, body or b"", headers.get("content-range"))
+        return httplib2.Response({"status": 200}), self.route(uri)
+
+    def download(self, byte_range: Optional[str]) -> tuple:
+        size = len(self.media)
+        # Copied, as reading them off a socket would
+        media = memoryview(self.media)
+        if byte_range is None:
+            return httplib2.Response({"status": 200}), media.tobytes()
+        first, last = byte_range.removeprefix("bytes=").split("-")
+        start, end = int(first), min(int(last), size - 1)
+        headers = {"status": 206, "content-range": f"bytes {start}-{end}/{size}"}
+        return httplib2.Response(headers), media[start : end + 1].tobytes()
+
+    @classmethod
+    def start_upload(cls, body) -> tuple:
+        with cls._lock:
+            uri = f"{UPLOAD_SESSION}{len(cls.uploads)}"
+            cls.uploads[uri] = {
+                "metadata": json.loads(body or "{}"),
+                "received": 0,
+                "sha256": hashlib.sha256(),
+            }
+        return httplib2.Response({"status": 200, "location": uri}), b""
+
+    def upload(self, uri: str, body: bytes, content_range: Optional[str]) -> tuple:
+        session = self.uploads[uri]
+        total = "0"
+        if content_range is not None:
+            span, total = content_range.removeprefix("bytes ").split("/")
+            if span != "*" and int(span.split("-")[0]) == session["received"]:
+                taken = len(body)
+                failed = random.random() < self.upload_errors
+                if failed:
+                    taken = random.randrange(0, len(body) + 1, 256 * 2**10)
+                session["sha256"].update(memoryview(body)[:taken])
+                session["received"] += taken
+                if failed:
+                    return httplib2.Response({"status": 503}), b"{}"
+        if total != "*" and session["received"] == int(total):
+            item = dict(session["metadata"], id=uri.rsplit("/", 1)[1])
+            return httplib2.Response({"status": 200}), json.dumps(item).encode()
+        headers = {"status": 308}
+        if session["received"]:
+            headers["range"] = f"bytes=0-{session['received'] - 1}"
+        return httplib2.Response(headers), b""
+
+    def route(self, uri: str) -> bytes:
+        handler = InMemoryHttp.handler
+        payload = handler(uri) if handler else None
+        if payload is not None:
+            return payload
+        return next(
+            (p for prefix, p in self.routes.items() if uri.startswith(prefix)),
+            self.payload,
+        )
+
+    def batch(self, body) -> tuple:
+        """Answers each part of a batch request like a request of its own."""
+        body = body.decode() if isinstance(body, bytes) else body
+        parts = []
+        for content_id, path in BATCH_PART.findall(body):
+            payload = self.route("https://www.googleapis.com" + path).decode()
+            parts.append(
+                f"--batch\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n"
+                f"{payload}\r\n"
+            )
+        content = "".join(parts) + "--batch--\r\n"
+        headers = {"status": 200, "content-type": "multipart/mixed; boundary=batch"}
+        return httplib2.Response(headers), content.encode()
+
+    def close(self):
+        pass
+
+
+def create_app(*routers) -> FastAPI:
+    """Builds an app around the given routers with Google traffic in memory."""
+    googleapiclient.http.build_http = InMemoryHttp
+    google_services.build_http = InMemoryHttp
+    transport.build_http = InMemoryHttp
+
+    app = FastAPI()
+    for router in routers:
+        app.include_router(router)
+    app.dependency_overrides[get_credentials] = lambda: Credentials(token="token")
+    app.dependency_overrides[get_user_id] = lambda: "benchmark"
+    return app
+
+
+async def request(
+    app: FastAPI,
+    path: str,
+    query: str = "",
+    headers: Optional[dict] = None,
+    on_body: Optional[Callable[[bytes], None]] = None,
+    method: str = "GET",
+    content: Iterable[bytes] = (),
+) -> tuple:
+    """
+    Sends one request through the app; returns (status, headers, body).
+    With on_body, each part of the body is passed to it instead of kept.
+    The request body is sent one part of content at a time.
+    """
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(b"host", b"localhost")]
+        + [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "client": ("127.0.0.1", 0),
+        "server": ("localhost", 8000),
+    }
+    status, response_headers, body = 0, {}, []
+    parts = iter(content)
+    part = next(parts, b"")
+    request_sent = False
+    response_done = asyncio.Event()
+
+    async def receive():
+        nonlocal part, request_sent
+        if not request_sent:
+            current, part = part, next(parts, None)
+            request_sent = part is None
+            more_body = part is not None
+            return {"type": "http.request", "body": current, "more_body": more_body}
+        await response_done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            response_headers.update(
+                (k.decode(), v.decode()) for k, v in message["headers"]
+            )
+        elif message["type"] == "http.response.body":
+            if on_body is not None:
+                on_body(message.get("body", b""))
+            else:
+                body.append(message.get("body", b""))
+            if not message.get("more_body"):
+                response_done.set()
+
+    await app(scope, receive, send)
+    return status, response_headers, b"".join(body)
+
+
+async def call(app: FastAPI, path: str, query: str = "") -> int:
+    """Sends one GET request through the app and returns the status code."""
+    status, _, _ = await request(app, path, query)
+    return status
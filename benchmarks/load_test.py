@@ -0,0 +1,64 @@
+"""
+Tail latency of GET /drive/search under many concurrent clients when every
+Google round trip takes a fixed time.
+
+Runs the same load twice: with Google calls executed inline on the event
+loop (the old behaviour) and through the executor thread pool.
+
+Usage:
+    python benchmarks/load_test.py [clients] [requests_per_client] [latency_ms]
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+
+from harness import InMemoryHttp, call, create_app
+
+import api.drive
+import executor
+
+
+async def inline_execute(request, **kwargs):
+    return request.execute(**kwargs)
+
+
+async def client(app, count: int, latencies: list) -> None:
+    for _ in range(count):
+        started = time.perf_counter()
+        status = await call(app, "/drive/search", "name=Sample")
+        latencies.append(time.perf_counter() - started)
+        assert status == 200, status
+
+
+async def measure(app, clients: int, count: int) -> list:
+    latencies = []
+    await asyncio.gather(*(client(app, count, latencies) for _ in range(clients)))
+    return sorted(latencies)
+
+
+def report(label: str, latencies: list) -> None:
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    print(
+        f"{label:<10} p50 {pct(0.50):8.1f} ms  p95 {pct(0.95):8.1f} ms  "
+        f"p99 {pct(0.99):8.1f} ms  mean {statistics.mean(latencies) * 1000:8.1f} ms"
+    )
+
+
+def main() -> None:
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 128
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    InMemoryHttp.latency = (int(sys.argv[3]) if len(sys.argv) > 3 else 50) / 1000
+    app = create_app(api.drive.router)
+
+    api.drive.execute = inline_execute
+    report("inline", asyncio.run(measure(app, clients, count)))
+    api.drive.execute = executor.execute
+    report("executor", asyncio.run(measure(app, clients, count)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Type-ahead query latency of the in-memory name index over synthetic Drive
+names: prefixes of names and of later words, substrings, and mimeType
+filtered queries, as a user types them one keystroke at a time.
+
+Usage:
+    python benchmarks/name_search.py [names] [queries]
+"""
+
+import random
+import resource
+import statistics
+import sys
+import time
+
+import harness  # noqa: F401  (puts the repository on sys.path)
+
+from name_index import NameIndex
+
+WORDS = (
+    "report budget invoice meeting notes draft final plan roadmap design"
+    " review summary q1 q2 q3 q4 2023 2024 2025 team sales marketing hr legal"
+    " contract proposal brief analysis forecast customer product launch"
+    " onboarding policy handbook minutes agenda retro sprint backlog"
+).split()
+MIME_TYPES = [
+    "application/vnd.google-apps.document",
+    "application/vnd.google-apps.spreadsheet",
+    "application/vnd.google-apps.presentation",
+    "application/vnd.google-apps.folder",
+    "application/pdf",
+    "image/png",
+]
+
+
+def synthetic_rows(count: int, rng: random.Random):
+    for i in range(count):
+        words = rng.sample(WORDS, rng.randint(2, 5))
+        name = " ".join(words).title() + f" {i}"
+        yield (f"id-{i}", name, rng.choice(MIME_TYPES), f"folder-{i % 5000}")
+
+
+def keystrokes(rng: random.Random, count: int):
+    """Queries as typed: each prefix of a term, 1 to its full length."""
+    queries = []
+    while len(queries) < count:
+        kind = rng.random()
+        if kind < 0.6:
+            term = rng.choice(WORDS)
+        elif kind < 0.8:
+            term = f"{rng.choice(WORDS)} {rng.choice(WORDS)}"
+        else:
+            word = rng.choice(WORDS)
+            term = word[1:] if len(word) > 4 else f"{word} {rng.randint(0, 999)}"
+        mime = rng.choice(MIME_TYPES) if rng.random() < 0.3 else None
+        queries += [(term[:n], mime) for n in range(1, len(term) + 1)]
+    return queries[:count]
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    rng = random.Random(7)
+
+    started = time.perf_counter()
+    index = NameIndex(synthetic_rows(count, rng))
+    build = time.perf_counter() - started
+    # Peak resident memory of the process, in kilobytes on Linux
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+    print(f"{count} names indexed in {build:.1f}s, peak RSS {memory:.0f}MB")
+
+    for i in range(1000):
+        index.add((f"new-{i}", f"Fresh Upload {i}", MIME_TYPES[0], "root"))
+        index.remove(f"id-{i}")
+
+    latencies = []
+    misses = 0
+    for term, mime in keystrokes(rng, queries):
+        started = time.perf_counter()
+        results = index.search(term, mime, 20)
+        latencies.append(time.perf_counter() - started)
+        misses += not results
+    latencies.sort()
+    p = lambda q: latencies[int(len(latencies) * q)] * 1000  # noqa: E731
+    print(
+        f"{len(latencies)} queries (limit 20, after 2000 changes):"
+        f" p50 {p(0.5):.3f}ms  p99 {p(0.99):.3f}ms  max {latencies[-1] * 1000:.3f}ms"
+        f"  mean {statistics.mean(latencies) * 1000:.3f}ms  no results {misses}"
+    )
+
+
+if __name__ == "__main__":
+    main()
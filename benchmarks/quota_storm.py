@@ -0,0 +1,134 @@
+"""
+Behaviour of Google calls under a burst larger than the quota, with Google
+simulated as accepting QUOTA requests per second and answering the rest
+with 403 userRateLimitExceeded. The scheduler is configured for 1.5x the
+real quota, so it has to find the ceiling itself.
+
+    naive      calls go straight to Google; clients retry a rejected call
+               at once, as they do when the error is passed through
+    scheduled  calls go through executor.execute (quota buckets, backoff
+               with jitter, rate adaptation)
+
+A second run measures interactive reads issued while bulk calls saturate
+the quota, in the bulk lane and without it.
+
+Usage:
+    python benchmarks/quota_storm.py [clients] [seconds]
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+from harness import InMemoryHttp, create_app
+
+import executor
+from config import settings
+from google_services import build_service
+
+QUOTA = 100
+
+
+def fresh_scheduler() -> None:
+    settings.GOOGLE_USER_RATE = settings.GOOGLE_USER_BURST = QUOTA * 1.5
+    executor.scheduler = executor.Scheduler(
+        32, 24, executor.TokenBucket(QUOTA * 1.5, QUOTA * 1.5, 0.05)
+    )
+    executor._user_buckets = executor.TTLCache(100, 3600)
+
+
+async def naive(request):
+    while True:
+        try:
+            return await executor.run(request.execute)
+        except HttpError:
+            continue
+
+
+async def storm(mode: str, clients: int, seconds: float) -> None:
+    fresh_scheduler()
+    executor.current_user.set("storm")
+    drive = build_service("drive", "v3", Credentials(token="token"))
+    call = naive if mode == "naive" else executor.execute
+    deadline = time.monotonic() + seconds
+    done = failed = 0
+
+    async def client():
+        nonlocal done, failed
+        while time.monotonic() < deadline:
+            try:
+                await call(drive.files().get(fileId="id"))
+                done += 1
+            except HttpError:
+                failed += 1
+
+    InMemoryHttp.calls = 0
+    await asyncio.gather(*(client() for _ in range(clients)))
+    print(
+        f"{mode:<10} {done / seconds:>8.1f}/s {InMemoryHttp.calls / seconds:>9.1f}/s"
+        f" {failed:>7} {done / max(InMemoryHttp.calls, 1):>9.0%}"
+    )
+
+
+async def interactive_latency(lane: bool, clients: int, seconds: float) -> None:
+    fresh_scheduler()
+    executor.current_user.set("mixed")
+    drive = build_service("drive", "v3", Credentials(token="token"))
+    deadline = time.monotonic() + seconds
+    latencies = []
+
+    async def bulk_client():
+        while time.monotonic() < deadline:
+            try:
+                await executor.execute(drive.files().get(fileId="bulk"))
+            except HttpError:
+                pass
+
+    async def reader():
+        await asyncio.sleep(1)
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            await executor.execute(drive.files().get(fileId="read"))
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(0.1)
+
+    async def bulk_load():
+        if lane:
+            with executor.bulk():
+                await asyncio.gather(*(bulk_client() for _ in range(clients)))
+        else:
+            await asyncio.gather(*(bulk_client() for _ in range(clients)))
+
+    await asyncio.gather(bulk_load(), reader())
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)]
+    print(
+        f"{'bulk lane' if lane else 'same lane':<10}"
+        f" p50 {statistics.median(latencies) * 1000:>7.1f} ms"
+        f"  p95 {p95 * 1000:>7.1f} ms"
+    )
+
+
+def main() -> None:
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    create_app()
+    InMemoryHttp.payload = b'{"id": "id"}'
+    InMemoryHttp.latency = 0.02
+    InMemoryHttp.quota = QUOTA
+
+    print(
+        f"{'mode':<10} {'succeeded':>10} {'upstream':>10} {'failed':>7} {'accepted':>9}"
+    )
+    for mode in ("naive", "scheduled"):
+        asyncio.run(storm(mode, clients, seconds))
+    print()
+    for lane in (False, True):
+        asyncio.run(interactive_latency(lane, clients, seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Reading ROWS x COLUMNS cells through GET /drive/spreadsheets/{id}, as
+GridData (includeGridData=true) against values=true: bytes Google sends,
+bytes returned and time per request. Google's cells are simulated with the
+fields a plain values cell has in a real GridData response.
+
+Usage:
+    python benchmarks/sheet_read.py [rows] [columns]
+"""
+
+import asyncio
+import json
+import sys
+import time
+
+from harness import InMemoryHttp, create_app, request
+
+import api.spreadsheets
+
+RUNS = 5
+
+
+def values(rows: int, columns: int) -> list:
+    return [
+        [str(row * col) if col % 2 else f"name {row}" for col in range(columns)]
+        for row in range(rows)
+    ]
+
+
+def cell(value: str) -> dict:
+    number = value.isdigit()
+    typed = {"numberValue": int(value)} if number else {"stringValue": value}
+    return {
+        "userEnteredValue": typed,
+        "effectiveValue": typed,
+        "formattedValue": value,
+        "effectiveFormat": {
+            "backgroundColor": {"red": 1, "green": 1, "blue": 1},
+            "padding": {"top": 2, "right": 3, "bottom": 2, "left": 3},
+            "horizontalAlignment": "RIGHT" if number else "LEFT",
+            "verticalAlignment": "BOTTOM",
+            "wrapStrategy": "OVERFLOW_CELL",
+            "textFormat": {
+                "foregroundColor": {},
+                "fontFamily": "arial,sans,sans-serif",
+                "fontSize": 10,
+                "bold": False,
+                "italic": False,
+                "strikethrough": False,
+                "underline": False,
+            },
+            "hyperlinkDisplayType": "PLAIN_TEXT",
+        },
+    }
+
+
+def responses(rows: int, columns: int) -> tuple:
+    table = values(rows, columns)
+    grid = {
+        "spreadsheetId": "sheet-id",
+        "sheets": [
+            {
+                "properties": {"sheetId": 0, "title": "Data"},
+                "data": [
+                    {"rowData": [{"values": list(map(cell, row))} for row in table]}
+                ],
+            }
+        ],
+    }
+    value_ranges = {
+        "spreadsheetId": "sheet-id",
+        "valueRanges": [
+            {"range": "Data!A1", "majorDimension": "ROWS", "values": table}
+        ],
+    }
+    return json.dumps(grid).encode(), json.dumps(value_ranges).encode()
+
+
+async def run(rows: int, columns: int) -> None:
+    grid, value_ranges = responses(rows, columns)
+    InMemoryHttp.routes = {
+        "https://sheets.googleapis.com/v4/spreadsheets/sheet-id/values": value_ranges,
+        "https://sheets.googleapis.com/v4/spreadsheets/sheet-id": grid,
+    }
+    app = create_app(api.spreadsheets.router)
+    print(f"{rows} rows x {columns} columns")
+    for label, query, sent in (
+        ("GridData", "includeGridData=true&ranges=Data", grid),
+        ("values", "values=true&ranges=Data", value_ranges),
+    ):
+        started = time.perf_counter()
+        for _ in range(RUNS):
+            status, _, body = await request(app, "/drive/spreadsheets/sheet-id", query)
+            assert status == 200, body[:200]
+        elapsed = (time.perf_counter() - started) / RUNS
+        print(
+            f"{label:<9} from Google {len(sent) / 2**20:>7.2f}MB"
+            f"  returned {len(body) / 2**20:>7.2f}MB  {elapsed * 1000:>7.0f}ms"
+        )
+
+
+def main() -> None:
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    columns = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    asyncio.run(run(rows, columns))
+
+
+if __name__ == "__main__":
+    main()
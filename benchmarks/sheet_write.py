@@ -0,0 +1,104 @@
+"""
+Writing ROWS x COLUMNS cells to a sheet through
+POST /drive/spreadsheets/{id}/values, as CSV and as a JSON array, for
+several batch sizes and concurrencies: Google calls made, total time and
+peak memory. Each run checks every cell sent arrived at Google once.
+
+Usage:
+    python benchmarks/sheet_write.py [rows] [columns] [latency seconds]
+"""
+
+import asyncio
+import json
+import sys
+import time
+import tracemalloc
+
+from harness import InMemoryHttp, create_app, request
+
+import api.spreadsheets
+from config import settings
+
+KB = 2**10
+written = []
+http_request = InMemoryHttp.request
+
+
+def recording_request(self, uri, method="GET", body=None, headers=None, **kwargs):
+    if method == "PUT" and "/values/" in uri:
+        written.append(sum(map(len, json.loads(body)["values"])))
+    return http_request(self, uri, method, body, headers, **kwargs)
+
+
+def rows_of(rows: int, columns: int):
+    values = [f"value {column}" for column in range(columns)]
+    for start in range(0, rows, 1000):
+        yield [[row, *values] for row in range(start, min(start + 1000, rows))]
+
+
+def csv_body(rows: int, columns: int):
+    for block in rows_of(rows, columns):
+        yield "".join(",".join(map(str, row)) + "\n" for row in block).encode()
+
+
+def json_body(rows: int, columns: int):
+    separator = b"["
+    for block in rows_of(rows, columns):
+        yield separator + json.dumps(block)[1:-1].encode()
+        separator = b","
+    yield b"]"
+
+
+async def write(app, content_type: str, content) -> dict:
+    status, _, response = await request(
+        app,
+        "/drive/spreadsheets/sheet-id/values",
+        "range=Data!A1",
+        headers={"Content-Type": content_type},
+        method="POST",
+        content=content,
+    )
+    assert status == 200, response[:200]
+    return json.loads(response)
+
+
+async def run(rows: int, columns: int) -> None:
+    InMemoryHttp.request = recording_request
+    app = create_app(api.spreadsheets.router)
+    # Loads the Sheets API discovery document
+    await write(app, "text/csv", [b"warm,up\n"])
+    print(
+        f"{rows} rows x {columns + 1} columns, {InMemoryHttp.latency * 1000:.0f}ms"
+        f" per Google call\n{'format':>6} {'batch':>7} {'in flight':>9}"
+        f" {'calls':>6} {'total':>7} {'peak memory':>12} {'cells ok':>9}"
+    )
+    for content_type, body in (("text/csv", csv_body), ("application/json", json_body)):
+        for batch_bytes, concurrency in ((256 * KB, 1), (256 * KB, 4), (2048 * KB, 4)):
+            settings.SHEETS_WRITE_BATCH_BYTES = batch_bytes
+            settings.SHEETS_WRITE_CONCURRENCY = concurrency
+            # Timed, then again for memory, which tracing slows down
+            written.clear()
+            started = time.perf_counter()
+            result = await write(app, content_type, body(rows, columns))
+            elapsed = time.perf_counter() - started
+            ok = result["updatedCells"] == sum(written) == rows * (columns + 1)
+            tracemalloc.start()
+            await write(app, content_type, body(rows, columns))
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"{content_type.split('/')[1]:>6} {batch_bytes // KB:>5}KB"
+                f" {concurrency:>9} {result['calls']:>6} {elapsed:>6.2f}s"
+                f" {peak / 2**20:>10.1f}MB {str(ok):>9}"
+            )
+
+
+def main() -> None:
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    columns = int(sys.argv[2]) if len(sys.argv) > 2 else 9
+    InMemoryHttp.latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.3
+    asyncio.run(run(rows, columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Throughput and peak memory of POST /drive/upload for one large body sent
+in PART_SIZE messages, per chunk size, and the same upload with a share of
+the chunks failing with 503 after Google took only part of them. Each run
+checks Google received exactly the bytes sent.
+
+Usage:
+    python benchmarks/upload.py [megabytes] [latency seconds] [error rate]
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from harness import InMemoryHttp, create_app, request
+
+from api import content_router
+
+MB = 2**20
+# Size of the body messages the server receives
+PART_SIZE = 64 * 2**10
+BLOCK = os.urandom(MB)
+
+
+def body(size: int):
+    for offset in range(0, size, PART_SIZE):
+        start = offset % len(BLOCK)
+        yield BLOCK[start : start + min(PART_SIZE, size - offset)]
+
+
+async def upload(app, size: int, chunk: int) -> tuple:
+    started = time.perf_counter()
+    status, _, response = await request(
+        app,
+        "/drive/upload",
+        f"name=upload.bin&chunkSize={chunk}",
+        headers={"Content-Type": "application/octet-stream"},
+        method="POST",
+        content=body(size),
+    )
+    elapsed = time.perf_counter() - started
+    assert status == 200, response[:200]
+    result = json.loads(response)
+    session = list(InMemoryHttp.uploads.values())[-1]
+    assert result["size"] == session["received"] == size, (result, session, size)
+    return elapsed, result["retries"], session["sha256"].hexdigest()
+
+
+async def run(size: int, errors: float) -> None:
+    expected = hashlib.sha256()
+    for part in body(size):
+        expected.update(part)
+    app = create_app(content_router)
+    print(
+        f"{size // MB}MB body in {PART_SIZE // 2**10}KB messages,"
+        f" {InMemoryHttp.latency * 1000:.0f}ms per Google call\n"
+        f"{'chunk':>6} {'errors':>7} {'total':>8} {'MB/s':>7} {'peak memory':>12}"
+        f" {'retries':>8} {'exact bytes':>12}"
+    )
+    for rate in (0.0, errors):
+        InMemoryHttp.upload_errors = rate
+        for chunk in (32 * MB, 8 * MB, 1 * MB):
+            tracemalloc.start()
+            elapsed, retries, digest = await upload(app, size, chunk)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"{chunk // MB:>4}MB {rate:>7.0%} {elapsed:>7.2f}s"
+                f" {size / MB / elapsed:>7.1f} {peak / MB:>10.1f}MB {retries:>8}"
+                f" {str(digest == expected.hexdigest()):>12}"
+            )
+
+
+def main() -> None:
+    size = int(sys.argv[1]) * MB if len(sys.argv) > 1 else 256 * MB
+    InMemoryHttp.latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+    errors = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+    asyncio.run(run(size, errors))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries expire ttl seconds after being set."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def discard_where(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """Removes every entry for which predicate(key, value) is true."""
+        with self._lock:
+            stale = [k for k, (_, v) in self._entries.items() if predicate(k, v)]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SizedLRUCache:
+    """Thread-safe LRU mapping bounded by the total size of its values."""
+
+    def __init__(self, maxbytes: int):
+        self.maxbytes = maxbytes
+        self.size = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, size: int) -> None:
+        """Stores value as taking size bytes; values over the budget are not kept."""
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[0]
+            if size > self.maxbytes:
+                return
+            self._entries[key] = (size, value)
+            self.size += size
+            while self.size > self.maxbytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= evicted
+
+    def discard_where(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """Removes every entry for which predicate(key, value) is true."""
+        with self._lock:
+            stale = [k for k, (_, v) in self._entries.items() if predicate(k, v)]
+            for key in stale:
+                self.size -= self._entries.pop(key)[0]
+            return len(stale)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -16,6 +16,105 @@ class Settings(BaseSettings):
         "https://www.googleapis.com/auth/drive",
         "openid",
     ]
+    # Threads running blocking Google API calls, and calls allowed to wait
+    # for one of them before new calls are rejected with 503
+    GOOGLE_POOL_SIZE: int = 32
+    GOOGLE_QUEUE_DEPTH: int = 256
+    # Of those threads, how many bulk calls (e.g. batch deletes) leave free
+    # for interactive ones
+    GOOGLE_INTERACTIVE_RESERVE: int = 8
+    # Google API quota, in requests per second (batches count each request),
+    # with the burst allowed per project and per user
+    GOOGLE_PROJECT_RATE: float = 200
+    GOOGLE_PROJECT_BURST: float = 400
+    GOOGLE_USER_RATE: float = 100
+    GOOGLE_USER_BURST: float = 200
+    # A rate limit halves the rate, which then recovers by this share of the
+    # configured rate per second
+    GOOGLE_RATE_RECOVERY: float = 0.05
+    # Retries of rate-limited and 5xx calls, with full-jitter exponential
+    # backoff from GOOGLE_BACKOFF_BASE up to GOOGLE_BACKOFF_MAX seconds
+    GOOGLE_MAX_RETRIES: int = 5
+    GOOGLE_BACKOFF_BASE: float = 0.5
+    GOOGLE_BACKOFF_MAX: float = 32
+    # Seconds a shared GET response keeps answering identical requests after
+    # it arrived (0: only requests made while it is in flight share it)
+    COALESCE_WINDOW: float = 0
+    COALESCE_CACHE_SIZE: int = 1000
+    # Pooled connections to Google shared by every API client: how many
+    # httplib2.Http (each with one connection per host) may exist, whether
+    # they are kept alive between calls, and after how many idle seconds a
+    # connection is dropped rather than reused
+    GOOGLE_HTTP_POOL_SIZE: int = 32
+    GOOGLE_HTTP_KEEPALIVE: bool = True
+    GOOGLE_HTTP_IDLE_TIMEOUT: float = 60
+    # Credentials kept per user between requests, and how long before expiry
+    # their access token is refreshed in the background
+    CREDENTIALS_CACHE_SIZE: int = 10000
+    CREDENTIALS_CACHE_TTL: float = 3600
+    TOKEN_REFRESH_MARGIN: float = 300
+    # Cached (parent folder, name) -> folder id lookups for /drive/navigate
+    FOLDER_CACHE_SIZE: int = 10000
+    FOLDER_CACHE_TTL: float = 300
+    # Cached folder id -> (name, parent id) used to build paths of search hits
+    ANCESTOR_CACHE_SIZE: int = 100000
+    ANCESTOR_CACHE_TTL: float = 600
+    # Local index of every active user's Drive metadata, kept current from
+    # the changes feed, answering /drive/search and /drive/navigate. Users
+    # are followed while they made a request in the last idle timeout.
+    DRIVE_INDEX_ENABLED: bool = True
+    DRIVE_INDEX_PATH: str = "drive_index.sqlite3"
+    DRIVE_INDEX_THREADS: int = 4
+    DRIVE_INDEX_POLL_INTERVAL: float = 30
+    DRIVE_INDEX_IDLE_TIMEOUT: float = 3600
+    # In-memory name index of each followed user for ranked /drive/search
+    # type-ahead; about 500 bytes of memory per file
+    DRIVE_NAME_INDEX_ENABLED: bool = True
+    # /drive/tree: folders OR'd into one files().list query, such queries in
+    # flight at once per request, and the deepest level it lists
+    TREE_PARENTS_PER_QUERY: int = 50
+    TREE_CONCURRENCY: int = 4
+    TREE_MAX_DEPTH: int = 20
+    # Batches of up to 100 deletes that /drive/batch-delete sends at once
+    BATCH_DELETE_CONCURRENCY: int = 4
+    # Bytes of file content or export fetched from Google per call, and so
+    # held in memory per download
+    DOWNLOAD_CHUNK_SIZE: int = 8 * 2**20
+    # Bytes of an upload sent to Google per call, a multiple of 256 KiB;
+    # an upload holds about three of them in memory
+    UPLOAD_CHUNK_SIZE: int = 8 * 2**20
+    # Rows written to a sheet per Google call, as bytes of JSON values (Google
+    # recommends at most 2 MB per request), and such calls in flight at once
+    SHEETS_WRITE_BATCH_BYTES: int = 2 * 2**20
+    SHEETS_WRITE_CONCURRENCY: int = 4
+    # Largest documents().batchUpdate body a document persist sends, in
+    # bytes of JSON requests; bigger persists take several calls in a row
+    DOCS_BATCH_UPDATE_BYTES: int = 4 * 2**20
+    # Comments of (user, file) held in memory for GET /drive/{id}/comment,
+    # how many seconds a listing answers before asking Google for what
+    # changed, and after how many the file is listed in full again
+    COMMENT_CACHE_SIZE: int = 10000
+    COMMENT_REFRESH_INTERVAL: float = 10
+    COMMENT_CACHE_TTL: float = 3600
+    # Background jobs (/jobs): where their state is kept, how many run at
+    # once overall and per user, how many a user may have queued or running,
+    # how often a running job's progress is saved, and how many seconds
+    # finished ones are kept
+    JOBS_PATH: str = "jobs.sqlite3"
+    JOBS_WORKERS: int = 8
+    JOBS_PER_USER: int = 2
+    JOBS_MAX_PENDING: int = 20
+    JOBS_PROGRESS_INTERVAL: float = 2
+    JOBS_RETENTION: float = 7 * 24 * 3600
+    # Validate Docs API payloads against the Document model before returning
+    # them; when off they are passed through byte for byte
+    VALIDATE_DOCUMENTS: bool = True
+    # Memory budget of rendered documents kept per (document, revision, user),
+    # and the (document, user) -> (Drive version, revision id) entries used to
+    # find them
+    DOCUMENT_CACHE_BYTES: int = 256 * 2**20
+    DOCUMENT_REVISION_CACHE_SIZE: int = 10000
+    DOCUMENT_REVISION_CACHE_TTL: float = 3600
 
     @property
     def REDIRECT_URI(self) -> str:
@@ -0,0 +1,537 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from googleapiclient.errors import HttpError
+
+from config import settings
+from executor import bulk, execute
+from name_index import NameIndex
+
+logger = logging.getLogger(__name__)
+
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+FILE_FIELDS = "id, name, mimeType, parents"
+CHANGE_FIELDS = (
+    f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}))"
+)
+# Largest pageSize files().list and changes().list accept
+PAGE_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    user_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    mime_type TEXT NOT NULL,
+    parent_id TEXT,
+    PRIMARY KEY (user_id, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS files_by_parent ON files (user_id, parent_id, name);
+CREATE TABLE IF NOT EXISTS sync_state (
+    user_id TEXT PRIMARY KEY,
+    root_id TEXT,
+    page_token TEXT,
+    ready INTEGER NOT NULL DEFAULT 0,
+    synced_at REAL
+);
+"""
+
+# (id, name, mimeType, parent id) as stored in the index
+Row = Tuple[str, str, str, Optional[str]]
+
+
+def _row(item: dict) -> Row:
+    return (
+        item["id"],
+        item.get("name", ""),
+        item.get("mimeType", ""),
+        item.get("parents", [None])[0],
+    )
+
+
+class DriveIndex:
+    """
+    SQLite store of every user's Drive file metadata.
+
+    Queries run on a small thread pool of their own, each thread with its
+    own connection; WAL mode lets them read while a sync writes. The
+    database is only created once first used.
+
+    Name searches of users with a complete index are answered from a
+    NameIndex held in memory, loaded from the database on first use and kept
+    current by the same changes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(
+            max_workers=settings.DRIVE_INDEX_THREADS, thread_name_prefix="drive-index"
+        )
+        self._names: Dict[str, NameIndex] = {}
+        # Changes to replay into the name indexes being loaded, per user
+        self._loading: Dict[str, List[dict]] = {}
+        self._names_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, partial(func, *args))
+
+    # Sync side
+
+    def _state(self, user_id: str) -> Optional[tuple]:
+        return (
+            self._connect()
+            .execute(
+                "SELECT root_id, page_token, ready FROM sync_state WHERE user_id = ?",
+                (user_id,),
+            )
+            .fetchone()
+        )
+
+    def _start_build(self, user_id: str, root: dict, page_token: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM files WHERE user_id = ?", (user_id,))
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_state (user_id, root_id, page_token,"
+                " ready) VALUES (?, ?, ?, 0)",
+                (user_id, root["id"], page_token),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                (user_id, *_row(root)),
+            )
+        # After the commit, so a name index loading now finds it not ready
+        self.drop_names(user_id)
+
+    def _add(self, user_id: str, items: Iterable[dict]) -> None:
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                [(user_id, *_row(item)) for item in items],
+            )
+
+    def _finish_build(self, user_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE sync_state SET ready = 1, synced_at = ? WHERE user_id = ?",
+                (time.time(), user_id),
+            )
+
+    def _apply(self, user_id: str, changes: List[dict], page_token: str) -> None:
+        """Applies a page of changes and moves the user's token past it."""
+        with self._connect() as conn:
+            for change in changes:
+                item = change.get("file")
+                if change.get("removed") or item is None:
+                    conn.execute(
+                        "DELETE FROM files WHERE user_id = ? AND id = ?",
+                        (user_id, change["fileId"]),
+                    )
+                else:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                        (user_id, *_row(item)),
+                    )
+            conn.execute(
+                "UPDATE sync_state SET page_token = ?, synced_at = ? WHERE user_id = ?",
+                (page_token, time.time(), user_id),
+            )
+        with self._names_lock:
+            names = self._names.get(user_id)
+            if user_id in self._loading:
+                self._loading[user_id] += changes
+        if names is not None:
+            self._update_names(user_id, names, changes)
+            if names.needs_compaction():
+                self._pool.submit(self._load_names, user_id)
+
+    # Name index
+
+    def _load_names(self, user_id: str) -> None:
+        """Loads the user's name index, replacing the current one if any."""
+        pending: List[dict] = []
+        with self._names_lock:
+            if user_id in self._loading:
+                return
+            self._loading[user_id] = pending
+        try:
+            state = self._state(user_id)
+            if state is None or not state[2]:
+                return
+            names = NameIndex(
+                self._connect().execute(
+                    "SELECT id, name, mime_type, parent_id FROM files"
+                    " WHERE user_id = ? AND id != ?",
+                    (user_id, state[0]),
+                )
+            )
+            with self._names_lock:
+                # Dropped while loading
+                if self._loading.get(user_id) is not pending:
+                    return
+                self._update_names(user_id, names, pending)
+                self._names[user_id] = names
+        except Exception as e:
+            logger.warning("Loading the name index of %s failed: %s", user_id, e)
+        finally:
+            with self._names_lock:
+                if self._loading.get(user_id) is pending:
+                    del self._loading[user_id]
+
+    def _update_names(
+        self, user_id: str, names: NameIndex, changes: List[dict]
+    ) -> None:
+        root_id = self._root(user_id)
+        for change in changes:
+            item = change.get("file")
+            if change.get("removed") or item is None:
+                names.remove(change["fileId"])
+            elif item["id"] != root_id:
+                names.add(_row(item))
+
+    def drop_names(self, user_id: str) -> None:
+        """Frees the user's name index, and discards one being loaded."""
+        with self._names_lock:
+            self._names.pop(user_id, None)
+            self._loading.pop(user_id, None)
+
+    # Query side
+
+    def _root(self, user_id: str) -> Optional[str]:
+        state = self._state(user_id)
+        return state[0] if state and state[2] else None
+
+    def _folder(self, user_id: str, parent_id: str, name: str) -> Optional[str]:
+        row = (
+            self._connect()
+            .execute(
+                "SELECT id FROM files WHERE user_id = ? AND parent_id = ?"
+                " AND name = ? AND mime_type = ? LIMIT 1",
+                (user_id, parent_id, name, FOLDER_MIME_TYPE),
+            )
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def _children(
+        self,
+        user_id: str,
+        parent_id: str,
+        mime_type: Optional[str],
+        offset: int,
+        limit: int,
+    ) -> List[Row]:
+        sql = "SELECT id, name, mime_type, parent_id FROM files"
+        sql += " WHERE user_id = ? AND parent_id = ?"
+        args: list = [user_id, parent_id]
+        if mime_type:
+            sql += " AND mime_type = ?"
+            args.append(mime_type)
+        sql += " ORDER BY name, id LIMIT ? OFFSET ?"
+        return self._connect().execute(sql, (*args, limit, offset)).fetchall()
+
+    def _children_of(self, user_id: str, parent_ids: List[str]) -> List[Row]:
+        marks = ", ".join("?" * len(parent_ids))
+        return (
+            self._connect()
+            .execute(
+                "SELECT id, name, mime_type, parent_id FROM files"
+                f" WHERE user_id = ? AND parent_id IN ({marks}) ORDER BY name, id",
+                (user_id, *parent_ids),
+            )
+            .fetchall()
+        )
+
+    def _search(
+        self,
+        user_id: str,
+        name: Optional[str],
+        mime_type: Optional[str],
+        offset: int,
+        limit: int,
+    ) -> List[Tuple[Row, str]]:
+        sql = "SELECT id, name, mime_type, parent_id FROM files WHERE user_id = ?"
+        # files().list never returns the root folder itself
+        sql += " AND id NOT IN (SELECT root_id FROM sync_state WHERE user_id = ?)"
+        args: list = [user_id, user_id]
+        if name:
+            # Drive's name contains matches the start of any word of the name
+            pattern = name.replace("\\", "\\\\").replace("%", "\\%")
+            pattern = pattern.replace("_", "\\_")
+            sql += " AND (name LIKE ? ESCAPE '\\' OR name LIKE ? ESCAPE '\\')"
+            args += [f"{pattern}%", f"% {pattern}%"]
+        if mime_type:
+            sql += " AND mime_type = ?"
+            args.append(mime_type)
+        sql += " ORDER BY name, id LIMIT ? OFFSET ?"
+        conn = self._connect()
+        rows = conn.execute(sql, (*args, limit, offset)).fetchall()
+        paths: Dict[Optional[str], str] = {}
+        return [(row, self._path(conn, user_id, row[3], paths)) for row in rows]
+
+    def _search_names(
+        self,
+        user_id: str,
+        name: str,
+        mime_type: Optional[str],
+        offset: int,
+        limit: int,
+    ) -> Optional[List[Tuple[Row, str]]]:
+        with self._names_lock:
+            names = self._names.get(user_id)
+        if names is None:
+            self._pool.submit(self._load_names, user_id)
+            return None
+        rows = names.search(name, mime_type, offset + limit)[offset:]
+        conn = self._connect()
+        paths: Dict[Optional[str], str] = {}
+        return [(row, self._path(conn, user_id, row[3], paths)) for row in rows]
+
+    @staticmethod
+    def _path(
+        conn: sqlite3.Connection,
+        user_id: str,
+        folder_id: Optional[str],
+        paths: Dict[Optional[str], str],
+    ) -> str:
+        """Path of a folder from the top of the user's Drive, memoized in paths."""
+        names = []
+        walked = []
+        while folder_id is not None and folder_id not in paths:
+            if folder_id in walked:
+                break
+            row = conn.execute(
+                "SELECT name, parent_id FROM files WHERE user_id = ? AND id = ?",
+                (user_id, folder_id),
+            ).fetchone()
+            if row is None:
+                # Not visible to the user, like the top of a shared folder
+                break
+            walked.append(folder_id)
+            names.append(row[0])
+            folder_id = row[1]
+        path = paths.get(folder_id, "") if folder_id is not None else ""
+        for walked_id, name in zip(reversed(walked), reversed(names)):
+            path += f"/{name}"
+            paths[walked_id] = path
+        return path
+
+    async def state(self, user_id: str) -> Optional[tuple]:
+        return await self._run(self._state, user_id)
+
+    async def root(self, user_id: str) -> Optional[str]:
+        """The id of the user's root folder once their index is complete."""
+        return await self._run(self._root, user_id)
+
+    async def folder(self, user_id: str, parent_id: str, name: str) -> Optional[str]:
+        return await self._run(self._folder, user_id, parent_id, name)
+
+    async def children(self, user_id, parent_id, mime_type, offset, limit):
+        return await self._run(
+            self._children, user_id, parent_id, mime_type, offset, limit
+        )
+
+    async def children_of(self, user_id: str, parent_ids: List[str]) -> List[Row]:
+        """Everything directly in any of the folders."""
+        return await self._run(self._children_of, user_id, parent_ids)
+
+    async def search(self, user_id, name, mime_type, offset, limit):
+        """Matching files with the path of their parent folder."""
+        return await self._run(self._search, user_id, name, mime_type, offset, limit)
+
+    async def search_names(self, user_id, name, mime_type, offset, limit):
+        """
+        Like search, but ranked by the user's name index (prefixes of the
+        name, then of its words, then anywhere in it), or None while the
+        index is loading.
+        """
+        return await self._run(
+            self._search_names, user_id, name, mime_type, offset, limit
+        )
+
+
+class DriveSync:
+    """
+    Keeps the index of each active user current.
+
+    The first request of a user starts a background task that lists their
+    whole Drive once and then follows the changes().list feed every
+    DRIVE_INDEX_POLL_INTERVAL seconds. The task stops after
+    DRIVE_INDEX_IDLE_TIMEOUT seconds without requests from the user and
+    resumes from the stored page token on the next one, also after restarts.
+    """
+
+    def __init__(self, index: DriveIndex):
+        self.index = index
+        self._followers: Dict[str, asyncio.Task] = {}
+        self._wakeups: Dict[str, asyncio.Event] = {}
+        self._seen: Dict[str, float] = {}
+        self._services: Dict[str, object] = {}
+        # The sync running for a user, shared by everyone waiting for one
+        self._syncs: Dict[str, asyncio.Task] = {}
+        # Changes made through this API per user, and how many of them the
+        # last finished sync started after
+        self._changes: Dict[str, int] = {}
+        self._synced: Dict[str, int] = {}
+        # Users whose whole Drive is being listed into the index
+        self._building: Set[str] = set()
+        # Users whose index a sync brought up to date since their task started
+        self._caught_up: Set[str] = set()
+
+    def touch(self, user_id: str, drive_service) -> None:
+        """Notes a request of the user, starting their sync if needed."""
+        self._seen[user_id] = time.monotonic()
+        self._services[user_id] = drive_service
+        if user_id not in self._followers:
+            self._wakeups[user_id] = asyncio.Event()
+            task = asyncio.create_task(self._follow(user_id))
+            self._followers[user_id] = task
+            task.add_done_callback(lambda _: self._stopped(user_id))
+
+    def _stopped(self, user_id: str) -> None:
+        self._followers.pop(user_id, None)
+        self._wakeups.pop(user_id, None)
+        # Also lets go of the client bound to the user's credentials
+        self._services.pop(user_id, None)
+        self._seen.pop(user_id, None)
+        self._changes.pop(user_id, None)
+        self._synced.pop(user_id, None)
+        self._caught_up.discard(user_id)
+        self.index.drop_names(user_id)
+
+    def changed(self, user_id: str) -> None:
+        """
+        Notes a change made through this API, so the user's next index read
+        waits for a sync started after it.
+        """
+        self._changes[user_id] = self._changes.get(user_id, 0) + 1
+        if user_id in self._wakeups:
+            self._wakeups[user_id].set()
+
+    async def current(self, user_id: str) -> bool:
+        """
+        Waits until changes made through this API are in the index, and
+        tells whether it can answer the user. An index still being built is
+        not waited for, as that takes a listing of the whole Drive; requests
+        go to Google until it is complete. Neither is the first sync of a
+        task resuming from a stored index, which may be far behind.
+        """
+        while self._synced.get(user_id, 0) < self._changes.get(user_id, 0):
+            if user_id not in self._caught_up or user_id in self._building:
+                return False
+            state = await self.index.state(user_id)
+            if state is None or not state[2]:
+                return False
+            await asyncio.shield(self.sync(user_id))
+        return user_id in self._caught_up and user_id not in self._building
+
+    def sync(self, user_id: str) -> asyncio.Task:
+        """Starts a sync of the user's index, or returns the one running."""
+        task = self._syncs.get(user_id)
+        if task is None:
+            task = asyncio.create_task(self._sync(user_id))
+            self._syncs[user_id] = task
+            task.add_done_callback(lambda _: self._syncs.pop(user_id, None))
+        return task
+
+    async def _follow(self, user_id: str) -> None:
+        with bulk():
+            while time.monotonic() - self._seen[user_id] < (
+                settings.DRIVE_INDEX_IDLE_TIMEOUT
+            ):
+                try:
+                    await asyncio.shield(self.sync(user_id))
+                except Exception as e:
+                    logger.warning("Drive index sync for %s failed: %s", user_id, e)
+                wakeup = self._wakeups[user_id]
+                try:
+                    await asyncio.wait_for(
+                        wakeup.wait(), settings.DRIVE_INDEX_POLL_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                wakeup.clear()
+
+    async def _sync(self, user_id: str) -> None:
+        """Builds the user's index if it is not complete, otherwise updates it."""
+        changes = self._changes.get(user_id, 0)
+        drive_service = self._services[user_id]
+        state = await self.index.state(user_id)
+        if state is None or not state[2]:
+            await self._build(user_id, drive_service)
+        else:
+            try:
+                await self._follow_changes(user_id, drive_service, state[1])
+            except HttpError as e:
+                if e.resp.status not in (400, 404, 410):
+                    raise
+                # The page token is no longer valid: start over
+                await self._build(user_id, drive_service)
+        self._synced[user_id] = max(self._synced.get(user_id, 0), changes)
+        if user_id in self._followers:
+            self._caught_up.add(user_id)
+
+    async def _follow_changes(self, user_id: str, drive_service, page_token: str):
+        while True:
+            response = await execute(
+                drive_service.changes().list(
+                    pageToken=page_token,
+                    pageSize=PAGE_SIZE,
+                    fields=CHANGE_FIELDS,
+                    includeRemoved=True,
+                )
+            )
+            page_token = response.get("nextPageToken") or response["newStartPageToken"]
+            await self.index._run(
+                self.index._apply, user_id, response.get("changes", []), page_token
+            )
+            if "newStartPageToken" in response:
+                return
+
+    async def _build(self, user_id: str, drive_service) -> None:
+        self._building.add(user_id)
+        self._caught_up.discard(user_id)
+        try:
+            await self._list_drive(user_id, drive_service)
+        finally:
+            self._building.discard(user_id)
+
+    async def _list_drive(self, user_id: str, drive_service) -> None:
+        # Taken first, so changes made while listing are replayed afterwards
+        start = await execute(drive_service.changes().getStartPageToken())
+        root = await execute(
+            drive_service.files().get(fileId="root", fields=FILE_FIELDS)
+        )
+        await self.index._run(
+            self.index._start_build, user_id, root, start["startPageToken"]
+        )
+        request = drive_service.files().list(
+            fields=f"nextPageToken, files({FILE_FIELDS})", pageSize=PAGE_SIZE
+        )
+        while request is not None:
+            response = await execute(request)
+            await self.index._run(self.index._add, user_id, response.get("files", []))
+            request = drive_service.files().list_next(request, response)
+        await self.index._run(self.index._finish_build, user_id)
+        await self._follow_changes(user_id, drive_service, start["startPageToken"])
+
+
+drive_index = DriveIndex(settings.DRIVE_INDEX_PATH)
+drive_sync = DriveSync(drive_index)
@@ -23,6 +23,11 @@ echo "3. Get a document by ID:"
 curl "$BASE_URL/drive/documents/$SAMPLE_DOCUMENT_ID"
 echo -e "\n---"
 
+# Get only the title and revision of a document
+echo "3a. Get only the title and revision of a document:"
+curl "$BASE_URL/drive/documents/$SAMPLE_DOCUMENT_ID?fields=title,revisionId"
+echo -e "\n---"
+
 # Delete a document by ID
 echo "4. Delete a document by ID:"
 curl -X DELETE "$BASE_URL/drive/documents/$SAMPLE_DOCUMENT_ID"
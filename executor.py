@@ -0,0 +1,394 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from enum import IntEnum
+from functools import partial
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
+
+from cache import TTLCache
+from config import settings
+
+# googleapiclient and httplib2 are blocking, so every Google call runs here
+# instead of on the event loop.
+_pool = ThreadPoolExecutor(
+    max_workers=settings.GOOGLE_POOL_SIZE, thread_name_prefix="google-api"
+)
+_pending = 0
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BULK = 1
+
+
+# Who the current request's Google calls are made for, set by get_user_id
+current_user: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "current_user", default=None
+)
+_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar(
+    "priority", default=Priority.INTERACTIVE
+)
+
+# Share of a bucket's burst that bulk calls leave for interactive ones
+BULK_TOKEN_RESERVE = 0.25
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+RETRYABLE_STATUSES = {500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE"}
+
+
+@contextmanager
+def bulk():
+    """Runs the Google calls made inside the block in the bulk lane."""
+    token = _priority.set(Priority.BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """
+    Token bucket whose rate halves on rate-limit errors (at most once a
+    second) and then recovers linearly back up to max_rate.
+    """
+
+    def __init__(self, rate: float, burst: float, recovery: float):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.recovery = recovery * rate
+        self.tokens = burst
+        self._updated = time.monotonic()
+        self._penalized = float("-inf")
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._updated = now
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.rate = min(self.max_rate, self.rate + elapsed * self.recovery)
+
+    def take(self, cost: float, priority: Priority) -> float:
+        """Takes cost tokens and returns 0, or returns how long to wait."""
+        reserve = self.burst * BULK_TOKEN_RESERVE if priority == Priority.BULK else 0
+        needed = min(cost + reserve, self.burst)
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= needed:
+                # Large batches may overdraw, delaying whoever comes next
+                self.tokens -= cost
+                return 0.0
+            return (needed - self.tokens) / self.rate
+
+    def penalize(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now - self._penalized < 1:
+                return
+            self._penalized = now
+            self.rate = max(self.rate / 2, self.max_rate * 0.05)
+            self.tokens = min(self.tokens, 0.0)
+
+
+class Scheduler:
+    """
+    Admits Google calls in priority order within the project quota.
+
+    At most slots calls run at once, of which bulk calls may take
+    bulk_slots, so interactive calls always find a thread free. Waiting
+    calls are admitted by priority, then arrival, when both a slot and
+    project tokens are available.
+    """
+
+    def __init__(self, slots: int, bulk_slots: int, project: TokenBucket):
+        self.slots = slots
+        self.bulk_slots = bulk_slots
+        self.project = project
+        self._running = 0
+        self._running_bulk = 0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+    def _dispatch(self) -> None:
+        while self._waiting:
+            priority, _, cost, future = self._waiting[0]
+            if future.cancelled():
+                heapq.heappop(self._waiting)
+                continue
+            if self._running >= self.slots:
+                return
+            if priority == Priority.BULK and self._running_bulk >= self.bulk_slots:
+                return
+            wait = self.project.take(cost, priority)
+            if wait > 0:
+                self._wake_in(wait)
+                return
+            heapq.heappop(self._waiting)
+            self._admit(priority)
+            future.set_result(None)
+
+    def _wake_in(self, wait: float) -> None:
+        loop = asyncio.get_running_loop()
+        if self._wakeup is not None:
+            if self._wakeup.when() <= loop.time() + wait:
+                return
+            self._wakeup.cancel()
+        self._wakeup = loop.call_later(wait, self._wake)
+
+    def _wake(self) -> None:
+        self._wakeup = None
+        self._dispatch()
+
+    def _admit(self, priority: Priority) -> None:
+        self._running += 1
+        if priority == Priority.BULK:
+            self._running_bulk += 1
+
+    def _release(self, priority: Priority) -> None:
+        self._running -= 1
+        if priority == Priority.BULK:
+            self._running_bulk -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, cost: int, priority: Priority):
+        if len(self._waiting) >= settings.GOOGLE_QUEUE_DEPTH:
+            raise HTTPException(
+                status_code=503,
+                detail="Too many pending Google API calls",
+                headers={"Retry-After": "1"},
+            )
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._sequence), cost, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(priority)
+            raise
+        try:
+            yield
+        finally:
+            self._release(priority)
+
+    def stats(self) -> dict:
+        return {
+            "running": self._running,
+            "running_bulk": self._running_bulk,
+            "waiting": len(self._waiting),
+            "project_rate": round(self.project.rate, 2),
+        }
+
+
+scheduler = Scheduler(
+    settings.GOOGLE_POOL_SIZE,
+    settings.GOOGLE_POOL_SIZE - settings.GOOGLE_INTERACTIVE_RESERVE,
+    TokenBucket(
+        settings.GOOGLE_PROJECT_RATE,
+        settings.GOOGLE_PROJECT_BURST,
+        settings.GOOGLE_RATE_RECOVERY,
+    ),
+)
+# Per-user quota buckets, kept as long as the users' credentials
+_user_buckets = TTLCache(
+    settings.CREDENTIALS_CACHE_SIZE, settings.CREDENTIALS_CACHE_TTL
+)
+
+
+def _user_bucket(user_id: str) -> TokenBucket:
+    bucket = _user_buckets.get(user_id)
+    if bucket is None:
+        bucket = TokenBucket(
+            settings.GOOGLE_USER_RATE,
+            settings.GOOGLE_USER_BURST,
+            settings.GOOGLE_RATE_RECOVERY,
+        )
+        _user_buckets.set(user_id, bucket)
+    return bucket
+
+
+def error_reason(error: HttpError) -> Optional[str]:
+    """The reason Google gives for an error, e.g. userRateLimitExceeded."""
+    try:
+        errors = json.loads(error.content)["error"].get("errors", [])
+        return errors[0].get("reason") if errors else None
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def is_rate_limited(error: HttpError) -> bool:
+    status = error.resp.status
+    if status == 403:
+        return error_reason(error) in RATE_LIMIT_REASONS
+    return status == 429
+
+
+def _retry_after(error: HttpError) -> float:
+    try:
+        return float(error.resp.get("retry-after", 0))
+    except ValueError:
+        return 0.0
+
+
+def http_exception(error: HttpError) -> HTTPException:
+    """
+    Maps a Google error to the response for it. Rate limits still left after
+    retrying are reported as 429 with Retry-After, whatever Google used.
+    """
+    if is_rate_limited(error):
+        retry_after = max(1, round(_retry_after(error)))
+        return HTTPException(
+            status_code=429,
+            detail=str(error),
+            headers={"Retry-After": str(retry_after)},
+        )
+    return HTTPException(status_code=error.resp.status, detail=str(error))
+
+
+async def run(func, *args, **kwargs):
+    """
+    Runs a blocking Google call on the Google API thread pool.
+
+    At most GOOGLE_POOL_SIZE calls run at once and GOOGLE_QUEUE_DEPTH more may
+    wait for a thread; anything beyond that is rejected with 503 rather than
+    queued without bound.
+    """
+    global _pending
+    if _pending >= settings.GOOGLE_POOL_SIZE + settings.GOOGLE_QUEUE_DEPTH:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many pending Google API calls",
+            headers={"Retry-After": "1"},
+        )
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_pool, partial(func, *args, **kwargs))
+    finally:
+        _pending -= 1
+
+
+async def execute(request, **kwargs):
+    """
+    Executes a googleapiclient HttpRequest (or batch) on the thread pool.
+
+    The call waits for the current user's and the project's quota and is
+    admitted by priority (see bulk()); a batch counts as each request in it.
+    Rate-limit errors, and 5xx errors of idempotent requests, are retried
+    up to GOOGLE_MAX_RETRIES times with full-jitter exponential backoff,
+    and rate limits slow the bucket they hit.
+    """
+    priority = _priority.get()
+    user_id = current_user.get()
+    user_bucket = _user_bucket(user_id) if user_id is not None else None
+    if isinstance(request, BatchHttpRequest):
+        cost, method = max(len(request._order), 1), "POST"
+    else:
+        cost, method = 1, request.method
+    if method != "GET":
+        # The user's shared responses may predate this change
+        _forget_recent(user_id)
+    for attempt in itertools.count():
+        if user_bucket is not None:
+            while wait := user_bucket.take(cost, priority):
+                await asyncio.sleep(wait)
+        async with scheduler.slot(cost, priority):
+            try:
+                return await run(request.execute, **kwargs)
+            except HttpError as e:
+                rate_limited = is_rate_limited(e)
+                retryable = rate_limited or (
+                    e.resp.status in RETRYABLE_STATUSES and method in IDEMPOTENT_METHODS
+                )
+                if not retryable or attempt >= settings.GOOGLE_MAX_RETRIES:
+                    raise
+                if rate_limited:
+                    if error_reason(e) == "userRateLimitExceeded" and user_bucket:
+                        user_bucket.penalize()
+                    else:
+                        scheduler.project.penalize()
+                backoff = min(
+                    settings.GOOGLE_BACKOFF_MAX,
+                    settings.GOOGLE_BACKOFF_BASE * 2**attempt,
+                )
+                delay = max(_retry_after(e), random.uniform(0, backoff))
+        await asyncio.sleep(delay)
+
+
+# Identical GETs in flight, keyed by (user, method, uri, body)
+_shared: Dict[tuple, asyncio.Task] = {}
+# Responses of finished shared calls, reused for COALESCE_WINDOW seconds
+_recent = TTLCache(settings.COALESCE_CACHE_SIZE, settings.COALESCE_WINDOW)
+coalescing = {"upstream": 0, "joined": 0, "reused": 0}
+
+
+def _response(resp, content):
+    return resp, content
+
+
+def _forget_recent(user_id: Optional[str]) -> None:
+    if settings.COALESCE_WINDOW > 0:
+        _recent.discard_where(lambda key, _: key[0] == user_id)
+
+
+async def execute_shared(request):
+    """
+    Executes a GET like execute(), but identical GETs for the same user
+    share one Google call: callers arriving while it is in flight await its
+    response, and so do those arriving within COALESCE_WINDOW seconds after
+    it (0 disables that). Each caller decodes the response itself, so
+    results are never shared objects.
+    """
+    key = (current_user.get(), request.method, request.uri, request.body)
+    postproc = request.postproc
+    response = _recent.get(key) if settings.COALESCE_WINDOW > 0 else None
+    if response is not None:
+        coalescing["reused"] += 1
+        return postproc(*response)
+
+    task = _shared.get(key)
+    if task is None:
+        coalescing["upstream"] += 1
+        request.postproc = _response
+        task = asyncio.create_task(execute(request))
+        _shared[key] = task
+
+        def done(task: asyncio.Task) -> None:
+            del _shared[key]
+            if task.cancelled() or task.exception() is not None:
+                return
+            if settings.COALESCE_WINDOW > 0:
+                _recent.set(key, task.result())
+
+        task.add_done_callback(done)
+    else:
+        coalescing["joined"] += 1
+    # Shielded: a caller going away must not cancel the call for the others
+    return postproc(*await asyncio.shield(task))
+
+
+def _raw_body(resp, content):
+    return content
+
+
+async def execute_raw(request, shared: bool = False) -> bytes:
+    """
+    Executes a googleapiclient HttpRequest, returning the undecoded body;
+    through execute_shared() if shared.
+    """
+    request.postproc = _raw_body
+    return await (execute_shared(request) if shared else execute(request))
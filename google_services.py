@@ -1,10 +1,37 @@
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, partial
+from types import MethodType
+from typing import Dict, Optional, Tuple
+
 from fastapi import Depends, HTTPException, Request
-from google.auth.transport.requests import Request as GoogleRequest
+from google.auth.exceptions import RefreshError
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import Resource, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import build_http
+
+from cache import TTLCache
+from config import settings
+from executor import current_user, run
+from transport import google_http, token_request
+
+logger = logging.getLogger(__name__)
+
+# Nested resource templates (e.g. drive.files()), keyed by (id(parent), name)
+_nested_templates: Dict[Tuple[int, str], Resource] = {}
 
+# Credentials reused across a user's requests, keyed by user id
+_credentials = TTLCache(settings.CREDENTIALS_CACHE_SIZE, settings.CREDENTIALS_CACHE_TTL)
+# The token refresh in flight for a user, awaited by every request needing it
+_refreshes: Dict[str, asyncio.Task] = {}
 
-def get_credentials(request: Request) -> Credentials:
+
+def _require_session(request: Request) -> None:
     if "credentials" not in request.session:
         raise HTTPException(
             status_code=401,
@@ -12,34 +39,169 @@ def get_credentials(request: Request) -> Credentials:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    creds_data = request.session["credentials"]
+
+async def get_user_id(request: Request) -> str:
+    """
+    Returns a stable id of the signed-in user, used to scope per-user caches
+    and quota. The request's Google calls are accounted to this user.
+    """
+    _require_session(request)
+    user_id = request.session.get("user_id")
+    if user_id is None:
+        # Sessions created before the callback recorded the user id
+        creds_data = request.session["credentials"]
+        secret = creds_data.get("refresh_token") or creds_data["token"]
+        user_id = hashlib.sha256(secret.encode()).hexdigest()
+    current_user.set(user_id)
+    return user_id
+
+
+def credentials_to_session(credentials: Credentials) -> dict:
+    return {
+        "token": credentials.token,
+        "refresh_token": credentials.refresh_token,
+        "token_uri": credentials.token_uri,
+        "client_id": credentials.client_id,
+        "client_secret": credentials.client_secret,
+        "scopes": credentials.scopes,
+        "expiry": credentials.expiry.isoformat() if credentials.expiry else None,
+    }
+
+
+def _credentials_from_session(creds_data: dict) -> Credentials:
+    creds_data = dict(creds_data)
+    expiry = creds_data.pop("expiry", None)
     credentials = Credentials(**creds_data)
+    if expiry:
+        credentials.expiry = datetime.fromisoformat(expiry)
+    return credentials
+
+
+def _expires_within(credentials: Credentials, seconds: float) -> bool:
+    if credentials.expiry is None:
+        return False
+    # google-auth keeps expiry as a naive UTC datetime
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    remaining = credentials.expiry - now
+    return remaining < timedelta(seconds=seconds)
+
+
+def _refresh(user_id: str, credentials: Credentials) -> asyncio.Task:
+    """Starts a token refresh for the user unless one is already in flight."""
+    task = _refreshes.get(user_id)
+    if task is None:
+        task = asyncio.create_task(run(credentials.refresh, token_request))
+        _refreshes[user_id] = task
+        task.add_done_callback(lambda _: _refreshes.pop(user_id, None))
+    return task
 
-    if credentials.expired and credentials.refresh_token:
-        credentials.refresh(GoogleRequest())
-        request.session["credentials"] = {
-            "token": credentials.token,
-            "refresh_token": credentials.refresh_token,
-            "token_uri": credentials.token_uri,
-            "client_id": credentials.client_id,
-            "client_secret": credentials.client_secret,
-            "scopes": credentials.scopes,
-        }
+
+def _log_refresh_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Proactive token refresh failed: %s", task.exception())
+
+
+async def get_credentials(
+    request: Request, user_id: str = Depends(get_user_id)
+) -> Credentials:
+    """
+    Returns the user's Credentials, shared by all of their requests.
+
+    Expired tokens are refreshed once per user however many requests need
+    them; the others await the same refresh. Tokens within
+    TOKEN_REFRESH_MARGIN seconds of expiry are refreshed in the background
+    while requests keep using the still valid token.
+    """
+    creds_data = request.session["credentials"]
+    credentials: Optional[Credentials] = _credentials.get(user_id)
+    if credentials is None or credentials.refresh_token != creds_data.get(
+        "refresh_token"
+    ):
+        credentials = _credentials_from_session(creds_data)
+        _credentials.set(user_id, credentials)
+
+    if credentials.refresh_token:
+        if credentials.expired:
+            try:
+                await asyncio.shield(_refresh(user_id, credentials))
+            except RefreshError as e:
+                _credentials.pop(user_id)
+                raise HTTPException(
+                    status_code=401,
+                    detail=f"Could not refresh credentials: {e}",
+                    headers={"WWW-Authenticate": "Bearer"},
+                )
+        elif _expires_within(credentials, settings.TOKEN_REFRESH_MARGIN):
+            _refresh(user_id, credentials).add_done_callback(_log_refresh_failure)
+
+    if creds_data.get("token") != credentials.token:
+        request.session["credentials"] = credentials_to_session(credentials)
 
     return credentials
 
 
+@lru_cache(maxsize=None)
+def _root_template(service_name: str, version: str) -> Resource:
+    """Parses the bundled discovery document and builds the API root once."""
+    document = get_static_doc(service_name, version)
+    if document is None:
+        raise RuntimeError(f"No discovery document for {service_name} {version}")
+    return build_from_document(json.loads(document), http=build_http())
+
+
+def _nested_template(parent: Resource, name: str) -> Resource:
+    key = (id(parent), name)
+    template = _nested_templates.get(key)
+    if template is None:
+        # Building a resource generates every method (and its docstring) from
+        # the discovery document, which is the expensive part of build().
+        template = _nested_templates.setdefault(key, getattr(parent, name)())
+    return template
+
+
+def _bind(template: Resource, http) -> Resource:
+    """Returns a shallow copy of a template Resource that sends through http."""
+    resource = object.__new__(Resource)
+    resource.__dict__.update(template.__dict__)
+    resource._http = http
+    resource._credentials_validated = False
+    for name in template._dynamic_attrs:
+        attr = template.__dict__[name]
+        if not isinstance(attr, MethodType):
+            continue
+        if getattr(attr.__func__, "__is_resource__", False):
+            resource.__dict__[name] = partial(
+                _bind, _nested_template(template, name), http
+            )
+        else:
+            resource.__dict__[name] = MethodType(attr.__func__, resource)
+    return resource
+
+
+def build_service(service_name: str, version: str, credentials: Credentials):
+    """
+    Returns an API client bound to the given credentials.
+
+    Same as googleapiclient.discovery.build(), but the discovery document is
+    parsed and every resource is generated only once per process; binding a
+    request's credentials just copies the prebuilt resources. All clients
+    send through the shared connection pool.
+    """
+    http = AuthorizedHttp(credentials, http=google_http)
+    return _bind(_root_template(service_name, version), http)
+
+
 def get_drive_service(credentials: Credentials = Depends(get_credentials)):
-    return build("drive", "v3", credentials=credentials)
+    return build_service("drive", "v3", credentials)
 
 
 def get_docs_service(credentials: Credentials = Depends(get_credentials)):
-    return build("docs", "v1", credentials=credentials)
+    return build_service("docs", "v1", credentials)
 
 
 def get_sheets_service(credentials: Credentials = Depends(get_credentials)):
-    return build("sheets", "v4", credentials=credentials)
+    return build_service("sheets", "v4", credentials)
 
 
 def get_slides_service(credentials: Credentials = Depends(get_credentials)):
-    return build("slides", "v1", credentials=credentials)
+    return build_service("slides", "v1", credentials)
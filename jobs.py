@@ -0,0 +1,295 @@
+import asyncio
+import contextvars
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from googleapiclient.errors import HttpError
+
+from config import settings
+from executor import bulk, http_exception
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER,
+    result TEXT,
+    error TEXT,
+    error_status INTEGER,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS jobs_by_user ON jobs (user_id, created_at);
+"""
+COLUMNS = (
+    "id, kind, status, done, total, result, error, error_status, created_at,"
+    " started_at, finished_at"
+)
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+# The job the current task works on, set by JobQueue for progress()
+_current_job: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar(
+    "current_job", default=None
+)
+
+
+def progress(done: int, total: Optional[int] = None) -> None:
+    """Reports how far the current job got; does nothing outside a job."""
+    job = _current_job.get()
+    if job is not None:
+        job["done"] = done
+        if total is not None:
+            job["total"] = total
+
+
+def _as_dict(row: tuple) -> dict:
+    job = dict(zip((c.strip() for c in COLUMNS.split(",")), row))
+    if job["result"] is not None:
+        job["result"] = json.loads(job["result"])
+    return job
+
+
+class JobStore:
+    """
+    SQLite record of every user's jobs, on a thread of its own like the
+    Drive index. Jobs left queued or running by an earlier process are
+    marked failed when the database is first used, since their work (and
+    the credentials it ran with) did not survive the restart.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs")
+        self._recovered = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+            if not self._recovered:
+                self._recover(conn)
+        return conn
+
+    def _recover(self, conn: sqlite3.Connection) -> None:
+        self._recovered = True
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, error_status = 503,"
+                " finished_at = ? WHERE status IN (?, ?)",
+                (FAILED, "Interrupted by a restart", time.time(), QUEUED, RUNNING),
+            )
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, partial(func, *args))
+
+    def _insert(self, user_id: str, job: dict) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE finished_at < ?",
+                (time.time() - settings.JOBS_RETENTION,),
+            )
+            conn.execute(
+                "INSERT INTO jobs (id, user_id, kind, status, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (job["id"], user_id, job["kind"], job["status"], job["created_at"]),
+            )
+
+    def _save(self, job: dict) -> None:
+        result = job["result"]
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, done = ?, total = ?, result = ?,"
+                " error = ?, error_status = ?, started_at = ?, finished_at = ?"
+                " WHERE id = ?",
+                (
+                    job["status"],
+                    job["done"],
+                    job["total"],
+                    None if result is None else json.dumps(result),
+                    job["error"],
+                    job["error_status"],
+                    job["started_at"],
+                    job["finished_at"],
+                    job["id"],
+                ),
+            )
+
+    def _get(self, user_id: str, job_id: str) -> Optional[dict]:
+        row = (
+            self._connect()
+            .execute(
+                f"SELECT {COLUMNS} FROM jobs WHERE id = ? AND user_id = ?",
+                (job_id, user_id),
+            )
+            .fetchone()
+        )
+        return None if row is None else _as_dict(row)
+
+    def _list(self, user_id: str, limit: int) -> List[dict]:
+        rows = (
+            self._connect()
+            .execute(
+                f"SELECT {COLUMNS} FROM jobs WHERE user_id = ?"
+                " ORDER BY created_at DESC LIMIT ?",
+                (user_id, limit),
+            )
+            .fetchall()
+        )
+        return [_as_dict(row) for row in rows]
+
+    async def insert(self, user_id: str, job: dict) -> None:
+        await self._run(self._insert, user_id, job)
+
+    async def save(self, job: dict) -> None:
+        await self._run(self._save, dict(job))
+
+    async def get(self, user_id: str, job_id: str) -> Optional[dict]:
+        return await self._run(self._get, user_id, job_id)
+
+    async def list(self, user_id: str, limit: int) -> List[dict]:
+        """The user's latest jobs, newest first."""
+        return await self._run(self._list, user_id, limit)
+
+
+class JobQueue:
+    """
+    Runs long operations in the background, so requests only wait for a
+    job id.
+
+    At most JOBS_WORKERS jobs run at once, and JOBS_PER_USER of them for
+    any one user; the others wait in submission order. A user may have
+    JOBS_MAX_PENDING jobs queued or running before new ones are refused
+    with 429. Jobs make their Google calls in the bulk lane. Their state is
+    kept in memory while they run, with progress written to the store at
+    most every JOBS_PROGRESS_INTERVAL seconds, and the outcome written when
+    they finish.
+    """
+
+    def __init__(self, store: JobStore):
+        self.store = store
+        self._workers = asyncio.Semaphore(settings.JOBS_WORKERS)
+        self._users: Dict[str, asyncio.Semaphore] = {}
+        # Jobs of this process not finished yet, by id, and per user
+        self._live: Dict[str, dict] = {}
+        self._pending: Dict[str, int] = {}
+        # The tasks running jobs, held so they are not garbage collected
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(
+        self, user_id: str, kind: str, work: Callable[[], Awaitable[Any]]
+    ) -> dict:
+        """Queues work as a job of the user and returns the job."""
+        if self._pending.get(user_id, 0) >= settings.JOBS_MAX_PENDING:
+            raise HTTPException(
+                status_code=429,
+                detail=f"At most {settings.JOBS_MAX_PENDING} jobs can be queued"
+                " or running at once",
+            )
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": QUEUED,
+            "done": 0,
+            "total": None,
+            "result": None,
+            "error": None,
+            "error_status": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        # Counted before the insert, so submits awaiting it count too
+        self._pending[user_id] = self._pending.get(user_id, 0) + 1
+        try:
+            await self.store.insert(user_id, job)
+        except BaseException:
+            self._release(user_id)
+            raise
+        self._live[job["id"]] = job
+        task = asyncio.create_task(self._run(user_id, job, work))
+        self._tasks.add(task)
+        task.add_done_callback(lambda _: self._finished(user_id, job, task))
+        return dict(job)
+
+    def _finished(self, user_id: str, job: dict, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self._live.pop(job["id"], None)
+        self._release(user_id)
+
+    def _release(self, user_id: str) -> None:
+        self._pending[user_id] -= 1
+        if not self._pending[user_id]:
+            del self._pending[user_id]
+            self._users.pop(user_id, None)
+
+    async def _run(
+        self, user_id: str, job: dict, work: Callable[[], Awaitable[Any]]
+    ) -> None:
+        if user_id not in self._users:
+            self._users[user_id] = asyncio.Semaphore(settings.JOBS_PER_USER)
+        async with self._users[user_id], self._workers:
+            job["status"], job["started_at"] = RUNNING, time.time()
+            await self.store.save(job)
+            _current_job.set(job)
+            saver = asyncio.create_task(self._save_progress(job))
+            try:
+                with bulk():
+                    result = await work()
+                job["result"], job["status"] = jsonable_encoder(result), SUCCEEDED
+            except Exception as e:
+                if isinstance(e, HttpError):
+                    e = http_exception(e)
+                if isinstance(e, HTTPException):
+                    job["error"], job["error_status"] = str(e.detail), e.status_code
+                else:
+                    logger.exception("Job %s failed", job["id"])
+                    job["error"], job["error_status"] = str(e), 500
+                job["status"] = FAILED
+            finally:
+                saver.cancel()
+                job["finished_at"] = time.time()
+            await self.store.save(job)
+
+    async def _save_progress(self, job: dict) -> None:
+        saved = (job["done"], job["total"])
+        while True:
+            await asyncio.sleep(settings.JOBS_PROGRESS_INTERVAL)
+            if (job["done"], job["total"]) != saved:
+                saved = (job["done"], job["total"])
+                await self.store.save(job)
+
+    async def get(self, user_id: str, job_id: str) -> Optional[dict]:
+        """The user's job, as it stands now while it runs here."""
+        job = await self.store.get(user_id, job_id)
+        if job is not None and job_id in self._live:
+            job = dict(self._live[job_id])
+        return job
+
+    async def list(self, user_id: str, limit: int) -> List[dict]:
+        jobs = await self.store.list(user_id, limit)
+        return [dict(self._live.get(job["id"], job)) for job in jobs]
+
+
+job_store = JobStore(settings.JOBS_PATH)
+job_queue = JobQueue(job_store)
@@ -4,7 +4,15 @@ import uvicorn
 from fastapi import FastAPI
 from starlette.middleware.sessions import SessionMiddleware
 
-from api import comments_router, documents_router, drive_router, spreadsheets_router
+from api import (
+    comments_router,
+    content_router,
+    documents_router,
+    drive_router,
+    jobs_router,
+    metrics_router,
+    spreadsheets_router,
+)
 from auth import router as auth_router
 from config import settings
 
@@ -19,6 +27,9 @@ app.include_router(drive_router)
 app.include_router(spreadsheets_router)
 app.include_router(documents_router)
 app.include_router(comments_router)
+app.include_router(content_router)
+app.include_router(jobs_router)
+app.include_router(metrics_router)
 
 
 @app.get("/")
@@ -0,0 +1,240 @@
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections import defaultdict
+from functools import partial, reduce
+from operator import and_
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+# (id, name, mimeType, parent id), as rows of the Drive index
+Row = Tuple[str, str, str, Optional[str]]
+
+# Word starts past this offset in a name are not indexed
+MAX_WORD_OFFSET = 255
+
+# Names a substring query verifies one by one before intersecting bitmaps
+SCAN_BUDGET = 4096
+
+_WORD_START = re.compile(r"(?<=[ _\-.()\[\]])[^ _\-.()\[\]]")
+_NONZERO = re.compile(rb"[^\x00]")
+
+
+def _word_starts(name: str) -> List[int]:
+    """Offsets of the words of a name after the first one."""
+    return [
+        match.start() for match in _WORD_START.finditer(name, 1, MAX_WORD_OFFSET + 1)
+    ]
+
+
+def _trigrams(name: str) -> Set[str]:
+    return set(map("".join, zip(name, name[1:], name[2:])))
+
+
+def _set_bits(bitmap: int, start: int) -> Iterator[int]:
+    """Positions of the bits set in bitmap from start on, in order."""
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+    for match in _NONZERO.finditer(data, start >> 3):
+        offset = match.start()
+        for bit in range(8):
+            if data[offset] >> bit & 1 and offset << 3 | bit >= start:
+                yield offset << 3 | bit
+
+
+class NameIndex:
+    """
+    In-memory index of one user's Drive names for ranked type-ahead search.
+
+    Matches are ranked in three tiers, each ordered by name:
+        1. names starting with the term
+        2. names with a later word starting with the term
+        3. names containing the term anywhere (terms of 3+ characters)
+
+    Tiers 1 and 2 are binary searches over names and word starts sorted
+    case-insensitively; tier 3 verifies the names listed under the term's
+    rarest trigram, going on from the intersection of bitmaps of all its
+    trigrams (built on first use) when that list is long. Changes are
+    inserted in place: a changed or removed file's old slot is hidden until
+    enough are to make a rebuild worth it.
+    """
+
+    def __init__(self, rows: Iterable[Row]):
+        self._lock = threading.Lock()
+        self._ids: List[str] = []
+        self._names: List[str] = []
+        self._lower: List[str] = []
+        self._mimes: List[str] = []
+        self._parents: List[Optional[str]] = []
+        self._slots: Dict[str, int] = {}
+        self._hidden: Set[int] = set()
+        self._trigrams: Dict[str, array] = defaultdict(partial(array, "I"))
+        self._bitmaps: Dict[str, bytearray] = {}
+        words = []
+        for row in rows:
+            slot = self._append(row)
+            lower = self._lower[slot]
+            words.extend(
+                (lower[start:], slot << 8 | start) for start in _word_starts(lower)
+            )
+        lower = self._lower
+        self._by_name = array("I", sorted(range(len(lower)), key=lower.__getitem__))
+        words.sort()
+        self._by_word = array("Q", (code for _, code in words))
+
+    def _append(self, row: Row) -> int:
+        file_id, name, mime_type, parent_id = row
+        slot = len(self._ids)
+        lower = name.lower()
+        self._ids.append(file_id)
+        self._names.append(name)
+        self._lower.append(lower)
+        self._mimes.append(sys.intern(mime_type))
+        self._parents.append(parent_id)
+        self._slots[file_id] = slot
+        for postings in map(self._trigrams.__getitem__, _trigrams(lower)):
+            postings.append(slot)
+        return slot
+
+    @staticmethod
+    def _set(bitmap: bytearray, slot: int) -> None:
+        if slot >> 3 >= len(bitmap):
+            bitmap.extend(bytes((slot >> 3) - len(bitmap) + 1))
+        bitmap[slot >> 3] |= 1 << (slot & 7)
+
+    def _bitmap(self, trigram: str) -> int:
+        bitmap = self._bitmaps.get(trigram)
+        if bitmap is None:
+            bitmap = self._bitmaps[trigram] = bytearray(len(self._ids) // 8 + 1)
+            for slot in self._trigrams[trigram]:
+                bitmap[slot >> 3] |= 1 << (slot & 7)
+        return int.from_bytes(bitmap, "little")
+
+    def _word(self, code: int) -> str:
+        return self._lower[code >> 8][code & 255 :]
+
+    def _row(self, slot: int) -> Row:
+        return (
+            self._ids[slot],
+            self._names[slot],
+            self._mimes[slot],
+            self._parents[slot],
+        )
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def add(self, row: Row) -> None:
+        """Adds a file or replaces the entry of one already indexed."""
+        with self._lock:
+            old = self._slots.get(row[0])
+            if old is not None:
+                self._hidden.add(old)
+            # New slots are the highest, so postings stay in slot order
+            slot = self._append(row)
+            for trigram in _trigrams(self._lower[slot]):
+                if trigram in self._bitmaps:
+                    self._set(self._bitmaps[trigram], slot)
+            insort(self._by_name, slot, key=self._lower.__getitem__)
+            for start in _word_starts(self._lower[slot]):
+                insort(self._by_word, slot << 8 | start, key=self._word)
+
+    def remove(self, file_id: str) -> None:
+        with self._lock:
+            slot = self._slots.pop(file_id, None)
+            if slot is not None:
+                self._hidden.add(slot)
+
+    def needs_compaction(self) -> bool:
+        return len(self._hidden) > max(1000, len(self._ids) // 20)
+
+    def rows(self) -> List[Row]:
+        """Current rows, to build a compacted index from."""
+        with self._lock:
+            return [self._row(slot) for slot in sorted(self._slots.values())]
+
+    def search(self, term: str, mime_type: Optional[str], limit: int) -> List[Row]:
+        """The best limit matches of term, optionally of one mimeType only."""
+        term = term.lower()
+        with self._lock:
+            found: List[int] = []
+            seen: Set[int] = set()
+            for tier in (self._prefixes, self._word_prefixes, self._substrings):
+                if len(found) >= limit:
+                    break
+                matches = tier(term, mime_type, limit - len(found), seen)
+                matches.sort(key=self._lower.__getitem__)
+                found += matches
+                seen.update(matches)
+            return [self._row(slot) for slot in found[:limit]]
+
+    def _visible(self, slot: int, mime_type: Optional[str], seen: Set[int]) -> bool:
+        return (
+            slot not in self._hidden
+            and slot not in seen
+            and (mime_type is None or self._mimes[slot] == mime_type)
+        )
+
+    def _prefixes(self, term, mime_type, limit, seen) -> List[int]:
+        matches = []
+        lower = self._lower
+        by_name = self._by_name
+        i = bisect_left(by_name, term, key=lower.__getitem__)
+        while i < len(by_name) and len(matches) < limit:
+            slot = by_name[i]
+            if not lower[slot].startswith(term):
+                break
+            if self._visible(slot, mime_type, seen):
+                matches.append(slot)
+            i += 1
+        return matches
+
+    def _word_prefixes(self, term, mime_type, limit, seen) -> List[int]:
+        matches = []
+        seen = set(seen)
+        lower = self._lower
+        by_word = self._by_word
+        i = bisect_left(by_word, term, key=self._word)
+        while i < len(by_word) and len(matches) < limit:
+            code = by_word[i]
+            slot = code >> 8
+            if not lower[slot].startswith(term, code & 255):
+                break
+            if self._visible(slot, mime_type, seen):
+                seen.add(slot)
+                matches.append(slot)
+            i += 1
+        return matches
+
+    def _substrings(self, term, mime_type, limit, seen) -> List[int]:
+        if len(term) < 3:
+            return []
+        trigrams = _trigrams(term)
+        postings = [self._trigrams.get(t) for t in trigrams]
+        if not all(postings):
+            return []
+        candidates = min(postings, key=len)
+        if len(candidates) > SCAN_BUDGET:
+            matches = self._verify(
+                term, candidates[:SCAN_BUDGET], mime_type, limit, seen
+            )
+            if len(matches) < limit:
+                # Few names have all the trigrams: find the rest without
+                # going through the many that have only the rarest one
+                bitmap = reduce(and_, map(self._bitmap, trigrams))
+                rest = _set_bits(bitmap, candidates[SCAN_BUDGET - 1] + 1)
+                matches += self._verify(
+                    term, rest, mime_type, limit - len(matches), seen
+                )
+            return matches
+        return self._verify(term, candidates, mime_type, limit, seen)
+
+    def _verify(self, term, slots, mime_type, limit, seen) -> List[int]:
+        matches = []
+        lower = self._lower
+        for slot in slots:
+            if term in lower[slot] and self._visible(slot, mime_type, seen):
+                matches.append(slot)
+                if len(matches) >= limit:
+                    break
+        return matches
@@ -0,0 +1,18 @@
+"""
+The tests run the routers in process against the in-memory Google of the
+benchmarks, with the SQLite stores in a temporary directory.
+"""
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+_data = tempfile.mkdtemp()
+os.environ.setdefault("DRIVE_INDEX_PATH", os.path.join(_data, "index.sqlite3"))
+os.environ.setdefault("JOBS_PATH", os.path.join(_data, "jobs.sqlite3"))
+
+# Puts the repository ahead of benchmarks/ (which has a drive_index.py too)
+import harness  # noqa: E402, F401
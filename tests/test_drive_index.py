@@ -0,0 +1,100 @@
+import asyncio
+import json
+from urllib.parse import parse_qs, urlparse
+
+from harness import InMemoryHttp, create_app, request
+
+import api.drive
+from config import settings
+from drive_index import DriveSync, drive_index
+
+FOLDER = "application/vnd.google-apps.folder"
+DOC = "application/vnd.google-apps.document"
+USER = "benchmark"
+
+
+class FakeDrive:
+    """files.get/list and changes.list over a Drive of a few files."""
+
+    def __init__(self):
+        self.files = {"root-id": {"id": "root-id", "name": "My Drive"}}
+        self.changes = []
+        self.add("file-1", "Report")
+
+    def add(self, file_id: str, name: str) -> None:
+        self.files[file_id] = {
+            "id": file_id,
+            "name": name,
+            "mimeType": DOC,
+            "parents": ["root-id"],
+        }
+
+    def change(self, file_id: str, name: str) -> None:
+        self.add(file_id, name)
+        self.changes.append({"fileId": file_id, "file": self.files[file_id]})
+
+    def __call__(self, uri: str) -> bytes:
+        url = urlparse(uri)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        path = url.path.removeprefix("/drive/v3/")
+        if path == "changes/startPageToken":
+            data = {"startPageToken": str(len(self.changes))}
+        elif path == "changes":
+            data = {
+                "changes": self.changes[int(query["pageToken"]) :],
+                "newStartPageToken": str(len(self.changes)),
+            }
+        elif path.startswith("files/"):
+            file_id = path.removeprefix("files/")
+            data = self.files["root-id" if file_id == "root" else file_id]
+        else:
+            data = {"files": list(self.files.values())[1:]}
+        return json.dumps(data).encode()
+
+
+async def listed(app) -> set:
+    status, _, body = await request(app, "/drive/navigate/")
+    assert status == 200, body
+    return {item["id"] for item in json.loads(body)}
+
+
+async def built() -> None:
+    while await drive_index.root(USER) is None:
+        await asyncio.sleep(0.01)
+
+
+async def caught_up(sync: DriveSync) -> None:
+    while not await sync.current(USER):
+        await asyncio.sleep(0.01)
+
+
+async def stop(sync: DriveSync) -> None:
+    followers = list(sync._followers.values())
+    for task in followers:
+        task.cancel()
+    await asyncio.gather(*followers, return_exceptions=True)
+
+
+def test_restart_serves_google_until_caught_up(monkeypatch):
+    drive = FakeDrive()
+    monkeypatch.setattr(InMemoryHttp, "handler", drive)
+    monkeypatch.setattr(settings, "DRIVE_INDEX_ENABLED", True)
+    app = create_app(api.drive.router)
+
+    async def run():
+        first = DriveSync(drive_index)
+        monkeypatch.setattr(api.drive, "drive_sync", first)
+        assert await listed(app) == {"file-1"}
+        await built()
+        await stop(first)
+
+        # Changed in Drive while no task followed the user's changes
+        drive.change("file-2", "Report final")
+        restarted = DriveSync(drive_index)
+        monkeypatch.setattr(api.drive, "drive_sync", restarted)
+        assert await listed(app) == {"file-1", "file-2"}
+        await caught_up(restarted)
+        assert await listed(app) == {"file-1", "file-2"}
+        await stop(restarted)
+
+    asyncio.run(run())
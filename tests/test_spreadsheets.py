@@ -0,0 +1,45 @@
+import asyncio
+import json
+from urllib.parse import unquote, urlencode, urlparse
+
+from harness import InMemoryHttp, create_app, request
+
+import api.spreadsheets
+
+
+def write(range_: str) -> tuple:
+    """Writes one row from range_; returns the status and the ranges sent."""
+    ranges = []
+
+    def handler(uri: str) -> bytes:
+        ranges.append(unquote(urlparse(uri).path).split("/values/", 1)[1])
+        return b"{}"
+
+    InMemoryHttp.handler = handler
+    app = create_app(api.spreadsheets.router)
+    try:
+        status, _, _ = asyncio.run(
+            request(
+                app,
+                "/drive/spreadsheets/sheet-id/values",
+                urlencode({"range": range_}),
+                headers={"Content-Type": "text/csv"},
+                method="POST",
+                content=[b"a,b\n"],
+            )
+        )
+    finally:
+        InMemoryHttp.handler = None
+    return status, ranges
+
+
+def test_sheet_names_are_quoted():
+    assert write("2024") == (200, ["'2024'!A1"])
+    assert write("A1!") == (200, ["'A1!'!A1"])
+    assert write("Q1 'Sales'!B2") == (200, ["'Q1 ''Sales'''!B2"])
+    assert write("'Data'!C3:D") == (200, ["'Data'!C3"])
+
+
+def test_ranges_without_a_top_left_cell_are_refused():
+    for range_ in ("Data!A:C", "A:C", "Data!2:5"):
+        assert write(range_) == (400, [])
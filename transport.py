@@ -0,0 +1,120 @@
+import queue
+import threading
+import time
+
+import httplib2
+import requests
+from google.auth.transport.requests import Request as GoogleRequest
+from googleapiclient.http import build_http
+
+from config import settings
+
+
+class PooledHttp:
+    """
+    Thread-safe stand-in for httplib2.Http backed by a pool of them.
+
+    httplib2.Http keeps one persistent connection per host but must not be
+    used by two threads at once, so each request borrows an idle Http (the
+    most recently used first, whose connections are likeliest to be alive)
+    and returns it afterwards. At most size Http objects are created;
+    requests beyond that wait for one to be returned.
+    """
+
+    def __init__(self, size: int, keepalive: bool = True, idle_timeout: float = 60):
+        self.size = size
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        # Same defaults as the googleapiclient clients would have had
+        template = build_http()
+        self.timeout = template.timeout
+        self.redirect_codes = template.redirect_codes
+        self.follow_redirects = template.follow_redirects
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "reused": 0, "connected": 0, "expired": 0}
+
+    def _acquire(self) -> httplib2.Http:
+        try:
+            http, returned = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                return build_http()
+            http, returned = self._idle.get()
+        if time.monotonic() - returned > self.idle_timeout and http.connections:
+            # The server has likely dropped these; don't pay for finding out
+            self._close(http)
+            self._count("expired")
+        return http
+
+    def _release(self, http: httplib2.Http) -> None:
+        if not self.keepalive:
+            self._close(http)
+        self._idle.put((http, time.monotonic()))
+
+    @staticmethod
+    def _close(http: httplib2.Http) -> None:
+        for conn in http.connections.values():
+            conn.close()
+        http.connections.clear()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        http = self._acquire()
+        try:
+            http.timeout = self.timeout
+            http.redirect_codes = self.redirect_codes
+            http.follow_redirects = self.follow_redirects
+            scheme, authority, _, _ = httplib2.urlnorm(uri)
+            conn_key = f"{scheme}:{authority}"
+            conn = http.connections.get(conn_key)
+            sock = getattr(conn, "sock", None)
+            response = http.request(uri, method, body, headers, *args, **kwargs)
+            reused = sock is not None and getattr(conn, "sock", None) is sock
+            with self._lock:
+                self._stats["requests"] += 1
+                self._stats["reused" if reused else "connected"] += 1
+            return response
+        finally:
+            self._release(http)
+
+    def close(self) -> None:
+        """Kept open: the pool is shared by every client for the process."""
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pool_size"] = self.size
+            stats["created"] = self._created
+        stats["idle"] = self._idle.qsize()
+        stats["reuse_rate"] = (
+            stats["reused"] / stats["requests"] if stats["requests"] else None
+        )
+        return stats
+
+
+def _token_session() -> requests.Session:
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1, pool_maxsize=settings.GOOGLE_HTTP_POOL_SIZE
+    )
+    session.mount("https://", adapter)
+    return session
+
+
+# Every Drive/Docs/Sheets/Slides client sends through this pool
+google_http = PooledHttp(
+    settings.GOOGLE_HTTP_POOL_SIZE,
+    keepalive=settings.GOOGLE_HTTP_KEEPALIVE,
+    idle_timeout=settings.GOOGLE_HTTP_IDLE_TIMEOUT,
+)
+# Token refreshes share one requests session and its connection pool
+token_request = GoogleRequest(session=_token_session())